@@ -16,7 +16,7 @@ from Crypto.Hash import SHA256
 from Crypto.Protocol.KDF import HKDF
 from Crypto.PublicKey import ECC
 from Crypto.PublicKey.ECC import EccKey
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from .keyexchange import *
 
@@ -42,6 +42,7 @@ class EllipticCurveDiffieHellman(KeySystem):
 class ECDHPublicKey(PublicKey):
     def __init__(self, public_key: EccKey):
         self.public_key = public_key
+        self._fingerprint: Optional[bytes] = None
 
     def __eq__(self, other):
         if not isinstance(other, ECDHPublicKey):
@@ -60,6 +61,11 @@ class ECDHPublicKey(PublicKey):
     def serialize(self) -> bytes:
         return self.public_key.export_key(format='PEM').encode()
 
+    def fingerprint(self) -> bytes:
+        if self._fingerprint is None:
+            self._fingerprint = SHA256.new(self.serialize()).digest()
+        return self._fingerprint
+
     def __str__(self):
         return f"ECDHPublicKey({self.serialize().hex()})"
 
@@ -70,6 +76,7 @@ class ECDHPrivateKey(PrivateKey):
             self.private_key: EccKey = private_key
         else:
             self.private_key: EccKey = ECC.generate(curve=CURVE_NAME)
+        self._fingerprint: Optional[bytes] = None
 
     def __eq__(self, other):
         if not isinstance(other, ECDHPrivateKey):
@@ -90,6 +97,11 @@ class ECDHPrivateKey(PrivateKey):
     def serialize(self) -> bytes:
         return self.private_key.export_key(format='PEM').encode()
 
+    def fingerprint(self) -> bytes:
+        if self._fingerprint is None:
+            self._fingerprint = self.public_key().fingerprint()
+        return self._fingerprint
+
     def __str__(self):
         return f"ECDHPrivateKey({self.serialize().hex()})"
 
@@ -42,6 +42,10 @@ class PrivateKey:
     def serialize(self) -> bytes:
         pass
 
+    def fingerprint(self) -> bytes:
+        """A short digest identifying the public half of this key."""
+        pass
+
 
 class PublicKey:
     def generate_private(self) -> PrivateKey:
@@ -50,6 +54,10 @@ class PublicKey:
     def cbor(self) -> dict:
         pass
 
+    def fingerprint(self) -> bytes:
+        """A short digest identifying this key."""
+        pass
+
 
 class KeySystem:
     def generate_private(self) -> PrivateKey:
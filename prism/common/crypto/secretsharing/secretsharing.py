@@ -68,6 +68,9 @@ class SecretSharing(metaclass=ABCMeta):
     def reconstruct(self, shares: List[Share], iq: int = 0, mode: int = 0) -> int:
         pass
 
+    def reconstruct_all(self, share_sets: List[List[Share]], iq: int = 0) -> List[int]:
+        return [self.reconstruct(shares, iq=iq) for shares in share_sets]
+
     @property
     def chunk_size_bytes(self) -> int:
         """The carrying capacity of a single share when splitting a secret into chunks."""
@@ -12,13 +12,31 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import random
-from typing import List, Union
+from functools import lru_cache
+from typing import List, Union, Tuple
 
 from prism.common.crypto.secretsharing.secretsharing import SecretSharing
 from prism.common.message import SecretSharingMap, SecretSharingType, Share
 from prism.common.crypto.modmath import modinv
 
 
+@lru_cache(maxsize=1024)
+def lagrange_coefficients(x_points: Tuple[int, ...], ir: int, modulus: int) -> Tuple[int, ...]:
+    """The Lagrange coefficients for interpolating at ir from the given x points.
+
+    Committees reconstruct from the same few party sets over and over, so the results are memoized."""
+    coeffs = []
+    for i in x_points:
+        numerator = 1
+        denominator = 1
+        for j in x_points:
+            if i != j:
+                numerator = (numerator * (ir - j)) % modulus
+                denominator = (denominator * (i - j)) % modulus
+        coeffs.append((numerator * modinv(denominator, modulus)) % modulus)
+    return tuple(coeffs)
+
+
 class ShamirSS(SecretSharing):
 
     def __init__(self, nparties: int, threshold: int, modulus: int):
@@ -27,9 +45,10 @@ class ShamirSS(SecretSharing):
                              parties=nparties, threshold=threshold, modulus=modulus))
 
     def _P(self, coeffs: List[int], x) -> int:
+        modulus = self.modulus
         y = 0
-        for i, coeff in enumerate(coeffs):
-            y = (y + (coeff * (x ** i))) % self.modulus
+        for coeff in reversed(coeffs):
+            y = (y * x + coeff) % modulus
         return y
 
     def share(self, value: Union[int, Share], coeff_required: bool = False) -> List[Share]:
@@ -42,22 +61,21 @@ class ShamirSS(SecretSharing):
         return [Share(self._P(coeffs, i + 1), i) for i in range(self.nparties)]
 
     def _recoverCoefficients(self, x_points: List[int], ir: int) -> List[int]:
-        coeffs = []
-        for i in x_points:
-            result = 1
-            for j in x_points:
-                if i != j:
-                    result = (result * (ir - j) * modinv((i - j), self.modulus)) % self.modulus
-            coeffs.append(int(result))
-        return coeffs
+        return list(lagrange_coefficients(tuple(x_points), ir, self.modulus))
 
     def reconstruct(self, shares: List[Share], iq: int = 0, mode: int = 0) -> int:
-        x_points = [s.x + 1 for s in shares]  # points on X axis start from 1, not from 0 (like the peer indices)
-        coeff = self._recoverCoefficients(x_points, iq)
-        value = 0
-        for i in range(len(shares)):
-            value = (value + (coeff[i] * shares[i].share)) % self.modulus
-        return value
+        x_points = tuple(s.x + 1 for s in shares)  # points on X axis start from 1, not from 0 (like the peer indices)
+        coeff = lagrange_coefficients(x_points, iq, self.modulus)
+        return sum(c * s.share for c, s in zip(coeff, shares)) % self.modulus
+
+    def reconstruct_all(self, share_sets: List[List[Share]], iq: int = 0) -> List[int]:
+        """Reconstruct many secrets at once. Share sets held by the same parties reuse one set of coefficients."""
+        modulus = self.modulus
+        results = []
+        for shares in share_sets:
+            coeff = lagrange_coefficients(tuple(s.x + 1 for s in shares), iq, modulus)
+            results.append(sum(c * s.share for c, s in zip(coeff, shares)) % modulus)
+        return results
 
     def random_polynomial_root_at(self, iq: int) -> List[Share]:
         init_coeff = [random.randrange(1, self.modulus) for _ in range(self.threshold - 1)]
@@ -11,6 +11,7 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+from collections import OrderedDict
 from cbor2 import CBORDecodeError
 from Crypto.Cipher import AES
 import structlog
@@ -21,9 +22,63 @@ from prism.common.message import PrismMessage
 
 LOGGER = structlog.getLogger(__name__)
 
+# The maximum number of derived keys to keep in the shared key cache
+SHARED_KEY_CACHE_SIZE = 256
 
-def decrypt(encrypted_msg: PrismMessage, private_key: PrivateKey, pub_key: PublicKey = None) -> Optional[PrismMessage]:
-    plaintext = decrypt_data(encrypted_msg, private_key=private_key, pub_key=pub_key)
+
+class SharedKeyCache:
+    """
+    A bounded LRU cache of symmetric keys derived by key exchange between a long-lived local private key and a
+    long-lived peer public key (such as the epoch keys of MPC peers), keyed by the fingerprints of both keys.
+    Keys derived from an epoch's private key should be forgotten when that epoch shuts down.
+    """
+
+    def __init__(self, max_size: int = SHARED_KEY_CACHE_SIZE):
+        self.max_size = max_size
+        self._keys: OrderedDict[Tuple[bytes, bytes], bytes] = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def exchange(self, private_key: PrivateKey, public_key: PublicKey) -> bytes:
+        cache_key = (private_key.fingerprint(), public_key.fingerprint())
+        key = self._keys.get(cache_key)
+        if key is not None:
+            self._keys.move_to_end(cache_key)
+            return key
+
+        key = private_key.exchange(public_key, b'')
+        self._keys[cache_key] = key
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return key
+
+    def forget(self, private_key: PrivateKey):
+        """Drop all keys derived from the given local private key."""
+        local_fingerprint = private_key.fingerprint()
+        for cache_key in [k for k in self._keys if k[0] == local_fingerprint]:
+            del self._keys[cache_key]
+
+    def clear(self):
+        self._keys.clear()
+
+
+SHARED_KEYS = SharedKeyCache()
+
+
+def _shared_key(private_key: PrivateKey, public_key: PublicKey, cache_key: bool) -> bytes:
+    if cache_key:
+        return SHARED_KEYS.exchange(private_key, public_key)
+    return private_key.exchange(public_key, b'')
+
+
+def decrypt(
+        encrypted_msg: PrismMessage,
+        private_key: PrivateKey,
+        pub_key: PublicKey = None,
+        cache_key: bool = False,
+) -> Optional[PrismMessage]:
+    plaintext = decrypt_data(encrypted_msg, private_key=private_key, pub_key=pub_key, cache_key=cache_key)
     if plaintext is not None:
         try:
             return PrismMessage.decode(plaintext)
@@ -36,13 +91,24 @@ def decrypt(encrypted_msg: PrismMessage, private_key: PrivateKey, pub_key: Publi
     return None
 
 
-def decrypt_data(encrypted_msg: PrismMessage, private_key: PrivateKey, pub_key: PublicKey = None) -> Optional[bytes]:
+def decrypt_data(
+        encrypted_msg: PrismMessage,
+        private_key: PrivateKey,
+        pub_key: PublicKey = None,
+        cache_key: bool = False,
+) -> Optional[bytes]:
+    """
+    Decrypt the ciphertext of the given message. If cache_key is set, the key derived from the given key pair is
+    cached in SHARED_KEYS, which should only be used for long-lived keys on both sides.
+    """
     if encrypted_msg.half_key:
         pub_key = KeySystem.load_public(encrypted_msg.half_key.as_cbor_dict())
+        # one-off half keys are not worth caching
+        cache_key = False
 
     if pub_key and encrypted_msg.ciphertext and encrypted_msg.nonce:
         try:
-            key = private_key.exchange(pub_key, b'')
+            key = _shared_key(private_key, pub_key, cache_key)
             aes = AES.new(key, AES.MODE_GCM, encrypted_msg.nonce)
             return aes.decrypt(encrypted_msg.ciphertext)
         except (ValueError, KeyError):
@@ -52,11 +118,27 @@ def decrypt_data(encrypted_msg: PrismMessage, private_key: PrivateKey, pub_key:
     return None
 
 
-def encrypt(message: PrismMessage, private_key: PrivateKey, peer_key: PublicKey, nonce: bytes) -> bytes:
-    return encrypt_data(message.encode(), private_key, peer_key, nonce)
+def encrypt(
+        message: PrismMessage,
+        private_key: PrivateKey,
+        peer_key: PublicKey,
+        nonce: bytes,
+        cache_key: bool = False,
+) -> bytes:
+    return encrypt_data(message.encode(), private_key, peer_key, nonce, cache_key)
 
 
-def encrypt_data(plaintext: bytes, private_key: PrivateKey, peer_key: PublicKey, nonce: bytes) -> bytes:
-    key = private_key.exchange(peer_key, b'')
+def encrypt_data(
+        plaintext: bytes,
+        private_key: PrivateKey,
+        peer_key: PublicKey,
+        nonce: bytes,
+        cache_key: bool = False,
+) -> bytes:
+    """
+    Encrypt plaintext with the key derived from the given key pair. If cache_key is set, the derived key is cached in
+    SHARED_KEYS, which should only be used for long-lived keys on both sides.
+    """
+    key = _shared_key(private_key, peer_key, cache_key)
     aes = AES.new(key, AES.MODE_GCM, nonce)
     return aes.encrypt(plaintext)
@@ -13,59 +13,113 @@
 #  limitations under the License.
 
 # Message seen storage for de-duplication:
-# - create a unique key for each message seen using PREFIX:<message-hash>
+# - create a unique 16-byte key for each message seen from the message digest, and any debug info it carries
 # - keys are expiring with configurable TTL (which gets reset when checking)
-# - purging of expired entries happens upon checking (to stay synchronous)
+# - keys are kept in buckets of msg_seen_sleep seconds by expiration time, so that purging only visits expired buckets
+# - at most msg_seen_max keys are kept, evicting the least recently seen ones first
 
 import hashlib
+import heapq
 import math
-from typing import Union
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Union
 
+import cbor2
 import structlog
 import time
 import trio
 
-from prism.common.message import PrismMessage
+from prism.common.message import LazyPrismMessage, PrismMessage
+
+KEY_BYTES = 16
 
 
 class MessageDeduplicator:
 
     def __init__(self, configuration) -> None:
         self._configuration = configuration
-        self._database = {}
+        # key -> expiration bucket, or None if kept forever; in order of last sighting
+        self._database: OrderedDict[bytes, Optional[int]] = OrderedDict()
+        self._buckets: Dict[int, Set[bytes]] = {}
+        self._bucket_heap: List[int] = []
+        self._bucket_width = max(configuration.msg_seen_sleep, 1.0)
         self._warn_once = True
         self._logger = structlog.getLogger(__name__)
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._database)
+
+    @staticmethod
+    def key(msg: Union[PrismMessage, LazyPrismMessage, bytes]) -> bytes:
+        if isinstance(msg, (PrismMessage, LazyPrismMessage)):
+            if msg.debug_info is None:
+                return msg.digest()[:KEY_BYTES]
+            # the digest leaves out debug info, but copies that only differ in their debug info are still distinct
+            debug_info = cbor2.dumps(msg.debug_info.as_cbor_dict())
+            return hashlib.blake2b(msg.digest() + debug_info, digest_size=KEY_BYTES).digest()
+        return hashlib.blake2b(msg, digest_size=KEY_BYTES).digest()
 
-    def is_msg_new(self, msg: Union[PrismMessage, bytes]) -> bool:
+    def is_msg_new(self, msg: Union[PrismMessage, LazyPrismMessage, bytes]) -> bool:
         if not msg:
             return True
 
-        if isinstance(msg, PrismMessage):
-            data = msg.encode()
+        key = self.key(msg)
+        now = time.monotonic()
+        # does key exist?  in either case, add it with updated or new TTL:
+        if key in self._database:
+            bucket = self._database.pop(key)
+            new = bucket is not None and bucket * self._bucket_width <= now
+            if bucket is not None:
+                self._buckets[bucket].discard(key)
         else:
-            data = msg
+            new = True
 
-        msg_hash = hashlib.sha256(data).hexdigest()
-        # hash message to create a unique key:
-        # key = f'MessageSeen:{hashlib.sha256(msg.clone(debug_info=None).encode()).hexdigest()}'
-        key = f'MessageSeen:{msg_hash}'
-        # does key exist?  in either case, add it with updated or new TTL:
-        expiration_time = self._database.get(key, 0.0)
-        now = time.time()
         # if TTL <= 0 then keep forever (= memory leak and WARN once)
         ttl = self._configuration.msg_seen_ttl
-        if ttl <= 0 and self._warn_once:
-            self._logger.warning(f'Keeping a record FOREVER - possible memory leak!')
-            self._warn_once = False
-        self._database[key] = now + ttl if ttl > 0 else math.inf
-        return expiration_time < now
+        if ttl <= 0:
+            if self._warn_once:
+                self._logger.warning(f'Keeping a record FOREVER - possible memory leak!')
+                self._warn_once = False
+            self._database[key] = None
+        else:
+            bucket = math.ceil((now + ttl) / self._bucket_width)
+            self._database[key] = bucket
+            if bucket not in self._buckets:
+                self._buckets[bucket] = set()
+                heapq.heappush(self._bucket_heap, bucket)
+            self._buckets[bucket].add(key)
+
+        self._evict(self._configuration.msg_seen_max)
+        return new
+
+    def _evict(self, limit: int):
+        """Forgets the least recently seen keys until there are at most limit (if positive)."""
+        while 0 < limit < len(self._database):
+            key, bucket = self._database.popitem(last=False)
+            if bucket is not None:
+                self._buckets[bucket].discard(key)
+            self.evicted += 1
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Removes all keys whose expiration bucket has passed and returns how many there were."""
+        if now is None:
+            now = time.monotonic()
+        current = math.floor(now / self._bucket_width)
+
+        purged = 0
+        while self._bucket_heap and self._bucket_heap[0] <= current:
+            bucket = heapq.heappop(self._bucket_heap)
+            for key in self._buckets.pop(bucket, ()):
+                del self._database[key]
+                purged += 1
+        self.expired += purged
+        return purged
 
     async def purge_task(self):
-        self._logger.debug(f"Starting loop to purge expired messages seen every {self._configuration.msg_seen_sleep}s")
+        self._logger.debug(f"Starting loop to purge expired messages seen every {self._bucket_width}s")
         while True:
             # remove all data base entries that have expired
-            now = time.time()
-            to_be_purged = [k for k, expires in self._database.items() if expires <= now]
-            for key in to_be_purged:
-                self._database.pop(key, None)
-            await trio.sleep(self._configuration.msg_seen_sleep)
+            self.purge()
+            await trio.sleep(self._bucket_width)
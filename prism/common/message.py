@@ -25,10 +25,12 @@
 # that gives a much more concise implementation of an immutable data structure.
 from base64 import b64encode, b64decode
 import cbor2
-from dataclasses import dataclass, field, MISSING
+from dataclasses import dataclass, field, MISSING, replace
 from enum import IntEnum, unique
+from functools import cached_property
 import hashlib
 from inspect import isclass
+import math
 from ipaddress import ip_address
 import os
 import sys
@@ -42,12 +44,22 @@ COMMENT = 'comment'
 
 @unique
 class MyIntEnum(IntEnum):
-    pass
+    """Integer enumeration with human-readable labels.
+    Every subclass registers the labels of its members with _label_members() once it is defined, so that str() and
+    the reverse lookup are single dictionary lookups."""
+
+    def __str__(self):
+        return self._labels[self]
 
     def __format__(self, format_spec):
         # override this until we upgraded to Python 3.8, which should have this issue fixed:
         # https://bugs.python.org/issue37479
-        return f"{str(self):{format_spec}}"
+        return f"{self._labels[self]:{format_spec}}"
+
+    @classmethod
+    def lookup(cls, key: Union[int, str]):
+        """Find a member by value, name or label, raising a KeyError if there is none."""
+        return cls._lookup[key]
 
     @classmethod
     def to_latex(cls, fp=sys.stdout):
@@ -55,6 +67,19 @@ class MyIntEnum(IntEnum):
             print(f'{member.value} & {member} \\tabularnewline', file=fp)
 
 
+def _label_members(cls: Type[MyIntEnum], labels: Dict[MyIntEnum, str], unknown: str = "UNKNOWN {cls} ({name})"):
+    """Precompute the label of every member of cls, using the unknown format for those not given in labels,
+    along with the table to look members up by value, name or label."""
+    cls._labels = {member: labels.get(member) or unknown.format(cls=cls.__name__, name=member.name) for member in cls}
+    lookup = {}
+    for member in cls:
+        lookup[member.value] = member
+        lookup[member.name] = member
+    for member, label in cls._labels.items():
+        lookup.setdefault(label, member)
+    cls._lookup = lookup
+
+
 class TypeEnum(MyIntEnum):
     USER_MESSAGE = 0
     ENCRYPT_EMIX_MESSAGE = 1
@@ -104,143 +129,145 @@ class TypeEnum(MyIntEnum):
     LSP_FWD_ADDR = 45
     ENC_LSP_FWD_ADDR = 46
     LSP_FWD_ADDR_ACK = 47
-
-    def __str__(self):
-        if self == self.USER_MESSAGE:
-            return "User Message"
-        if self == self.ENCRYPT_EMIX_MESSAGE:
-            return "Encrypted Emix Message"
-        if self == self.SEND_TO_DROPBOX:
-            return "Send to Dropbox"
-        if self == self.READ_DROPBOX:
-            return "Read Dropbox"
-        if self == self.ANNOUNCE_ROLE_KEY:
-            return "Announcement of Role and Keys (ARK)"
-        if self == self.ARK_RESPONSE:
-            return "ARK Response"
-        if self == self.ENCRYPT_USER_MESSAGE:
-            return "Encrypted User Message"
-        if self == self.ENCRYPT_DROPBOX_MESSAGE:
-            return "Encrypted Dropbox Message"
-        if self == self.WRITE_DROPBOX:
-            return "Write Dropbox"
-        if self == self.READ_DROPBOX_RECIPIENTS:
-            return "Read Dropbox Recipients"
-        if self == self.READ_SELECTED_DROPBOX_MESSAGES:
-            return "Read Selected Dropbox Messages"
-        if self == self.DROPBOX_RECIPIENTS:
-            return "Dropbox Recipients"
-        if self == self.SEND_TO_EMIX:
-            return "Send To Emix"
-        if self == self.ENCRYPT_DROPBOX_RECIPIENTS:
-            return "Encrypted Dropbox Recipients Message"
-        if self == self.MPC_REQUEST:
-            return "MPC Request"
-        if self == self.MPC_RESPONSE:
-            return "MPC Response"
-        if self == self.WRITE_OBLIVIOUS_DROPBOX:
-            return "Write Oblivious Dropbox"
-        if self == self.READ_OBLIVIOUS_DROPBOX:
-            return "Read Oblivious Dropbox"
-        if self == self.READ_OBLIVIOUS_DROPBOX_RESPONSE:
-            return "Read Oblivious Dropbox Response"
-        if self == self.ENCRYPTED_READ_OBLIVIOUS_DROPBOX_RESPONSE:
-            return "Encrypted Read Oblivious Dropbox Response"
-        if self == self.MESSAGE_FRAGMENT:
-            return "Message Fragment"
-        if self == self.ENCRYPTED_MESSAGE_FRAGMENT:
-            return "Encrypted Message Fragment"
-        if self == self.ENCRYPT_PEER_MESSAGE:
-            return "Encrypted Peer Message"
-        if self == self.MPC_HELLO:
-            return "MPC Hello"
-        if self == self.LSP:
-            return "LSP"
-        if self == self.LSP_ACK:
-            return "LSP Ack"
-        if self == self.LSP_DATABASE_REQUEST:
-            return "LSP Database Request"
-        if self == self.LSP_DATABASE_RESPONSE:
-            return "LSP Database Response"
-        if self == self.LSP_HELLO:
-            return "LSP Hello"
-        if self == self.LSP_HELLO_RESPONSE:
-            return "LSP Hello Response"
-        if self == self.MPC_ACK:
-            return "MPC ACK"
-        if self == self.ARKS:
-            return "ARKs"
-        if self == self.LSP_FWD:
-            return "LSP Forwarding"
-        if self == self.MPC_HELLO_RESPONSE:
-            return "MPC Hello Response"
-        if self == self.NARK:
-            return "NARK"
-        if self == self.CLIENT_REGISTRATION_REQUEST:
-            return "Client Registration Request"
-        if self == self.CLIENT_REGISTRATION_RESPONSE:
-            return "Client Registration Response"
-        if self == self.FLOOD_MSG:
-            return "Flooding PRISM Message"
-        if self == self.EPOCH_ARK:
-            return "Epoch ARK"
-        if self == self.ENCRYPT_LINK_REQUEST:
-            return "Encrypted Link Request"
-        if self == self.LINK_REQUEST:
-            return "Link Request"
-        if self == self.LINK_REQUEST_ACK:
-            return "Link Request ACK"
-        if self == self.EPOCH_ARK_WRAPPER:
-            return "Epoch ARK (wrapped)"
-        if self == self.LSP_FLOOD:
-            return "Flood"
-
-        return f"UNKNOWN {self.__class__.__name__} ({self.name})"
+    MPC_BATCH = 48
 
     def create(self, **kv):
         return PrismMessage(msg_type=self, **kv)
 
+    @property
+    def is_control(self) -> bool:
+        """Link-state routing and link establishment traffic between servers."""
+        return self in CONTROL_TYPES
+
+    @property
+    def is_mpc(self) -> bool:
+        return self in MPC_TYPES
+
+    @property
+    def is_ark(self) -> bool:
+        return self in ARK_TYPES
+
+    @property
+    def is_client(self) -> bool:
+        """Messages that a client sends or receives."""
+        return self in CLIENT_TYPES
+
+    @property
+    def is_encrypted(self) -> bool:
+        return self in ENCRYPTED_TYPES
+
+
+_label_members(TypeEnum, {
+    TypeEnum.USER_MESSAGE: "User Message",
+    TypeEnum.ENCRYPT_EMIX_MESSAGE: "Encrypted Emix Message",
+    TypeEnum.SEND_TO_DROPBOX: "Send to Dropbox",
+    TypeEnum.READ_DROPBOX: "Read Dropbox",
+    TypeEnum.ANNOUNCE_ROLE_KEY: "Announcement of Role and Keys (ARK)",
+    TypeEnum.ARK_RESPONSE: "ARK Response",
+    TypeEnum.ENCRYPT_USER_MESSAGE: "Encrypted User Message",
+    TypeEnum.ENCRYPT_DROPBOX_MESSAGE: "Encrypted Dropbox Message",
+    TypeEnum.WRITE_DROPBOX: "Write Dropbox",
+    TypeEnum.READ_DROPBOX_RECIPIENTS: "Read Dropbox Recipients",
+    TypeEnum.READ_SELECTED_DROPBOX_MESSAGES: "Read Selected Dropbox Messages",
+    TypeEnum.DROPBOX_RECIPIENTS: "Dropbox Recipients",
+    TypeEnum.SEND_TO_EMIX: "Send To Emix",
+    TypeEnum.ENCRYPT_DROPBOX_RECIPIENTS: "Encrypted Dropbox Recipients Message",
+    TypeEnum.MPC_REQUEST: "MPC Request",
+    TypeEnum.MPC_RESPONSE: "MPC Response",
+    TypeEnum.WRITE_OBLIVIOUS_DROPBOX: "Write Oblivious Dropbox",
+    TypeEnum.READ_OBLIVIOUS_DROPBOX: "Read Oblivious Dropbox",
+    TypeEnum.READ_OBLIVIOUS_DROPBOX_RESPONSE: "Read Oblivious Dropbox Response",
+    TypeEnum.ENCRYPTED_READ_OBLIVIOUS_DROPBOX_RESPONSE: "Encrypted Read Oblivious Dropbox Response",
+    TypeEnum.MESSAGE_FRAGMENT: "Message Fragment",
+    TypeEnum.ENCRYPTED_MESSAGE_FRAGMENT: "Encrypted Message Fragment",
+    TypeEnum.ENCRYPT_PEER_MESSAGE: "Encrypted Peer Message",
+    TypeEnum.MPC_HELLO: "MPC Hello",
+    TypeEnum.LSP: "LSP",
+    TypeEnum.LSP_ACK: "LSP Ack",
+    TypeEnum.LSP_DATABASE_REQUEST: "LSP Database Request",
+    TypeEnum.LSP_DATABASE_RESPONSE: "LSP Database Response",
+    TypeEnum.LSP_HELLO: "LSP Hello",
+    TypeEnum.LSP_HELLO_RESPONSE: "LSP Hello Response",
+    TypeEnum.MPC_ACK: "MPC ACK",
+    TypeEnum.ARKS: "ARKs",
+    TypeEnum.LSP_FWD: "LSP Forwarding",
+    TypeEnum.MPC_HELLO_RESPONSE: "MPC Hello Response",
+    TypeEnum.NARK: "NARK",
+    TypeEnum.CLIENT_REGISTRATION_REQUEST: "Client Registration Request",
+    TypeEnum.CLIENT_REGISTRATION_RESPONSE: "Client Registration Response",
+    TypeEnum.FLOOD_MSG: "Flooding PRISM Message",
+    TypeEnum.EPOCH_ARK: "Epoch ARK",
+    TypeEnum.ENCRYPT_LINK_REQUEST: "Encrypted Link Request",
+    TypeEnum.LINK_REQUEST: "Link Request",
+    TypeEnum.LINK_REQUEST_ACK: "Link Request ACK",
+    TypeEnum.EPOCH_ARK_WRAPPER: "Epoch ARK (wrapped)",
+    TypeEnum.LSP_FLOOD: "Flood",
+    TypeEnum.MPC_BATCH: "MPC Batch",
+}, unknown="UNKNOWN TypeEnum ({name})")
+
+CONTROL_TYPES = frozenset({
+    TypeEnum.LSP, TypeEnum.LSP_ACK, TypeEnum.LSP_DATABASE_REQUEST, TypeEnum.LSP_DATABASE_RESPONSE,
+    TypeEnum.LSP_HELLO, TypeEnum.LSP_HELLO_RESPONSE, TypeEnum.LSP_FWD, TypeEnum.LSP_FLOOD, TypeEnum.LSP_FWD_ADDR,
+    TypeEnum.ENC_LSP_FWD_ADDR, TypeEnum.LSP_FWD_ADDR_ACK, TypeEnum.FLOOD_MSG, TypeEnum.LINK_REQUEST,
+    TypeEnum.ENCRYPT_LINK_REQUEST, TypeEnum.LINK_REQUEST_ACK,
+})
+MPC_TYPES = frozenset({
+    TypeEnum.MPC_REQUEST, TypeEnum.MPC_RESPONSE, TypeEnum.MPC_HELLO, TypeEnum.MPC_HELLO_RESPONSE, TypeEnum.MPC_ACK,
+    TypeEnum.MPC_BATCH,
+})
+ARK_TYPES = frozenset({
+    TypeEnum.ANNOUNCE_ROLE_KEY, TypeEnum.ARK_RESPONSE, TypeEnum.ARKS, TypeEnum.NARK, TypeEnum.EPOCH_ARK,
+    TypeEnum.EPOCH_ARK_WRAPPER,
+})
+CLIENT_TYPES = frozenset({
+    TypeEnum.USER_MESSAGE, TypeEnum.ENCRYPT_USER_MESSAGE, TypeEnum.SEND_TO_EMIX, TypeEnum.ENCRYPT_EMIX_MESSAGE,
+    TypeEnum.SEND_TO_DROPBOX, TypeEnum.ENCRYPT_DROPBOX_MESSAGE, TypeEnum.READ_DROPBOX, TypeEnum.WRITE_DROPBOX,
+    TypeEnum.WRITE_OBLIVIOUS_DROPBOX, TypeEnum.READ_OBLIVIOUS_DROPBOX,
+    TypeEnum.ENCRYPTED_READ_OBLIVIOUS_DROPBOX_RESPONSE,
+    TypeEnum.MESSAGE_FRAGMENT, TypeEnum.ENCRYPTED_MESSAGE_FRAGMENT, TypeEnum.CLIENT_REGISTRATION_REQUEST,
+    TypeEnum.CLIENT_REGISTRATION_RESPONSE, TypeEnum.ENCRYPT_REGISTRATION_MESSAGE,
+})
+ENCRYPTED_TYPES = frozenset(t for t in TypeEnum if t.name.startswith(("ENCRYPT", "ENC_")))
+
 
 class CipherEnum(MyIntEnum):
     AES_GCM = 0
 
-    def __str__(self):
-        if self == self.AES_GCM:
-            return "AES-GCM"
-        return f"UNKNOWN {self.__class__.__name__}"
+
+_label_members(CipherEnum, {
+    CipherEnum.AES_GCM: "AES-GCM",
+}, unknown="UNKNOWN CipherEnum")
 
 
 class MessageKeyEncryptionTypeEnum(MyIntEnum):
     IBE_SCHEME = 0
 
-    def __str__(self):  # TODO
-        if self == self.IBE_SCHEME:
-            return "IBE Scheme"
-        return f"UNKNOWN {self.__class__.__name__}"
+
+_label_members(MessageKeyEncryptionTypeEnum, {
+    MessageKeyEncryptionTypeEnum.IBE_SCHEME: "IBE Scheme",
+}, unknown="UNKNOWN MessageKeyEncryptionTypeEnum")
 
 
 class HalfKeyTypeEnum(MyIntEnum):
     DIFFIE_HELLMAN = 0
     ECDH = 1
 
-    def __str__(self):
-        if self == self.DIFFIE_HELLMAN:
-            return "Diffie-Hellman"
-        elif self == self.ECDH:
-            return "Elliptic Curve Diffie-Hellman"
-        return f"UNKNOWN {self.__class__.__name__}"
+
+_label_members(HalfKeyTypeEnum, {
+    HalfKeyTypeEnum.DIFFIE_HELLMAN: "Diffie-Hellman",
+    HalfKeyTypeEnum.ECDH: "Elliptic Curve Diffie-Hellman",
+}, unknown="UNKNOWN HalfKeyTypeEnum")
 
 
 class DropboxModeType(MyIntEnum):
     SINGLE_SERVER = 0
     MPC_COMMITTEE = 1
 
-    def __str__(self):
-        if self == self.MPC_COMMITTEE:
-            return "MPC"
-        if self == self.SINGLE_SERVER:
-            return "single server"
-        return f"UNKNOWN {self.__class__.__name__}"
+
+_label_members(DropboxModeType, {
+    DropboxModeType.MPC_COMMITTEE: "MPC",
+    DropboxModeType.SINGLE_SERVER: "single server",
+}, unknown="UNKNOWN DropboxModeType")
 
 
 class SecretSharingType(MyIntEnum):
@@ -248,14 +275,12 @@ class SecretSharingType(MyIntEnum):
     FELDMAN = 1
     FULL = 2
 
-    def __str__(self):
-        if self == self.SHAMIR:
-            return "Shamir"
-        if self == self.FELDMAN:
-            return "Feldman"
-        if self == self.FULL:
-            return "Full Threshold"
-        return f"UNKNOWN {self.__class__.__name__}"
+
+_label_members(SecretSharingType, {
+    SecretSharingType.SHAMIR: "Shamir",
+    SecretSharingType.FELDMAN: "Feldman",
+    SecretSharingType.FULL: "Full Threshold",
+}, unknown="UNKNOWN SecretSharingType")
 
 
 class ActionEnum(MyIntEnum):
@@ -300,13 +325,129 @@ class ActionEnum(MyIntEnum):
     ACTION_MULM_BGW_OPEN = 39
     ACTION_HELLO = 40
 
-    def __str__(self):
-        return self.name.replace("ACTION_", "").lower()
-
     def __repr__(self):
         return str(self)
 
 
+_label_members(ActionEnum, {action: action.name.replace("ACTION_", "").lower() for action in ActionEnum})
+
+
+# -- precompiled codec tables for the data classes below:
+
+# field kinds used by the codec tables:
+_PLAIN = "plain"  # copy value as is (or convert with field type when decoding)
+_ENUM = "enum"  # IntEnum subclass: cast to int when encoding
+_NESTED = "nested"  # CBORFactory subclass: recurse into nested dictionary
+_LIST = "list"  # List of plain values: copy
+_LIST_NESTED = "list_nested"  # List of CBORFactory subclasses: recurse into each element
+_LIST_TUPLE = "list_tuple"  # List of tuples: restore tuples from CBOR arrays
+
+# exact value types that are copied verbatim into a CBOR dictionary
+_VERBATIM_TYPES = frozenset([int, str, bytes, bool, float])
+
+
+def cbor_header_size(argument: int) -> int:
+    """The number of bytes CBOR uses to encode the initial byte and argument of a data item, such as the length of
+    a byte string or array, or the value of an unsigned integer."""
+    if argument < 24:
+        return 1
+    elif argument < 2 ** 8:
+        return 2
+    elif argument < 2 ** 16:
+        return 3
+    elif argument < 2 ** 32:
+        return 5
+    else:
+        return 9
+
+
+def _cbor_size(value) -> int:
+    """The number of bytes cbor2.dumps() produces for the given value, as it appears in as_cbor_dict()."""
+    if value is None or value is True or value is False:
+        return 1
+    if isinstance(value, CBORFactory):
+        return value.data_size()
+    if isinstance(value, int):
+        if value < 0:
+            value = -1 - value
+        if value < 2 ** 64:
+            return cbor_header_size(value)
+        # bignum: tag followed by a byte string of the magnitude
+        length = (value.bit_length() + 7) // 8
+        return 1 + cbor_header_size(length) + length
+    if isinstance(value, (bytes, bytearray)):
+        return cbor_header_size(len(value)) + len(value)
+    if isinstance(value, str):
+        length = len(value) if value.isascii() else len(value.encode("utf-8"))
+        return cbor_header_size(length) + length
+    if isinstance(value, (list, tuple)):
+        return cbor_header_size(len(value)) + sum(_cbor_size(x) for x in value)
+    if isinstance(value, float) and value == value and abs(value) != math.inf:
+        return 9
+    # anything else (NaN, infinities, dictionaries...) is rare enough to simply encode
+    return len(cbor2.dumps(value))
+
+
+def _resolve_factory(target) -> Type["CBORFactory"]:
+    # generic CBORFactory fields name their class in the metadata, which may be defined after the field
+    return globals()[target] if isinstance(target, str) else target
+
+
+def _factory_target(field_type, metadata) -> Union[Type["CBORFactory"], str]:
+    if field_type is CBORFactory:
+        if 'cls' not in metadata:
+            raise TypeError("cannot create generic CBORFactory, need subclass metadata")
+        # use metadata information to generate class object:
+        return metadata['cls']
+    return field_type
+
+
+class _CodecTable:
+    """
+    Field-index and type-converter tables of one CBORFactory subclass.
+    Built once per class from the dataclass fields so that encoding and decoding do not need to reflect over
+    `__dataclass_fields__` for every message.
+    """
+
+    def __init__(self, cls):
+        self.field_indices: Dict[str, int] = {}
+        # (index, name, kind) for every field:
+        self.encoders: List[Tuple[int, str, str]] = []
+        # (index, name, kind, target) for every field that is part of __init__():
+        self.decoders: List[Tuple[int, str, str, Any]] = []
+        # name -> (kind, target) for every field that is part of __init__():
+        self.init_fields: Dict[str, Tuple[str, Any]] = {}
+
+        for index, feld in enumerate(cls.__dataclass_fields__.values()):
+            self.field_indices[feld.name] = index
+            kind, target = self._classify(feld)
+            self.encoders.append((index, feld.name, kind))
+            if feld.init:  # field is part of __init__() implementation
+                self.decoders.append((index, feld.name, kind, target))
+                self.init_fields[feld.name] = (kind, target)
+
+    @staticmethod
+    def _classify(feld) -> Tuple[str, Any]:
+        field_type = feld.type
+        if isclass(field_type):
+            if issubclass(field_type, CBORFactory):
+                return _NESTED, _factory_target(field_type, feld.metadata)
+            if issubclass(field_type, IntEnum):
+                return _ENUM, field_type
+            return _PLAIN, field_type
+
+        # TODO: Python 3.8 has more inspection capabilities here!
+        #  see: https://stackoverflow.com/a/50101934/3816489
+        args = getattr(field_type, "__args__", None)
+        if getattr(field_type, "__origin__", None) is not list or not args:
+            return _PLAIN, field_type
+        if isclass(args[0]) and issubclass(args[0], CBORFactory):
+            return _LIST_NESTED, _factory_target(args[0], feld.metadata)
+        if getattr(args[0], "__origin__", None) is tuple:
+            return _LIST_TUPLE, None
+        return _LIST, None
+
+
 # -- base class for all custom, possibly nested data classes:
 
 @dataclass(frozen=True)
@@ -339,37 +480,77 @@ class CBORFactory:
         else:
             return val
 
-    def as_cbor_dict(self) -> Dict:
-        """Create a CBOR dictionary from this data structure using the order of the fields as keys/indices"""
+    def as_cbor_dict(self, exclude: Container[str] = ()) -> Dict:
+        """Create a CBOR dictionary from this data structure using the order of the fields as keys/indices,
+           leaving out the top-level fields named in exclude"""
 
         result = {}
-        for index, dc_field in enumerate(self.__dataclass_fields__.values()):
-            if self.__getattribute__(dc_field.name) is not None:
-                # distinguish these cases with actions:
-                # 1) CBOR Factory subclasses => recurse into them
-                # 2) IntEnum => cast to int
-                # 3) List => if element is CBOR Factory subclass then recurse into them, else simply copy
-                # 4) all other cases => simply copy value from ordered dict representation
-                if issubclass(dc_field.type if isclass(dc_field.type) else dc_field.type.__class__, CBORFactory):
-                    result[index] = self.__getattribute__(dc_field.name).as_cbor_dict()
-                elif isinstance(self.__getattribute__(dc_field.name), IntEnum):
-                    result[index] = int(self.__getattribute__(dc_field.name))
-                elif isinstance(self.__getattribute__(dc_field.name), List):
-                    result[index] = [x.as_cbor_dict() if isinstance(x, CBORFactory) else x
-                                     for x in self.__getattribute__(dc_field.name)]
+        for index, name, kind in self._codec_table().encoders:
+            value = getattr(self, name)
+            if value is None or name in exclude:
+                continue
+            # distinguish these cases with actions:
+            # 1) CBOR Factory subclasses => recurse into them
+            # 2) IntEnum => cast to int
+            # 3) List => if element is CBOR Factory subclass then recurse into them, else simply copy
+            # 4) all other cases => simply copy value from ordered dict representation
+            if kind is _PLAIN:
+                if value.__class__ in _VERBATIM_TYPES:
+                    result[index] = value
+                elif isinstance(value, IntEnum):
+                    result[index] = int(value)
+                elif isinstance(value, list):
+                    result[index] = [x.as_cbor_dict() if isinstance(x, CBORFactory) else x for x in value]
                 # REMINDER: don't attempt to have Dict here!
                 else:
-                    result[index] = self.__getattribute__(dc_field.name)  # just copy value
+                    result[index] = value  # just copy value
+            elif kind is _NESTED:
+                result[index] = value.as_cbor_dict()
+            elif kind is _ENUM:
+                result[index] = int(value)
+            elif isinstance(value, list):  # kind is _LIST
+                result[index] = [x.as_cbor_dict() if isinstance(x, CBORFactory) else x for x in value]
+            else:
+                result[index] = value
         return result
 
     def clone(self, **kwargs):
-        d = self.as_cbor_dict()
-        for key, value in kwargs.items():
-            index = self.lookup_field_index(key)
-            if index is None:
+        """
+        Create a copy of this instance with the given fields replaced.
+        Untouched field values, including nested CBORFactory instances and byte payloads, are shared with the
+        original rather than rebuilt, as both instances are immutable. Replacement values may be given in their CBOR
+        form (e.g., int for an IntEnum or a dict for a nested CBORFactory). Unknown or fixed fields are ignored.
+        """
+        init_fields = self._codec_table().init_fields
+        changes = {}
+        for name, value in kwargs.items():
+            spec = init_fields.get(name)
+            if spec is None:
                 continue
-            d[index] = value.as_cbor_dict() if isinstance(value, CBORFactory) else value
-        return self.from_cbor_dict(d)
+            changes[name] = value if value is None else self._coerce_field(value, *spec)
+        return replace(self, **changes)
+
+    @staticmethod
+    def _coerce_field(value, kind: str, target):
+        """Convert a field value given in CBOR form to the type of the field, as from_cbor_dict() would"""
+        if kind is _PLAIN or kind is _ENUM:
+            if value.__class__ is target or isinstance(value, list):
+                return value
+            return target(value)
+        elif kind is _NESTED:
+            if isinstance(value, CBORFactory):
+                return value
+            if not isinstance(value, dict):
+                raise ValueError(f"Expected a dictionary for a {target} field, got {type(value).__name__}")
+            return _resolve_factory(target).from_cbor_dict(value)
+        elif not isinstance(value, list):
+            raise ValueError(f"Expected a list, got {type(value).__name__}")
+        elif kind is _LIST_NESTED:
+            nested_cls = _resolve_factory(target)
+            return [nested_cls.from_cbor_dict(x) if isinstance(x, dict) else x for x in value]
+        elif kind is _LIST_TUPLE:
+            return [tuple(datum) for datum in value]
+        return value
 
     @classmethod
     def from_cbor_dict(cls, d: Dict):
@@ -378,48 +559,32 @@ class CBORFactory:
             return None
 
         arg_dict = {}
-        for index, feld in enumerate(cls.__dataclass_fields__.values()):
-            if feld.init:  # field is part of __init__() implementation
-                if index in d:  # field index is present in CBOR dictionary
-                    if d[index] is None:
-                        continue  # no need to add this entry to the arg dictionary
-                    if issubclass(feld.type if isclass(feld.type) else feld.type.__class__, CBORFactory):
-                        # nested CBOR dict or None
-                        if not isinstance(d[index], dict):
-                            raise ValueError(f"Expected a dictionary at index={index} when creating new class instance")
-                        if feld.type == CBORFactory or feld.type.__class__ == CBORFactory:
-                            if 'cls' not in feld.metadata:
-                                raise TypeError("cannot create generic CBORFactory, need subclass metadata")
-                            # use metadata information to generate class object:
-                            arg_dict[feld.name] = globals()[feld.metadata['cls']].from_cbor_dict(d[index])
-                        else:
-                            arg_dict[feld.name] = feld.type.from_cbor_dict(d[index])
-                    elif isinstance(d[index], list):
-                        # TODO: Python 3.8 has more inspection capabilities here!
-                        #  see: https://stackoverflow.com/a/50101934/3816489
-                        args = feld.type.__args__
-                        if not args:
-                            raise TypeError("need generic list argument to proceed")
-                        if isclass(args[0]) and issubclass(args[0], CBORFactory):
-                            if args[0] == CBORFactory:
-                                if 'cls' not in feld.metadata:
-                                    raise TypeError("cannot create generic CBORFactory, need subclass metadata")
-                                # use metadata information to generate class object:
-                                arg_dict[feld.name] = [globals()[feld.metadata['cls']].from_cbor_dict(x) for x in
-                                                       d[index]]
-                            else:
-                                arg_dict[feld.name] = [args[0].from_cbor_dict(x) for x in d[index]]
-                        else:
-                            # TODO: change to better introspection of inner list typing when Python > 3.7
-                            #  see: https://stackoverflow.com/a/50080269/3816489
-                            origin = getattr(args[0], "__origin__", None)
-                            if origin is tuple:
-                                arg_dict[feld.name] = [tuple(datum) for datum in d[index]]
-                            else:
-                                arg_dict[feld.name] = d[index]
-                    # REMINDER: don't attempt to handle Dict here!
-                    else:
-                        arg_dict[feld.name] = feld.type(d[index])
+        for index, name, kind, target in cls._codec_table().decoders:
+            value = d.get(index)
+            if value is None:
+                continue  # field not present or no need to add this entry to the arg dictionary
+            if kind is _PLAIN or kind is _ENUM:
+                if value.__class__ is target:
+                    arg_dict[name] = value
+                elif isinstance(value, list):
+                    raise TypeError("need generic list argument to proceed")
+                else:
+                    arg_dict[name] = target(value)
+            elif kind is _NESTED:
+                # nested CBOR dict
+                if not isinstance(value, dict):
+                    raise ValueError(f"Expected a dictionary at index={index} when creating new class instance")
+                arg_dict[name] = _resolve_factory(target).from_cbor_dict(value)
+            elif not isinstance(value, list):
+                raise ValueError(f"Expected a list at index={index} when creating new class instance")
+            elif kind is _LIST_NESTED:
+                nested_cls = _resolve_factory(target)
+                arg_dict[name] = [nested_cls.from_cbor_dict(x) for x in value]
+            elif kind is _LIST_TUPLE:
+                arg_dict[name] = [tuple(datum) for datum in value]
+            else:
+                arg_dict[name] = value
+            # REMINDER: don't attempt to handle Dict here!
         try:
             return cls(**arg_dict)
         except TypeError as e:
@@ -427,15 +592,34 @@ class CBORFactory:
 
     @classmethod
     def lookup_field_index(cls, field_name: str) -> int:
-        """Find CBOR field index for given field name or raise ValueError if field not present"""
-        field_names = [feld.name for feld in cls.__dataclass_fields__.values()]
-        try:
-            return field_names.index(field_name)
-        except ValueError:
-            return -1
+        """Find CBOR field index for given field name or return -1 if field not present"""
+        return cls._codec_table().field_indices.get(field_name, -1)
+
+    @classmethod
+    def _codec_table(cls) -> "_CodecTable":
+        """The precompiled codec table of this class (compiled on first use if not done at module load)"""
+        table = cls.__dict__.get("_cbor_codec")
+        if table is None:
+            table = _CodecTable(cls)
+            cls._cbor_codec = table
+        return table
+
+    @cached_property
+    def _encoded_size(self) -> int:
+        # instances are immutable, so the size is computed at most once per instance
+        size = 0
+        count = 0
+        for index, name, kind in self._codec_table().encoders:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            size += cbor_header_size(index) + _cbor_size(value)
+            count += 1
+        return cbor_header_size(count) + size
 
     def data_size(self) -> int:
-        return len(self.encode())
+        """The length of encode(), computed without encoding"""
+        return self._encoded_size
 
     def encode(self) -> bytes:
         return cbor2.dumps(self.as_cbor_dict())
@@ -866,13 +1050,18 @@ class PrismMessage(CBORFactory):
         # do not print empty fields or those that have repr=False
         return f"PrismMessage: {self.msg_type} with {self.repr_fields()}"
 
+    @cached_property
+    def _content_digest(self) -> bytes:
+        # messages are immutable, so the digest is computed at most once per instance
+        return hashlib.sha256(cbor2.dumps(self.as_cbor_dict(exclude=("debug_info",)))).digest()
+
     def digest(self) -> bytes:
         """
         Create a SHA256 digest byte string for creating message signatures.
         Note: this excludes any debug info in this message.
         :return: SHA256 digest of this message (without any debug info)
         """
-        return hashlib.sha256(self.clone(debug_info=None).encode()).digest()
+        return self._content_digest
 
     def hexdigest(self) -> str:
         """
@@ -880,7 +1069,86 @@ class PrismMessage(CBORFactory):
         Note: this excludes any debug info in this message.
         :return: Hex representation of the SHA256 of this message (without any debug info)
         """
-        return hashlib.sha256(self.clone(debug_info=None).encode()).hexdigest()
+        return self._content_digest.hex()
+
+
+class LazyPrismMessage:
+    """
+    A received PrismMessage that has only been parsed as far as its top-level CBOR map.
+
+    Fields are converted to their PrismMessage types when first accessed, so that dispatching on a few header fields
+    such as msg_type or pseudonym does not build nested messages, maps and lists. Anything else (e.g., clone()) is
+    served by the full PrismMessage, which materialize() builds once. encode() returns the received bytes.
+    """
+    __slots__ = ("data", "_fields", "_values", "_message", "_content_digest")
+
+    def __init__(self, data: bytes):
+        fields = cbor2.loads(data)
+        if not isinstance(fields, dict):
+            raise ValueError(f"Expected a CBOR map for a PrismMessage, got {type(fields).__name__}")
+        self.data = data
+        self._fields = fields
+        self._values = {}
+        self._message: Optional[PrismMessage] = None
+        self._content_digest: Optional[bytes] = None
+
+    def __getattr__(self, name: str):
+        # only called for names that are not slots, i.e., message fields and PrismMessage methods
+        if self._message is not None:
+            return getattr(self._message, name)
+
+        values = self._values
+        if name in values:
+            return values[name]
+
+        table = PrismMessage._codec_table()
+        index = table.field_indices.get(name)
+        spec = table.init_fields.get(name)
+        if index is None or spec is None:
+            return getattr(self.materialize(), name)
+
+        value = self._fields.get(index)
+        if value is not None:
+            value = PrismMessage._coerce_field(value, *spec)
+        values[name] = value
+        return value
+
+    def __str__(self):
+        return str(self.materialize())
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    def materialize(self) -> PrismMessage:
+        if self._message is None:
+            self._message = PrismMessage.from_cbor_dict(self._fields)
+        return self._message
+
+    def encode(self) -> bytes:
+        return self.data
+
+    def data_size(self) -> int:
+        return len(self.data)
+
+    def digest(self) -> bytes:
+        """The same digest as PrismMessage.digest(), computed from the received CBOR map."""
+        if self._content_digest is None:
+            debug_index = PrismMessage.lookup_field_index("debug_info")
+            content = {index: value for index, value in self._fields.items() if index != debug_index}
+            self._content_digest = hashlib.sha256(cbor2.dumps(content)).digest()
+        return self._content_digest
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+
+def _compile_codec_tables(cls=CBORFactory):
+    for subclass in cls.__subclasses__():
+        subclass._codec_table()
+        _compile_codec_tables(subclass)
+
+
+_compile_codec_tables()
 
 
 # -- create various data types as convenience methods:
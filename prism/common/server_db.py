@@ -13,6 +13,7 @@
 #  limitations under the License.
 from __future__ import annotations
 
+from base64 import b64encode
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Dict, List, Optional
@@ -37,6 +38,7 @@ class ServerRecord:
         self.ark = ark
         self.expiration = datetime.utcfromtimestamp(ark.expiration)
         self.last_broadcast = datetime.utcfromtimestamp(0)
+        self._ark_bytes: Optional[bytes] = None
 
     def __repr__(self):
         role_info = f"{self.pseudonym.hex()[:6]}, {self.epoch}, {self.role}"
@@ -56,7 +58,7 @@ class ServerRecord:
 
     def to_json(self) -> dict:
         return {
-            "ark": self.ark.to_b64(),
+            "ark": b64encode(self.ark_bytes).decode("utf-8"),
             "last_broadcast": self.last_broadcast.timestamp(),
         }
 
@@ -79,6 +81,13 @@ class ServerRecord:
     def role(self) -> str:
         return self.ark.role
 
+    @property
+    def ark_bytes(self) -> bytes:
+        """The encoded ARK, cached until the ARK is replaced."""
+        if self._ark_bytes is None:
+            self._ark_bytes = self.ark.encode()
+        return self._ark_bytes
+
     def valid(self) -> bool:
         return self.expiration > datetime.utcnow()
 
@@ -93,6 +102,7 @@ class ServerRecord:
         if ark_expires > self.expiration:
             self.ark = ark
             self.expiration = ark_expires
+            self._ark_bytes = None
 
 
 class ServerDB:
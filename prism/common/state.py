@@ -12,13 +12,31 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import json
+import os
 
 from abc import ABCMeta, abstractmethod
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, Optional, Set, Tuple, Union
 
 from prism.common.config import configuration
 
+# A key path into a state, e.g. ("batches", batch_id). Integers index into lists.
+StatePath = Tuple[Union[str, int], ...]
+# Marks a key path that was removed from a state in save_changes()
+DELETED = object()
+
+
+class StateChanges(dict):
+    """The values that changed in a state since it was last saved, by key path, in the order they were changed."""
+
+    def set(self, path: StatePath, value: Any):
+        # move the path to the end, so that it is applied after any earlier change to one of its parents
+        self.pop(path, None)
+        self[path] = value
+
+    def delete(self, path: StatePath):
+        self.set(path, DELETED)
+
 
 class StateStore(metaclass=ABCMeta):
     @abstractmethod
@@ -29,6 +47,13 @@ class StateStore(metaclass=ABCMeta):
     def load_state(self, name: str) -> Optional[dict]:
         pass
 
+    def save_changes(self, name: str, changes: Dict[StatePath, Any], state: Callable[[], dict]):
+        """
+        Saves a state of which only the values at the given key paths changed since it was last saved or loaded.
+        Paths mapped to DELETED were removed. state() builds the whole state, for stores that need it.
+        """
+        self.save_state(name, state())
+
 
 class DummyStateStore(StateStore):
     def __init__(self):
@@ -42,26 +67,176 @@ class DummyStateStore(StateStore):
         return self.state.get(name, None)
 
 
-class DirectoryStateStore(StateStore):
-    def __init__(self, state_path: Path):
+def apply_delta(state: Any, delta: dict) -> Any:
+    """Apply a single set/delete journal entry to a state, returning the new state. Entries that index into a list
+    can only replace existing items."""
+    path = delta["p"]
+    if not path:
+        return delta.get("v")
+
+    if not isinstance(state, dict):
+        state = {}
+    parent = state
+    for key in path[:-1]:
+        if isinstance(parent, list):
+            child = parent[key] if isinstance(key, int) and 0 <= key < len(parent) else None
+            if not isinstance(child, (dict, list)):
+                return state
+        else:
+            child = parent.get(key)
+            if not isinstance(child, (dict, list)):
+                child = parent[key] = {}
+        parent = child
+
+    key = path[-1]
+    if isinstance(parent, list):
+        if isinstance(key, int) and 0 <= key < len(parent) and not delta.get("d"):
+            parent[key] = delta["v"]
+    elif delta.get("d"):
+        parent.pop(key, None)
+    else:
+        parent[key] = delta["v"]
+    return state
+
+
+def replay_journal(state: Any, text: str) -> Any:
+    """Apply the journal entries in text to a state. Replaying entries that a snapshot already covers is harmless."""
+    for line in text.splitlines():
+        try:
+            delta = json.loads(line)
+        except json.JSONDecodeError:
+            break  # incomplete last write
+        state = apply_delta(state, delta)
+    return state
+
+
+class FileStateStore(StateStore, metaclass=ABCMeta):
+    """
+    Keeps each state in a JSON snapshot file. While journaling, save_changes() appends the changed keys to a journal
+    file instead, and the snapshot is only rewritten once the journal has grown larger than it (and at least
+    compact_min_bytes). Loading a state replays its journal on top of the snapshot.
+
+    The journal is emptied after a new snapshot has been written. Replaying a journal on top of the snapshot that
+    already contains it changes nothing, so a failure in between loses nothing. Changes are only journaled on top of
+    a snapshot that this store wrote or loaded, anything else is saved in full.
+
+    Subclasses provide the file operations.
+    """
+
+    def __init__(self, compact_min_bytes: int = 64 * 1024):
         super().__init__()
-        self.state_path = state_path
-        self.state_path.mkdir(exist_ok=True)
+        self.compact_min_bytes = compact_min_bytes
+        # states whose snapshot and journal hold what the owner last saved or loaded
+        self._synced: Set[str] = set()
+        self._snapshot_bytes: Dict[str, int] = {}
+        self._journal_bytes: Dict[str, int] = {}
 
-    def save_path(self, name: str) -> Path:
-        return self.state_path / f"{name}.json"
+    @property
+    def journaling(self) -> bool:
+        return False
+
+    @abstractmethod
+    def save_path(self, name: str) -> Union[str, Path]:
+        pass
+
+    @abstractmethod
+    def journal_path(self, name: str) -> Union[str, Path]:
+        pass
+
+    @abstractmethod
+    def read_file(self, path) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def write_file(self, path, data: bytes):
+        pass
+
+    @abstractmethod
+    def append_file(self, path, data: bytes):
+        pass
 
     def save_state(self, name: str, state: dict):
-        self.save_path(name).write_text(json.dumps(state))
+        self.write_snapshot(name, state)
+
+    def save_changes(self, name: str, changes: Dict[StatePath, Any], state: Callable[[], dict]):
+        if not self.journaling or name not in self._synced:
+            self.save_state(name, state())
+            return
+        if not changes:
+            return
+
+        data = "".join(
+            json.dumps({"p": path, "d": True} if value is DELETED else {"p": path, "v": value}) + "\n"
+            for path, value in changes.items()
+        ).encode("utf-8")
+        self.append_file(self.journal_path(name), data)
+        self._journal_bytes[name] = self._journal_bytes.get(name, 0) + len(data)
+
+        if self._journal_bytes[name] > max(self.compact_min_bytes, self._snapshot_bytes.get(name, 0)):
+            self.write_snapshot(name, state())
+
+    def write_snapshot(self, name: str, state: dict):
+        data = json.dumps(state).encode("utf-8")
+        self.write_file(self.save_path(name), data)
+        self._snapshot_bytes[name] = len(data)
+        self._synced.add(name)
+
+        if name not in self._journal_bytes:
+            self._journal_bytes[name] = len(self.read_file(self.journal_path(name)) or b"")
+        if self._journal_bytes[name]:
+            self.write_file(self.journal_path(name), b"")
+            self._journal_bytes[name] = 0
 
     def load_state(self, name: str) -> Optional[dict]:
         if configuration.ignore_state:
             return None
 
-        if not self.save_path(name).exists():
+        state = None
+        snapshot = self.read_file(self.save_path(name))
+        if snapshot:
+            self._snapshot_bytes[name] = len(snapshot)
+            state = json.loads(bytes(snapshot).decode("utf-8"))
+
+        journal = self.read_file(self.journal_path(name))
+        self._journal_bytes[name] = len(journal or b"")
+        if journal:
+            state = replay_journal(state, bytes(journal).decode("utf-8"))
+
+        if snapshot:
+            self._synced.add(name)
+        return state
+
+
+class DirectoryStateStore(FileStateStore):
+    def __init__(self, state_path: Path, journal: bool = False, compact_min_bytes: int = 64 * 1024):
+        super().__init__(compact_min_bytes)
+        self.state_path = state_path
+        self.state_path.mkdir(exist_ok=True)
+        self.journal = journal
+
+    @property
+    def journaling(self) -> bool:
+        return self.journal
+
+    def save_path(self, name: str) -> Path:
+        return self.state_path / f"{name}.json"
+
+    def journal_path(self, name: str) -> Path:
+        return self.state_path / f"{name}.journal"
+
+    def read_file(self, path: Path) -> Optional[bytes]:
+        if not path.exists():
             return None
+        return path.read_bytes()
+
+    def write_file(self, path: Path, data: bytes):
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
 
-        return json.loads(self.save_path(name).read_text())
+    def append_file(self, path: Path, data: bytes):
+        with path.open("ab") as f:
+            f.write(data)
 
 
 class EpochStateStore(StateStore):
@@ -75,5 +250,8 @@ class EpochStateStore(StateStore):
     def save_state(self, name: str, state: dict):
         self.inner_store.save_state(self._transform_name(name), state)
 
+    def save_changes(self, name: str, changes: Dict[StatePath, Any], state: Callable[[], dict]):
+        self.inner_store.save_changes(self._transform_name(name), changes, state)
+
     def load_state(self, name: str) -> Optional[dict]:
         return self.inner_store.load_state(self._transform_name(name))
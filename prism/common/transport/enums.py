@@ -103,3 +103,13 @@ class ConnectionStatus(Enum):
     @property
     def usable(self) -> bool:
         return self in [ConnectionStatus.OPEN, ConnectionStatus.AVAILABLE]
+
+
+class OverflowPolicy(Enum):
+    """What a MessageHook does with a package when its queue is at capacity."""
+    BLOCK = 1
+    DROP_OLDEST = 2
+    DROP_NEWEST = 3
+
+    def __str__(self):
+        return self.name
@@ -13,8 +13,9 @@
 #  limitations under the License.
 from __future__ import annotations
 
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from jaeger_client import SpanContext
 
@@ -25,10 +26,14 @@ from prism.common.transport.transport import Transport, Channel, Link, MessageHo
 
 
 class EpochMessageHook(MessageHook):
+    """Filters packages by epoch for an inner hook, which queues the matched packages and keeps the counters."""
+
+    # noinspection PyMissingConstructor
     def __init__(self, inner_hook: MessageHook, epoch: str):
-        super().__init__()
         self.inner_hook = inner_hook
         self.epoch = epoch
+        self.dispatch_types = inner_hook.dispatch_types
+        self.dispatch_key = inner_hook.dispatch_key
 
     def match(self, package: Package) -> bool:
         if package.message.epoch and not package.message.epoch == self.epoch:
@@ -39,11 +44,20 @@ class EpochMessageHook(MessageHook):
     async def put(self, package: Package):
         await self.inner_hook.put(package)
 
+    async def receive_pkg(self) -> Package:
+        return await self.inner_hook.receive_pkg()
+
+    @property
+    def backlog(self) -> int:
+        return self.inner_hook.backlog
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.inner_hook.stats(), "hook": repr(self)}
+
     def __repr__(self):
         return f"EpochHook({self.epoch}, {self.inner_hook})"
 
     def dispose(self):
-        super().dispose()
         self.inner_hook.dispose()
 
 
@@ -52,10 +66,17 @@ class EpochTransport(Transport):
         super().__init__(transport.configuration)
         self.epoch = epoch
         self.inner_transport = transport
+        transport.send_link_pools.add(self.send_links)
         self._hook_map = {}
         self.local_address = transport.local_address
         self.local_link = EpochLink(LocalLink(self), self)
         self.epoch_links: List[EpochLink] = []
+        self._channel_links: Dict[str, List[EpochLink]] = defaultdict(list)
+
+        # EpochChannel wrappers, rebuilt when the inner transport's layout_version changes
+        self._channel_views: Dict[str, EpochChannel] = {}
+        self._channel_list: List[Channel] = []
+        self._views_version = -1
 
     @property
     def raw_links(self):
@@ -76,16 +97,39 @@ class EpochTransport(Transport):
                 return self.promote(link.inner_link)
 
         link = EpochLink(link, self)
-        self.epoch_links.append(link)
+        self.add_epoch_link(link)
         return link
 
+    def add_epoch_link(self, link: EpochLink):
+        if link not in self.epoch_links:
+            self.epoch_links.append(link)
+            self._channel_links[link.channel.channel_id].append(link)
+
+    def remove_epoch_link(self, link: EpochLink):
+        if link in self.epoch_links:
+            self.epoch_links.remove(link)
+            self._channel_links[link.channel.channel_id].remove(link)
+
+    def channel_links(self, channel_id: str) -> List[EpochLink]:
+        return list(self._channel_links.get(channel_id, ()))
+
     @property
     def overhead_bytes(self):
         return self.inner_transport.overhead_bytes + len(self.epoch) + 10
 
     @property
     def channels(self) -> List[Channel]:
-        return [EpochChannel(channel, self) for channel in self.inner_transport.channels]
+        if self._views_version != self.inner_transport.layout_version:
+            views = {}
+            for channel in self.inner_transport.channels:
+                view = self._channel_views.get(channel.channel_id)
+                if view is None or view.inner_channel is not channel:
+                    view = EpochChannel(channel, self)
+                views[channel.channel_id] = view
+            self._channel_views = views
+            self._channel_list = list(views.values())
+            self._views_version = self.inner_transport.layout_version
+        return self._channel_list
 
     async def register_hook(self, hook: MessageHook):
         epoch_hook = EpochMessageHook(hook, self.epoch)
@@ -100,18 +144,27 @@ class EpochTransport(Transport):
     async def submit_to_hooks(self, package: Package):
         await self.inner_transport.submit_to_hooks(package)
 
+    def hook_stats(self) -> List[Dict[str, Any]]:
+        return [hook.stats() for hook in self._hook_map.values()]
+
     async def shutdown(self):
+        self.inner_transport.send_link_pools.discard(self.send_links)
+        await self.send_links.close()
         for link in self.epoch_links:
             await link.close()
 
 
 class EpochChannel(Channel):
     """
-    A thin, ephemeral wrapper around an ordinary Transport which converts its links to EpochLinks.
+    A thin wrapper around an ordinary Channel which converts its links to EpochLinks.
+    EpochTransport keeps one per inner channel for as long as the inner transport's channels stay the same.
     """
     def __init__(self, channel: Channel, epoch_transport: EpochTransport):
         super().__init__(channel.channel_id)
         self._inner_channel = channel
+        # inner links by link address, rebuilt when the inner transport's layout_version changes
+        self._address_index: Dict[str, List[Link]] = {}
+        self._index_version = -1
         self.epoch_transport = epoch_transport
         self.epoch = epoch_transport.epoch
         self.link_direction = channel.link_direction
@@ -127,13 +180,28 @@ class EpochChannel(Channel):
     def __repr__(self):
         return repr(self._inner_channel)
 
+    @property
+    def inner_channel(self) -> Channel:
+        return self._inner_channel
+
     @property
     def status(self):
         return self._inner_channel.status
 
     @property
     def links(self) -> List[Link]:
-        return [link for link in self.epoch_transport.epoch_links if link.channel.channel_id == self.channel_id]
+        return self.epoch_transport.channel_links(self.channel_id)
+
+    def _loaded_links(self, link_address: str, refresh: bool = False) -> List[Link]:
+        version = self.epoch_transport.inner_transport.layout_version
+        if refresh or self._index_version != version:
+            self._address_index = defaultdict(list)
+            for link in self._inner_channel.links:
+                self._address_index[link.link_address].append(link)
+            self._index_version = version
+
+        return [link for link in self._address_index.get(link_address, ())
+                if link.link_address == link_address and link.link_status == LinkStatus.LOADED and link.active]
 
     async def create_link(self, endpoints: List[str]) -> Optional[Link]:
         new_link = await self._inner_channel.create_link(endpoints)
@@ -142,12 +210,12 @@ class EpochChannel(Channel):
             return None
 
         epoch_link = EpochLink(new_link, self.epoch_transport)
-        self.epoch_transport.epoch_links.append(epoch_link)
+        self.epoch_transport.add_epoch_link(epoch_link)
         return epoch_link
 
     async def load_link(self, link_address: str, endpoints: List[str], link_type: Optional[LinkType], role: Optional[str]) -> Optional[Link]:
-        matches = [link for link in self._inner_channel.links
-                   if link.link_address == link_address and link.link_status == LinkStatus.LOADED and link.active]
+        # link addresses can be filled in after a link is indexed, so check again from scratch before loading
+        matches = self._loaded_links(link_address) or self._loaded_links(link_address, refresh=True)
 
         if not matches:
             new_link = await self._inner_channel.load_link(link_address, endpoints, link_type, role)
@@ -157,7 +225,7 @@ class EpochChannel(Channel):
             return None
 
         epoch_link = EpochLink(matches[0], self.epoch_transport)
-        self.epoch_transport.epoch_links.append(epoch_link)
+        self.epoch_transport.add_epoch_link(epoch_link)
         return epoch_link
 
 
@@ -209,11 +277,9 @@ class EpochLink(Link):
     async def open(self):
         if self not in self.inner_link.references:
             self.inner_link.references.append(self)
-        if self not in self.epoch_transport.epoch_links:
-            self.epoch_transport.epoch_links.append(self)
+        self.epoch_transport.add_epoch_link(self)
 
     async def close(self):
         if self in self.inner_link.references:
             self.inner_link.references.remove(self)
-        if self in self.epoch_transport.epoch_links:
-            self.epoch_transport.epoch_links.remove(self)
+        self.epoch_transport.remove_epoch_link(self)
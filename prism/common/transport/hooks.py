@@ -11,22 +11,32 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
-from typing import Optional
+from typing import Optional, Union
 
 from prism.common.message import TypeEnum
+from .enums import OverflowPolicy
 from .transport import MessageHook, Package
 
 
 class MessageTypeHook(MessageHook):
     """Matches messages to the specified pseudonym of the specified types."""
-    def __init__(self, pseudonym: Optional[bytes], *types: TypeEnum):
-        super().__init__()
+    def __init__(
+            self,
+            pseudonym: Optional[bytes],
+            *types: TypeEnum,
+            capacity: Union[int, float, None] = None,
+            overflow: Optional[OverflowPolicy] = None,
+    ):
+        super().__init__(capacity, overflow)
         self.pseudonym = pseudonym
         self.types = list(types)
+        self.dispatch_types = frozenset(types)
+        if pseudonym:
+            self.dispatch_key = ("pseudonym", pseudonym)
 
     def match(self, package: Package) -> bool:
         message = package.message
-        return (not self.pseudonym or message.pseudonym == self.pseudonym) and message.msg_type in self.types
+        return (not self.pseudonym or message.pseudonym == self.pseudonym) and message.msg_type in self.dispatch_types
 
     def __repr__(self) -> str:
         return f"MessageTypeHook({self.types})"
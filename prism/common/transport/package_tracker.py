@@ -0,0 +1,70 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from typing import Dict, Optional
+
+import trio
+
+
+class PackageTracker:
+    """
+    Tracks the delivery status of packages handed to the SDK.
+
+    A sender registers a package handle with expect() before yielding, then awaits wait(). Status callbacks from the
+    SDK may arrive on any thread, so report() hands them to the trio thread, where the waiting sender is woken.
+    Reports for handles nobody is waiting on (e.g. because the sender timed out) are dropped.
+    """
+
+    def __init__(self):
+        self.trio_token: Optional[trio.lowlevel.TrioToken] = None
+        self._events: Dict[int, trio.Event] = {}
+        self._results: Dict[int, bool] = {}
+
+    def attach(self):
+        """Must be called from the trio thread before any packages are sent."""
+        self.trio_token = trio.lowlevel.current_trio_token()
+
+    def expect(self, handle: int):
+        self._events[handle] = trio.Event()
+
+    def report(self, handle: int, success: bool):
+        if self.trio_token:
+            try:
+                self.trio_token.run_sync_soon(self._resolve, handle, success)
+            except trio.RunFinishedError:
+                pass
+        else:
+            self._resolve(handle, success)
+
+    def _resolve(self, handle: int, success: bool):
+        event = self._events.get(handle)
+        if not event or event.is_set():
+            return
+        self._results[handle] = success
+        event.set()
+
+    async def wait(self, handle: int, timeout_sec: float) -> bool:
+        """Wait for the status of a package. Returns False if the package failed or its status did not arrive in
+        time."""
+        event = self._events.get(handle)
+        if not event:
+            return False
+
+        try:
+            with trio.move_on_after(timeout_sec):
+                await event.wait()
+            return self._results.get(handle, False)
+        finally:
+            # also when the sender is cancelled, which may happen after the status arrived
+            self._events.pop(handle, None)
+            self._results.pop(handle, None)
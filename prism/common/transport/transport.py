@@ -13,16 +13,19 @@
 #  limitations under the License.
 from __future__ import annotations
 
+import heapq
 import math
+from collections import Counter, defaultdict
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Set, cast
+from typing import Any, Awaitable, Callable, FrozenSet, Iterator, List, Optional, Dict, Set, Tuple, Union, cast
+from weakref import WeakSet
 
 import structlog
 import trio
 from jaeger_client import SpanContext
 
-from prism.common.message import PrismMessage, LinkAddress
+from prism.common.message import PrismMessage, LazyPrismMessage, LinkAddress
 from .enums import *
 from ..config import configuration
 from ..constant import TIMEOUT_MS_MAX
@@ -36,12 +39,17 @@ DATE_MIN = datetime.utcfromtimestamp(0)
 @dataclass
 class Package:
     """Represents a received package, so that the receiver gets information
-    about the source of the package, in case that is relevant to them."""
-    message: PrismMessage
+    about the source of the package, in case that is relevant to them.
+    Transports may submit packages with a LazyPrismMessage, which is materialized before a hook receives it."""
+    message: Union[PrismMessage, LazyPrismMessage]
     context: SpanContext
     timestamp: datetime = field(default_factory=datetime.utcnow)
     link: Link = field(default=None)
 
+    def materialize(self):
+        if isinstance(self.message, LazyPrismMessage):
+            self.message = self.message.materialize()
+
     def __repr__(self):
         if self.link:
             return f"Package(link={self.link.link_id})"
@@ -171,20 +179,158 @@ class LocalLink(Link):
         return True
 
 
+@dataclass
+class PooledLink:
+    link: Link
+    users: int = 0
+    last_used: float = field(default_factory=trio.current_time)
+    evicted: bool = False
+
+
+class SendLinkPool:
+    """Open send links by address, shared between one-off sends so that repeated sends to the same address do not
+    each pay for loading a link. Links are closed once nobody has used them for idle_sec, or as soon as they stop
+    being able to send. An idle_sec of 0 or less closes every link after use.
+
+    Idle links are closed by the sweep task of the transport that runs (see Transport.send_link_pools)."""
+
+    logger = structlog.get_logger(__name__ + " SendLinkPool")
+
+    def __init__(self, idle_sec: float):
+        self.idle_sec = idle_sec
+        self._links: Dict[Tuple[str, str], PooledLink] = {}
+        self._loading: Dict[Tuple[str, str], trio.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    @staticmethod
+    def _key(address: LinkAddress) -> Tuple[str, str]:
+        return address.channel_id, address.link_address
+
+    async def acquire(
+            self,
+            address: LinkAddress,
+            load: Callable[[], Awaitable[Optional[Link]]],
+    ) -> Optional[PooledLink]:
+        """Returns a pooled link to the given address, calling load() to get one if there is none that can send.
+        Every acquired link must be handed back through release()."""
+        key = self._key(address)
+        lock = self._loading.setdefault(key, trio.Lock())
+        async with lock:
+            entry = self._links.get(key)
+            if entry and not entry.link.can_send:
+                await self._evict(key, entry)
+                entry = None
+
+            if not entry:
+                link = await load()
+                if not link:
+                    return None
+                entry = PooledLink(link)
+                self._links[key] = entry
+
+            entry.users += 1
+            return entry
+
+    async def release(self, address: LinkAddress, entry: PooledLink, success: bool):
+        entry.users -= 1
+        entry.last_used = trio.current_time()
+        if not success or self.idle_sec <= 0 or entry.evicted:
+            await self._evict(self._key(address), entry)
+
+    async def _evict(self, key: Tuple[str, str], entry: PooledLink):
+        if self._links.get(key) is entry:
+            del self._links[key]
+        entry.evicted = True
+        if not entry.users:
+            await entry.link.close()
+
+    async def _evict_logged(self, key: Tuple[str, str], entry: PooledLink):
+        """Evicts a link, logging rather than raising if it fails to close, so that the other links still get
+        closed."""
+        try:
+            await self._evict(key, entry)
+        except Exception as e:
+            self.logger.warning(f"Error closing pooled link {entry.link}: {e}")
+
+    async def sweep(self):
+        """Closes the links that have been idle for idle_sec."""
+        now = trio.current_time()
+        for key, entry in list(self._links.items()):
+            if not entry.users and now - entry.last_used >= self.idle_sec:
+                await self._evict_logged(key, entry)
+
+        for key, lock in list(self._loading.items()):
+            if key not in self._links and not lock.locked() and not lock.statistics().tasks_waiting:
+                del self._loading[key]
+
+    async def close(self):
+        for key, entry in list(self._links.items()):
+            await self._evict_logged(key, entry)
+
+
+# Message fields that hooks can declare as their dispatch key (see MessageHook.dispatch_key)
+HOOK_KEY_FIELDS: Dict[str, Callable[[PrismMessage], Any]] = {
+    "pseudonym": lambda message: message.pseudonym,
+    "nonce": lambda message: message.nonce,
+    "request_id": lambda message: message.mpc_map.request_id if message.mpc_map else None,
+}
+
+
 class MessageHook:
     """A hook allows a task to register to receive specific messages inline rather than having them
     dispatched through the main message queue. Tasks should subclass MessageHook and override the
-    match predicate."""
+    match predicate.
+
+    Subclasses can narrow down which packages the transport checks them against by declaring the message types
+    they can match in dispatch_types, and a (field, value) pair from HOOK_KEY_FIELDS that every message they match
+    carries in dispatch_key. The key is only used together with dispatch_types.
+
+    Matched packages wait in a queue until the consumer receives them. By default the queue is unbounded, so that
+    put() never blocks. Hooks may opt into a capacity, in which case the overflow policy decides what happens once
+    the queue is full: put() blocks until there is room, or the oldest or newest package is dropped.
+    The transport hands packages to hooks one at a time, so a full BLOCK hook holds up delivery to every other hook
+    as well. Only use BLOCK with a bounded capacity if the consumer is guaranteed to keep draining its queue
+    without waiting on any other hook."""
     _in: trio.MemorySendChannel
     _out: trio.MemoryReceiveChannel
-
-    def __init__(self):
-        self._in, self._out = trio.open_memory_channel(math.inf)  # unbounded so that put() doesn't block
+    dispatch_types: Optional[FrozenSet[int]] = None
+    dispatch_key: Optional[Tuple[str, Any]] = None
+    overflow: OverflowPolicy = OverflowPolicy.BLOCK
+
+    def __init__(self, capacity: Union[int, float, None] = None, overflow: Optional[OverflowPolicy] = None):
+        self.capacity = capacity if capacity is not None else math.inf
+        if overflow is not None:
+            self.overflow = overflow
+        if self.capacity < 1 and self.overflow is not OverflowPolicy.BLOCK:
+            raise ValueError(f"Overflow policy {self.overflow} needs a capacity of at least 1")
+
+        self._in, self._out = trio.open_memory_channel(self.capacity)
+        self.queued = 0
+        self.delivered = 0
+        self.dropped = 0
 
     @property
     def in_channel(self):
         return self._in
 
+    @property
+    def backlog(self) -> int:
+        """The number of packages waiting to be received."""
+        return self._out.statistics().current_buffer_used
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hook": repr(self),
+            "capacity": self.capacity,
+            "overflow": str(self.overflow),
+            "queued": self.queued,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "backlog": self.backlog,
+        }
+
     def dispose(self):
         """Cleans up the memory channels when the hook is unregistered."""
         self._in.close()
@@ -195,23 +341,202 @@ class MessageHook:
         return False
 
     async def put(self, package: Package):
-        await self._in.send(package)
+        if self.overflow is OverflowPolicy.BLOCK:
+            await self._in.send(package)
+        else:
+            try:
+                self._in.send_nowait(package)
+            except trio.WouldBlock:
+                self.dropped += 1
+                if self.overflow is OverflowPolicy.DROP_NEWEST:
+                    return
+                self._out.receive_nowait()
+                self._in.send_nowait(package)
+        self.queued += 1
 
     async def receive_pkg(self) -> Package:
-        return cast(Package, await self._out.receive())
+        package = cast(Package, await self._out.receive())
+        self.delivered += 1
+        return package
+
+
+class HookIndex:
+    """Registered hooks indexed by the message types and keys they declare, so that a package is only checked
+    against the hooks that could match it."""
+
+    def __init__(self):
+        self._untyped: List[MessageHook] = []
+        self._typed: Dict[int, List[MessageHook]] = defaultdict(list)
+        self._keyed: Dict[Tuple[int, str, Any], List[MessageHook]] = {}
+        # number of keyed hooks for each message type and key field
+        self._key_fields: Dict[int, Counter] = defaultdict(Counter)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[MessageHook]:
+        seen = set()
+        for hooks in [self._untyped, *self._typed.values(), *self._keyed.values()]:
+            for hook in hooks:
+                if id(hook) not in seen:
+                    seen.add(id(hook))
+                    yield hook
+
+    def add(self, hook: MessageHook):
+        if not hook.dispatch_types:
+            self._untyped.append(hook)
+        elif hook.dispatch_key:
+            key_field, key_value = hook.dispatch_key
+            for msg_type in hook.dispatch_types:
+                self._keyed.setdefault((msg_type, key_field, key_value), []).append(hook)
+                self._key_fields[msg_type][key_field] += 1
+        else:
+            for msg_type in hook.dispatch_types:
+                self._typed[msg_type].append(hook)
+        self._count += 1
+
+    def remove(self, hook: MessageHook):
+        if not hook.dispatch_types:
+            if hook in self._untyped:
+                self._untyped.remove(hook)
+                self._count -= 1
+        elif hook.dispatch_key:
+            key_field, key_value = hook.dispatch_key
+            removed = False
+            for msg_type in hook.dispatch_types:
+                hooks = self._keyed.get((msg_type, key_field, key_value))
+                if not hooks or hook not in hooks:
+                    continue
+                hooks.remove(hook)
+                if not hooks:
+                    del self._keyed[(msg_type, key_field, key_value)]
+                fields = self._key_fields[msg_type]
+                fields[key_field] -= 1
+                if fields[key_field] <= 0:
+                    del fields[key_field]
+                removed = True
+            if removed:
+                self._count -= 1
+        else:
+            removed = False
+            for msg_type in hook.dispatch_types:
+                hooks = self._typed.get(msg_type)
+                if hooks and hook in hooks:
+                    hooks.remove(hook)
+                    removed = True
+            if removed:
+                self._count -= 1
+
+    def candidates(self, package: Package) -> List[MessageHook]:
+        """The hooks that could match the given package: hooks without dispatch types first, then hooks registered
+        for the package's type, then keyed hooks, each in the order they were added. A hook appears at most once."""
+        message = package.message
+        msg_type = message.msg_type
+        candidates = list(self._untyped)
+        candidates.extend(self._typed.get(msg_type, ()))
+        for key_field in self._key_fields.get(msg_type, ()):
+            key_value = HOOK_KEY_FIELDS[key_field](message)
+            if key_value is not None:
+                candidates.extend(self._keyed.get((msg_type, key_field, key_value), ()))
+        return candidates
+
+
+class MessagePool:
+    """Packages that no hook has matched yet, held until a matching hook is registered or they expire.
+    Packages are indexed by message type so that a new hook is only checked against those it could match, and
+    expire in order of their deadlines."""
+
+    def __init__(self):
+        self._packages: Dict[str, Package] = {}
+        self._typed: Dict[int, Dict[str, Package]] = defaultdict(dict)
+        # (deadline, sequence number, digest), with entries for removed or replaced packages left in place
+        self._deadlines: List[Tuple[datetime, int, str]] = []
+        # sequence number of the current deadline entry for each package
+        self._entries: Dict[str, int] = {}
+        self._sequence = 0
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._packages
+
+    def add(self, package: Package, deadline: datetime):
+        digest = package.message.hexdigest()
+        self.pop(digest)
+        self._packages[digest] = package
+        self._typed[package.message.msg_type][digest] = package
+        self._sequence += 1
+        self._entries[digest] = self._sequence
+        heapq.heappush(self._deadlines, (deadline, self._sequence, digest))
+
+    def pop(self, digest: str) -> Optional[Package]:
+        package = self._packages.pop(digest, None)
+        if package:
+            del self._entries[digest]
+            typed = self._typed[package.message.msg_type]
+            del typed[digest]
+            if not typed:
+                del self._typed[package.message.msg_type]
+        return package
+
+    def candidates(self, hook: MessageHook) -> List[Tuple[str, Package]]:
+        """The pooled packages that the given hook could match, as (digest, package) pairs."""
+        if not hook.dispatch_types:
+            return list(self._packages.items())
+
+        candidates = [item for msg_type in hook.dispatch_types for item in self._typed.get(msg_type, {}).items()]
+        if hook.dispatch_key:
+            key_field, key_value = hook.dispatch_key
+            get_key = HOOK_KEY_FIELDS[key_field]
+            candidates = [(digest, package) for digest, package in candidates
+                          if self._key_matches(get_key, package, key_value)]
+        return candidates
+
+    @staticmethod
+    def _key_matches(get_key: Callable[[PrismMessage], Any], package: Package, key_value: Any) -> bool:
+        try:
+            return get_key(package.message) == key_value
+        except (ValueError, TypeError):
+            # leave packages that do not decode to the caller, which drops them once it fails to materialize them
+            return True
+
+    def next_deadline(self) -> Optional[datetime]:
+        while self._deadlines:
+            deadline, sequence, digest = self._deadlines[0]
+            if self._entries.get(digest) == sequence:
+                return deadline
+            heapq.heappop(self._deadlines)
+        return None
+
+    def expire(self, now: datetime) -> int:
+        """Removes all packages whose deadline has passed and returns how many there were."""
+        expired = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, sequence, digest = heapq.heappop(self._deadlines)
+            if self._entries.get(digest) == sequence:
+                self.pop(digest)
+                expired += 1
+        return expired
 
 
 # One object of class Transport will be provided to the server on initialization
 # It will have channels preconfigured, and may or may not have links already running
 class Transport:
-    hooks: List[MessageHook]
-    message_pool: Dict[str, Package]
+    hooks: HookIndex
+    message_pool: MessagePool
     local_address: str
 
     def __init__(self, config):
         self.configuration = config
-        self.hooks = []
-        self.message_pool = {}
+        self.hooks = HookIndex()
+        self.message_pool = MessagePool()
+        self._pool_filled = trio.Event()
+        self.layout_version = 0
+        self.send_links = SendLinkPool(config.get("transport_send_link_idle_sec", 30.0))
+        # pools swept by run(), including those of EpochTransports wrapping this transport, which are not run
+        self.send_link_pools: WeakSet[SendLinkPool] = WeakSet([self.send_links])
         self.local_address = config.get('name', None)
         self._logger = structlog.getLogger(__name__)
         self.local_link = LocalLink(self)
@@ -227,6 +552,10 @@ class Transport:
     def configure(self, **kwargs):
         pass
 
+    def layout_changed(self):
+        """Subclasses call this whenever a channel or link is added or removed, so that views of them are rebuilt."""
+        self.layout_version += 1
+
     def links_for_address(self, address: str) -> List[Link]:
         return [
             link for channel in self.channels for link in channel.links
@@ -235,48 +564,67 @@ class Transport:
 
     async def register_hook(self, hook: MessageHook):
         # check new hook for pending messages first
-        for pid in list(self.message_pool.keys()):
-            package = self.message_pool.get(pid)
-            if not package:
+        for pid, package in self.message_pool.candidates(hook):
+            if pid not in self.message_pool:
                 continue
 
-            if hook.match(package):
-                await hook.put(package)
-                self.message_pool.pop(pid, None)
+            try:
+                if not hook.match(package):
+                    continue
+                package.materialize()
+            except (ValueError, TypeError) as e:
+                # fields of lazily decoded messages are only checked once hooks look at them
+                self._logger.warning(f"Dropping undecodable pooled package: {e}")
+                self.message_pool.pop(pid)
+                continue
 
-        self.hooks.append(hook)
+            self.message_pool.pop(pid)
+            await hook.put(package)
+
+        self.hooks.add(hook)
 
     async def _hook_task(self):
+        """Drops pooled packages that no hook has claimed within dt_hold_package_sec."""
         self._logger.debug("Starting hook task")
         while True:
-            now = datetime.utcnow()
-            drop_threshold = timedelta(seconds=self.configuration.dt_hold_package_sec)
-            for pid in list(self.message_pool.keys()):
-                package = self.message_pool.get(pid)
-                if not package:
-                    continue
-
-                if (now - package.timestamp >= drop_threshold) or await self._check_hooks(package):
-                    self.message_pool.pop(pid, None)
-
-            await trio.sleep(0.1)
+            self.message_pool.expire(datetime.utcnow())
+            deadline = self.message_pool.next_deadline()
+            if deadline is None:
+                await self._pool_filled.wait()
+                self._pool_filled = trio.Event()
+            else:
+                await trio.sleep(max((deadline - datetime.utcnow()).total_seconds(), 0))
 
     def remove_hook(self, hook: MessageHook):
-        if hook in self.hooks:
-            self.hooks.remove(hook)
+        self.hooks.remove(hook)
         hook.dispose()
 
+    def hook_stats(self) -> List[Dict[str, Any]]:
+        """Queue counters of every registered hook."""
+        return [hook.stats() for hook in self.hooks]
+
     async def submit_to_hooks(self, package: Package):
         """Submit incoming package to all registered hooks.  If any of the hooks matches, consumes the package then
         stop.  Otherwise, if never matched, put the package in memory channel for later re-delivery to new hooks."""
-        if not await self._check_hooks(package):
-            self.message_pool[package.message.hexdigest()] = package
+        try:
+            matched = await self._check_hooks(package)
+        except (ValueError, TypeError) as e:
+            # fields of lazily decoded messages are only checked once hooks look at them
+            self._logger.warning(f"Dropping undecodable package: {e}")
+            return
+
+        if not matched:
+            hold = timedelta(seconds=self.configuration.dt_hold_package_sec)
+            self.message_pool.add(package, package.timestamp + hold)
+            self._pool_filled.set()
 
     async def _check_hooks(self, package: Package) -> bool:
-        """Check a package with each hook, send it to the ones it matches, and returns whether there was a match."""
+        """Check a package with each hook that could match it, send it to the ones it matches, and returns whether
+        there was a match."""
         matched = False
-        for hook in self.hooks:
+        for hook in self.hooks.candidates(package):
             if hook.match(package):
+                package.materialize()
                 await hook.put(package)
                 matched = True
         return matched
@@ -290,14 +638,19 @@ class Transport:
             timeout_ms: int = TIMEOUT_MS_MAX,
     ) -> bool:
         with trace_context(self._logger, "send-to-address", context, address=address, timeout_ms=timeout_ms) as scope:
-            link = await self.load_address(address, [endpoint or "send-to-address"], link_type=LinkType.SEND)
+            entry = await self.send_links.acquire(
+                address,
+                lambda: self.load_address(address, [endpoint or "send-to-address"], link_type=LinkType.SEND),
+            )
 
-            if not link:
+            if not entry:
                 return False
+            success = False
             try:
-                return await link.send(message, scope.context, timeout_ms)
+                success = await entry.link.send(message, scope.context, timeout_ms)
+                return success
             finally:
-                await link.close()
+                await self.send_links.release(address, entry, success)
 
     async def load_address(
             self,
@@ -326,7 +679,19 @@ class Transport:
     async def run(self):
         """Runs any background tasks that the transport needs to operate, such as polling whiteboards.
         Passes received messages to self.submit_to_hooks()"""
-        await self._hook_task()
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self._sweep_task)
+            await self._hook_task()
+
+    async def _sweep_task(self):
+        """Closes the pooled send links that have been idle for too long."""
+        if self.send_links.idle_sec <= 0:
+            return
+
+        while True:
+            await trio.sleep(self.send_links.idle_sec / 2)
+            for pool in list(self.send_link_pools):
+                await pool.sweep()
 
     def debug_dump(self, logger):
         for channel in self.channels:
@@ -335,3 +700,8 @@ class Transport:
                 logger.debug(f"  {link}")
                 logger.debug(f"    {link.link_address}")
             logger.debug("\n")
+
+        logger.debug("Hooks:")
+        for stats in self.hook_stats():
+            logger.debug(f"  {stats['hook']}: {stats['backlog']}/{stats['capacity']} queued ({stats['overflow']}), "
+                         f"{stats['queued']} in, {stats['delivered']} out, {stats['dropped']} dropped")
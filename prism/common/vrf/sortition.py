@@ -51,10 +51,10 @@ class VRFSortition:
             return True
 
         # input a serialized proof, claimed role, and a distribution
-        from prism.common.vrf.vrf import deserialize_proof, VRF_verify, VRF_proof_to_hash
+        from prism.common.vrf.vrf import deserialize_proof, VRF_verify
         pk, alpha, pi = deserialize_proof(serial_proof)
-        if VRF_verify(pk, alpha, pi):
-            beta = bytes2ip(VRF_proof_to_hash(pi))
-            return self.rd.role(beta) == role
+        valid, beta = VRF_verify(pk, alpha, pi)
+        if valid:
+            return self.rd.role(bytes2ip(beta)) == role
         else:
             return False
@@ -17,6 +17,7 @@ from cryptography.hazmat.primitives import serialization
 import hashlib
 import json
 import math
+from functools import lru_cache
 from typing import Tuple, Optional, Any
 
 from .octets import bytes2ip, i2bytes
@@ -25,6 +26,8 @@ from prism.common.crypto.server_rsa import ServerRSAPrivateKey, RSA_KEY_SIZE
 # constants section. will be formalized and moved later
 # RSA_KEYLEN = 2048  # (bits)
 HASH_OUTLEN = 32  # (bytes)
+# Number of verification results and deserialized proofs to remember. The same ARK proofs are checked over and over.
+VRF_CACHE_SIZE = 4096
 
 
 # this file implements VRFs via RSA Full Domain Hash
@@ -99,38 +102,21 @@ def mod_mult(a: int, b: int, mod: int) -> int:
 
 
 def mod_exp(b: int, power: int, mod: int) -> int:
-    # the recursive way blows out Python's stack with numbers so large
-    # need to do this iteratively
     if power < 0:
         raise ValueError("invalid power")
-    assert (power >= 0)
-    if power == 0:
-        return 1
-    if power == 1:
-        return b
-    accum = 1
-    while power > 1:
-        if power % 2 == 1:
-            accum = mod_mult(b, accum, mod)
-            power = (power - 1) // 2
-        else:
-            power = power // 2
-        b = mod_mult(b, b, mod)
-    return mod_mult(b, accum, mod)
+    return pow(b, power, mod)
 
 
 def RSASP1(K, m: int) -> int:
     # K is type cryptography key
     # m is type integer (the message representative)
-    # return s = m^d mod n
-    # NOTES: the spec provides a faster way to perform this computation
-    # see it for performance improvements
+    # return s = m^d mod n, computed with the CRT as in RFC 8017 section 5.2.1
     sk = K.private_numbers()
-    pk = K.public_key()
-    public = pk.public_numbers()
-    n = public.n
-    d = sk.d
-    return mod_exp(m, d, n)
+    p, q = sk.p, sk.q
+    s1 = pow(m % p, sk.dmp1, p)
+    s2 = pow(m % q, sk.dmq1, q)
+    h = (sk.iqmp * (s1 - s2)) % p
+    return s2 + q * h
 
 
 def RSAVP1(PK, s: int) -> int:
@@ -138,9 +124,7 @@ def RSAVP1(PK, s: int) -> int:
     # s is type integer (signature representative)
     # return m = s^e mod n
     pk = PK.public_numbers()
-    n = pk.n
-    e = pk.e
-    return mod_exp(s, e, n)
+    return pow(s, pk.e, pk.n)
 
 
 # serialization functions
@@ -158,6 +142,7 @@ def serialize_proof(PK, alpha: bytes, pi: bytes) -> str:
     return json.dumps(d)
 
 
+@lru_cache(maxsize=VRF_CACHE_SIZE)
 def deserialize_proof(serial: str) -> Tuple[Any, bytes, bytes]:
     # get the encoded proof message and break it into
     # our internal format so that we can verify properly
@@ -233,10 +218,12 @@ def VRF_verify(PK, alpha: bytes, pi: bytes) -> Tuple[bool, Optional[bytes]]:
     ## recall k is the bytelen of the rsa modulus
     # return EM == EM_check
     public = PK.public_numbers()
-    n = public.n
-    ksize = (PK.key_size) // 8
-    s = bytes2ip(pi)
-    m = RSAVP1(PK, s)
+    return _verify(public.n, public.e, PK.key_size // 8, alpha, pi)
+
+
+@lru_cache(maxsize=VRF_CACHE_SIZE)
+def _verify(n: int, e: int, ksize: int, alpha: bytes, pi: bytes) -> Tuple[bool, Optional[bytes]]:
+    m = pow(bytes2ip(pi), e, n)
 
     try:
         EM = i2bytes(m, ksize - 1)
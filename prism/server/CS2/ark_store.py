@@ -15,7 +15,7 @@ from datetime import datetime, timedelta
 from time import time
 from typing import Optional, List, Set
 
-from prism.common.message import PrismMessage, TypeEnum
+from prism.common.message import PrismMessage, TypeEnum, cbor_header_size
 from prism.common.server_db import ServerDB, ServerRecord
 from prism.common.state import StateStore
 from prism.server.server_data import ServerData
@@ -81,32 +81,37 @@ class ArkStore(ServerDB):
         dead_servers.extend(degraded_servers)
 
         records_by_last_broadcast = sorted(non_dummy_servers, key=lambda s: s.last_broadcast)
-        batch = []
-        message = None
-        new_size = 0
-
-        for batch_size in range(1, len(records_by_last_broadcast) + 1):
-            new_batch = records_by_last_broadcast[:batch_size]
-            new_message = PrismMessage(
-                msg_type=TypeEnum.ARKS,
-                pseudonym=server_data.pseudonym,
-                epoch=server_data.epoch,
-                micro_timestamp=int(time() * 1e6),
-                submessages=[rec.ark for rec in new_batch],
-                dead_servers=dead_servers,
-            )
-            new_size = len(new_message.encode())
+        if not records_by_last_broadcast:
+            return None
 
+        envelope = dict(
+            msg_type=TypeEnum.ARKS,
+            pseudonym=server_data.pseudonym,
+            epoch=server_data.epoch,
+            micro_timestamp=int(time() * 1e6),
+            dead_servers=dead_servers,
+        )
+        # The encoded message is the envelope with each ARK's encoding appended to the submessages array, so its
+        # size can be computed from the sizes of the ARKs without re-encoding the message for each batch size.
+        base_size = PrismMessage(submessages=[], **envelope).data_size() - cbor_header_size(0)
+        arks_size = 0
+        batch_size = 0
+
+        for rec in records_by_last_broadcast:
+            ark_size = rec.ark.data_size()
+            new_size = base_size + cbor_header_size(batch_size + 1) + arks_size + ark_size
             if new_size > mtu:
+                if batch_size == 0:
+                    self.logger.warning(f"Single ARK produces message size ({new_size}) greater than MTU {mtu}.")
                 break
-            else:
-                batch = new_batch
-                message = new_message
+            arks_size += ark_size
+            batch_size += 1
 
-        if new_size and message is None:
-            self.logger.warning(f"Single ARK produces message size ({new_size}) greater than MTU {mtu}.")
+        if not batch_size:
+            return None
 
+        batch = records_by_last_broadcast[:batch_size]
         for rec in batch:
             rec.last_broadcast = datetime.utcnow()
 
-        return message
+        return PrismMessage(submessages=[rec.ark for rec in batch], **envelope)
@@ -32,6 +32,7 @@ from prism.common.logging import MONITOR_STATUS
 from prism.common.message import PrismMessage
 from prism.common.state import StateStore
 from prism.common.tracing import trace_context
+from prism.common.transport.enums import OverflowPolicy
 from prism.common.transport.epoch_transport import EpochTransport
 from prism.common.transport.hooks import MessageTypeHook
 from prism.common.util import bytes_hex_abbrv, frequency_limit
@@ -156,7 +157,10 @@ class AbstractRole(metaclass=ABCMeta):
             yield scope
 
     def monitor_data(self) -> dict:
+        hook_stats = self._transport.hook_stats()
         return {
+            "hook_backlog": sum(stats["backlog"] for stats in hook_stats),
+            "hook_drops": sum(stats["dropped"] for stats in hook_stats),
             "flood_db_size": len(self.flooding),
             "dropbox_index": self.server_data.dropbox_index,
             "lsp_table_size": len(self.router.network),
@@ -195,10 +199,14 @@ class AbstractRole(metaclass=ABCMeta):
             require_pseudonym: bool,
             *types
     ):
-        if require_pseudonym:
-            hook = MessageTypeHook(self.pseudonym, *types)
-        else:
-            hook = MessageTypeHook(None, *types)
+        # Requests that arrive while the handler is this far behind are shed rather than blocking the transport,
+        # which would also hold up the responses the handler may be waiting for
+        hook = MessageTypeHook(
+            self.pseudonym if require_pseudonym else None,
+            *types,
+            capacity=configuration.hook_capacity,
+            overflow=OverflowPolicy.DROP_NEWEST,
+        )
         await self._transport.register_hook(hook)
 
         while True:
@@ -24,6 +24,7 @@ from jaeger_client import SpanContext
 from prism.common.config import configuration
 from prism.common.crypto.verify import verify_ARK, sign_ARK
 from prism.common.message import create_ARK, TypeEnum, PrismMessage
+from prism.common.transport.enums import OverflowPolicy
 from prism.common.transport.transport import MessageHook, Package
 from prism.common.vrf.link import is_link_compatible
 from prism.common.vrf.sortition import VRFSortition
@@ -33,8 +34,10 @@ from ...CS2.roles.abstract_role import AbstractRole
 
 class ArkHook(MessageHook):
     def __init__(self, server_data):
-        super().__init__()
+        # ARKs are re-announced periodically, so only a bounded backlog of them is worth keeping
+        super().__init__(capacity=1000, overflow=OverflowPolicy.DROP_OLDEST)
         self.server_data = server_data
+        self.dispatch_types = frozenset([TypeEnum.ANNOUNCE_ROLE_KEY])
 
     def match(self, package: Package) -> bool:
         msg = package.message
@@ -143,7 +146,7 @@ class AnnouncingRole(AbstractRole, metaclass=ABCMeta):
                 continue
 
             ark_count = len(arks_message.submessages)
-            ark_bytes = len(arks_message.encode())
+            ark_bytes = arks_message.data_size()
             with self.trace(
                     "ark-broadcast",
                     ark_count=ark_count,
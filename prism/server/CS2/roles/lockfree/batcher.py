@@ -0,0 +1,128 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional
+
+import structlog
+import trio
+from jaeger_client import SpanContext
+
+from prism.common.message import PrismMessage
+
+
+@dataclass
+class OutboundBatch:
+    messages: List[PrismMessage] = field(default_factory=list)
+    contexts: List[Optional[SpanContext]] = field(default_factory=list)
+    size: int = 0
+    timeout_sec: float = math.inf
+    flushing: bool = False
+    full: trio.Event = field(default_factory=trio.Event)
+    sent: trio.Event = field(default_factory=trio.Event)
+    success: bool = False
+
+    def add(self, message: PrismMessage, context: Optional[SpanContext], timeout_sec: float):
+        self.messages.append(message)
+        self.contexts.append(context)
+        self.size += message.data_size()
+        self.timeout_sec = min(self.timeout_sec, timeout_sec)
+
+    def remove(self, message: PrismMessage):
+        for i, queued in enumerate(self.messages):
+            if queued is message:
+                del self.messages[i]
+                del self.contexts[i]
+                self.size -= message.data_size()
+                return
+
+
+class PeerBatcher:
+    """
+    Coalesces the messages sent to a single peer within a short window, so that they can travel in one package.
+    The first message of a batch starts a task in the given nursery that sends the batch once delay_sec has passed
+    or the batch has grown to max_bytes, and every sender waits for the outcome of the send that carried its message.
+    A message that would take the pending batch past max_bytes starts a new batch instead, so a batch only exceeds
+    max_bytes when it holds a single message that is larger on its own.
+
+    A sender that is cancelled before its batch is flushed takes its message out of the batch. Once a batch is being
+    sent, the send is shared by all of its senders, so it is only bounded by the shortest of their timeouts and by
+    the nursery.
+    """
+
+    logger = structlog.get_logger(__name__ + " PeerBatcher")
+
+    def __init__(
+            self,
+            send: Callable[[List[PrismMessage], List[Optional[SpanContext]], float], Awaitable[bool]],
+            nursery: trio.Nursery,
+            delay_sec: float,
+            max_bytes: int,
+    ):
+        self._send = send
+        self.nursery = nursery
+        self.delay_sec = delay_sec
+        self.max_bytes = max_bytes
+        self._pending: Optional[OutboundBatch] = None
+        self.batches_sent = 0
+        self.messages_sent = 0
+
+    async def send(self, message: PrismMessage, context: SpanContext = None, timeout_sec: float = math.inf) -> bool:
+        batch = self._pending
+        if batch is not None and batch.messages and batch.size + message.data_size() > self.max_bytes:
+            # send what is pending rather than let the message push the batch past max_bytes
+            self._close(batch)
+            batch = None
+        if batch is None:
+            batch = self._pending = OutboundBatch()
+            self.nursery.start_soon(self._flush_task, batch)
+
+        batch.add(message, context, timeout_sec)
+        if batch.size >= self.max_bytes:
+            self._close(batch)
+
+        try:
+            await batch.sent.wait()
+        except trio.Cancelled:
+            if not batch.flushing:
+                batch.remove(message)
+            raise
+
+        return batch.success
+
+    def _close(self, batch: OutboundBatch):
+        if self._pending is batch:
+            self._pending = None
+        batch.full.set()
+
+    async def _flush_task(self, batch: OutboundBatch):
+        try:
+            with trio.move_on_after(self.delay_sec):
+                await batch.full.wait()
+            self._close(batch)
+
+            batch.flushing = True
+            if not batch.messages:
+                return
+
+            self.batches_sent += 1
+            self.messages_sent += len(batch.messages)
+            with trio.move_on_after(batch.timeout_sec):
+                batch.success = await self._send(batch.messages, batch.contexts, batch.timeout_sec)
+        except Exception as e:
+            self.logger.error(f"Failed to send batch of {len(batch.messages)} messages: {e}")
+        finally:
+            batch.sent.set()
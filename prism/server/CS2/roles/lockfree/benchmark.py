@@ -0,0 +1,448 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Benchmark for the lock-free MPC dropbox.
+
+Runs a full committee of LockFreeDropbox roles in a single process. Each party has its own EpochTransport, and
+messages between parties are encoded, counted and handed to the destination's transport by a BenchRouter standing in
+for the link-state router. Store and poll requests are built with the client's MPCDropbox, so the measured path is
+everything from the leader receiving a decrypted request to the client reassembling the retrieved message.
+
+Routing is simulated: a message is decoded lazily and submitted straight to the destination transport's hooks with
+Transport.submit_to_hooks, without going through the router, links or channels (LocalLink included). Link selection,
+send-link pooling and channel I/O are therefore not part of the measurement, and --latency-ms stands in for the network.
+
+Usage:
+    python -m prism.server.CS2.roles.lockfree.benchmark --stores 100 --polls 20 --concurrency 10
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import structlog
+import trio
+from jaeger_client import SpanContext
+
+from prism.client.dropbox import MPCDropbox, MPCRequestRegistry
+from prism.common.config import configuration
+from prism.common.config.config import load_dict_config
+from prism.common.constant import TIMEOUT_MS_MAX
+from prism.common.crypto.halfkey.ecdh import EllipticCurveDiffieHellman
+from prism.common.crypto.server_message import decrypt
+from prism.common.logging import init_logging
+from prism.common.message import LazyPrismMessage, PrismMessage, TypeEnum, LinkAddress
+from prism.common.pseudonym import Pseudonym
+from prism.common.server_db import ServerRecord
+from prism.common.state import DummyStateStore, DirectoryStateStore, StateStore
+from prism.common.tracing import init_tracer
+from prism.common.transport.epoch_transport import EpochTransport
+from prism.common.transport.transport import Transport, Package
+from prism.server.CS2.roles.lockfree.dropbox import LockFreeDropbox
+from prism.server.CS2.roles.lockfree.peer import DropboxPeer
+from prism.server.pki import RoleKeyMaterial
+from prism.server.server_data import ServerData
+
+EPOCH = "genesis"
+
+
+class BenchNetwork:
+    """Connects the transports of the committee and keeps count of the traffic between them. Delivery skips the
+    links and channels entirely and submits the encoded message to the destination transport's hooks."""
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.transports: Dict[bytes, EpochTransport] = {}
+        self.replies: List[PrismMessage] = []
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.nursery: Optional[trio.Nursery] = None
+
+    async def deliver(self, target: bytes, message: PrismMessage, context: Optional[SpanContext]) -> bool:
+        transport = self.transports.get(target)
+        if not transport:
+            return False
+
+        data = message.clone(epoch=EPOCH).encode()
+        self.bytes_sent += len(data)
+        self.messages_sent += 1
+
+        if self.latency_ms:
+            self.nursery.start_soon(self._deliver_later, transport, data, context)
+        else:
+            await transport.submit_to_hooks(Package(LazyPrismMessage(data), context))
+        return True
+
+    async def _deliver_later(self, transport: EpochTransport, data: bytes, context: Optional[SpanContext]):
+        await trio.sleep(self.latency_ms / 1000)
+        await transport.submit_to_hooks(Package(LazyPrismMessage(data), context))
+
+
+class BenchRouter:
+    """The subset of the LinkStateRouter interface used by MPC roles, delivering directly over a BenchNetwork.
+    Anything not addressed to a committee member is treated as a reply to a client."""
+
+    def __init__(self, network: BenchNetwork):
+        self.network = network
+
+    def online(self, _pseudonym: bytes) -> bool:
+        return True
+
+    async def send(
+            self,
+            address: Union[str, bytes, LinkAddress],
+            message: PrismMessage,
+            context: Optional[SpanContext],
+            block: bool = False,
+            timeout_ms=TIMEOUT_MS_MAX,
+            **kwargs
+    ) -> bool:
+        if isinstance(address, bytes) and address in self.network.transports:
+            return await self.network.deliver(address, message, context)
+
+        self.network.replies.append(message)
+        return True
+
+    async def broadcast(
+            self,
+            message: PrismMessage,
+            context: Optional[SpanContext],
+            block: bool = False,
+            timeout_ms=TIMEOUT_MS_MAX,
+            **kwargs
+    ) -> bool:
+        self.network.replies.append(message)
+        return True
+
+
+@dataclass
+class PhaseStats:
+    name: str
+    ops: int = 0
+    failures: int = 0
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    bytes_sent: int = 0
+    messages_sent: int = 0
+    preproducts_consumed: int = 0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return math.nan
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def per_op(self, value: float) -> float:
+        return value / self.ops if self.ops else math.nan
+
+    def report(self) -> dict:
+        return {
+            "phase": self.name,
+            "ops": self.ops,
+            "failures": self.failures,
+            "elapsed_s": self.elapsed,
+            "ops_per_s": self.ops / self.elapsed if self.elapsed else math.nan,
+            "p50_ms": self.percentile(50) * 1000,
+            "p90_ms": self.percentile(90) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.percentile(100) * 1000,
+            "preproducts_per_op": self.per_op(self.preproducts_consumed),
+            "bytes_per_op": self.per_op(self.bytes_sent),
+            "messages_per_op": self.per_op(self.messages_sent),
+        }
+
+
+class DropboxBenchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.network = BenchNetwork(args.latency_ms)
+        self.committee = [self.make_party(party_id) for party_id in range(args.parties)]
+        self.form_committee()
+
+        self.registry = MPCRequestRegistry()
+        self.client = MPCDropbox(ServerRecord(self.committee_ark()), self.registry, configuration)
+        self.recipients = [Pseudonym(os.urandom(32)) for _ in range(args.recipients)]
+        self.sent: Dict[bytes, List[PrismMessage]] = {pseudonym.pseudonym: [] for pseudonym in self.recipients}
+        self.delivered: Dict[bytes, List[PrismMessage]] = {pseudonym.pseudonym: [] for pseudonym in self.recipients}
+        self.poll_recipients: Dict[bytes, bytes] = {}
+        self.polls_started = 0
+        self.retrieved = 0
+        self.duplicates = 0
+        self.mismatched = 0
+
+    @property
+    def leader(self) -> LockFreeDropbox:
+        return self.committee[0]
+
+    def state_store(self, party_id: int) -> StateStore:
+        if self.args.state_dir:
+            return DirectoryStateStore(
+                self.args.state_dir / f"party-{party_id}",
+                journal=bool(configuration.get("state_journal")),
+            )
+        return DummyStateStore()
+
+    def make_party(self, party_id: int) -> LockFreeDropbox:
+        private_key = EllipticCurveDiffieHellman().generate_private()
+        server_data = ServerData(
+            id=f"bench-dropbox-{party_id}",
+            certificate=b"",
+            DH_public_dict=private_key.public_key().cbor(),
+            pseudonym=os.urandom(32),
+            role_name="DROPBOX_LF",
+            committee="bench",
+            epoch=EPOCH,
+            proof=None,
+            dropbox_index=0,
+        )
+        transport = EpochTransport(Transport(configuration), EPOCH)
+        role = LockFreeDropbox(
+            transport=transport,
+            state_store=self.state_store(party_id),
+            sd=server_data,
+            role_keys=RoleKeyMaterial(private_key, None),
+        )
+        role.router = BenchRouter(self.network)
+        self.network.transports[server_data.pseudonym] = transport
+        return role
+
+    def form_committee(self):
+        """Sets up every party as if the committee had been formed and the hello/ready handshake had completed."""
+        now = datetime.utcnow()
+        for party_id, role in enumerate(self.committee):
+            role.party_id = party_id
+            role.peers = [
+                DropboxPeer(
+                    i,
+                    peer.server_data.id,
+                    pseudonym=peer.pseudonym,
+                    ready=True,
+                    local=peer is role,
+                    last_hello_ack=now,
+                    last_ready_ack=now,
+                    half_key=peer.server_data.half_key_map(),
+                )
+                for i, peer in enumerate(self.committee)
+            ]
+
+    def committee_ark(self) -> PrismMessage:
+        return PrismMessage(
+            msg_type=TypeEnum.ANNOUNCE_ROLE_KEY,
+            expiration=int(time.time()) + 86400,
+            worker_keys=[peer.server_data.half_key_map() for peer in self.committee],
+            secret_sharing=self.leader.sharing.parameters,
+            **self.leader.server_data.ark_data(),
+        )
+
+    def preproducts_claimed(self) -> int:
+        return sum(batch.next for batch in self.leader.preproducts.batches.values() if batch.owned)
+
+    def preproducts_ready(self) -> bool:
+        reserve = configuration.mpc_preproduct_batch_size * configuration.mpc_preproduct_refresh_threshold
+        return all(self.leader.preproducts.total_remaining(group, exact=True) >= reserve
+                   for group in self.leader.preproduct_groups())
+
+    async def run_party(self, role: LockFreeDropbox):
+        async with trio.open_nursery() as nursery:
+            role.batch_nursery = nursery
+            nursery.start_soon(role._transport.inner_transport.run)
+            nursery.start_soon(role.handler_loop, nursery, role.mpc_op_task, True, TypeEnum.MPC_REQUEST)
+            nursery.start_soon(role.handler_loop, nursery, role.handle_enc_peer, True, TypeEnum.ENCRYPT_PEER_MESSAGE)
+            nursery.start_soon(role.handler_loop, nursery, role.handle_mpc_batch, True, TypeEnum.MPC_BATCH)
+            if role.is_leader:
+                nursery.start_soon(role.preproduct_task)
+
+    async def store(self, stats: PhaseStats):
+        recipient = self.rng.choice(self.recipients)
+        message = PrismMessage(msg_type=TypeEnum.USER_MESSAGE, ciphertext=os.urandom(self.args.message_bytes))
+        request = decrypt(self.client.write_request(recipient, message, None), self.leader.private_key)
+
+        start = time.perf_counter()
+        with trio.move_on_after(self.args.op_timeout) as cancel_scope:
+            await self.leader.store_task(None, request)
+        self.record(stats, start, cancel_scope.cancelled_caught)
+        self.sent[recipient.pseudonym].append(message)
+
+    async def poll(self, stats: PhaseStats):
+        recipient = self.recipients[self.polls_started % len(self.recipients)]
+        self.polls_started += 1
+        nonce = os.urandom(16)
+        self.poll_recipients[nonce] = recipient.pseudonym
+        request = decrypt(self.client.read_request(recipient, nonce, [], None, None), self.leader.private_key)
+
+        start = time.perf_counter()
+        with trio.move_on_after(self.args.op_timeout) as cancel_scope:
+            await self.leader.poll_task(None, request)
+        self.record(stats, start, cancel_scope.cancelled_caught)
+        self.collect_replies()
+
+    @staticmethod
+    def record(stats: PhaseStats, start: float, failed: bool):
+        if failed:
+            stats.failures += 1
+        else:
+            stats.ops += 1
+            stats.latencies.append(time.perf_counter() - start)
+
+    def collect_replies(self):
+        """Matches replies to the messages stored for the recipient that polled for them. Concurrent polls for the
+        same recipient can retrieve the same fragments, which are counted as duplicates rather than mismatches."""
+        replies, self.network.replies = self.network.replies, []
+        for reply in replies:
+            if not self.registry.is_mine(reply):
+                continue
+            recipient = self.poll_recipients[reply.enc_dropbox_response_id]
+            message = self.registry.reassemble(reply)
+            expected = self.sent[recipient]
+            if message in expected:
+                expected.remove(message)
+                self.delivered[recipient].append(message)
+                self.retrieved += 1
+            elif message in self.delivered[recipient]:
+                self.duplicates += 1
+            else:
+                self.mismatched += 1
+
+    async def phase(self, name: str, count: int, op) -> PhaseStats:
+        stats = PhaseStats(name)
+        bytes_before = self.network.bytes_sent
+        messages_before = self.network.messages_sent
+        claimed_before = self.preproducts_claimed()
+        limiter = trio.CapacityLimiter(self.args.concurrency)
+
+        async def limited():
+            async with limiter:
+                await op(stats)
+
+        start = time.perf_counter()
+        async with trio.open_nursery() as nursery:
+            for _ in range(count):
+                nursery.start_soon(limited)
+        stats.elapsed = time.perf_counter() - start
+
+        stats.bytes_sent = self.network.bytes_sent - bytes_before
+        stats.messages_sent = self.network.messages_sent - messages_before
+        stats.preproducts_consumed = self.preproducts_claimed() - claimed_before
+        return stats
+
+    async def run(self) -> List[PhaseStats]:
+        results = []
+        async with trio.open_nursery() as nursery:
+            self.network.nursery = nursery
+            for role in self.committee:
+                nursery.start_soon(self.run_party, role)
+
+            start = time.perf_counter()
+            with trio.fail_after(self.args.op_timeout):
+                while not self.preproducts_ready():
+                    await trio.sleep(0.05)
+            warmup = PhaseStats("preprocess", ops=1, elapsed=time.perf_counter() - start,
+                                bytes_sent=self.network.bytes_sent, messages_sent=self.network.messages_sent)
+            warmup.latencies.append(warmup.elapsed)
+            results.append(warmup)
+
+            results.append(await self.phase("store", self.args.stores, self.store))
+            results.append(await self.phase("poll", self.args.polls, self.poll))
+
+            # Preprocessing still in flight complains about the peers going away when cancelled
+            if not self.args.verbose:
+                logging.getLogger("prism").setLevel(logging.CRITICAL)
+            nursery.cancel_scope.cancel()
+
+        return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the lock-free MPC dropbox in a single process.")
+    parser.add_argument("--parties", type=int, default=4, help="Committee size")
+    parser.add_argument("--threshold", type=int, default=2, help="Secret sharing threshold")
+    parser.add_argument("--stores", type=int, default=50, help="Number of messages to store")
+    parser.add_argument("--polls", type=int, default=10, help="Number of poll requests")
+    parser.add_argument("--recipients", type=int, default=5, help="Number of distinct recipient pseudonyms")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent requests per phase")
+    parser.add_argument("--message-bytes", type=int, default=1000, help="Size of each stored message")
+    parser.add_argument("--batch-size", type=int, help="Preproduct batch size (default from configuration)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated one-way latency between parties")
+    parser.add_argument("--op-timeout", type=float, default=300, help="Seconds before an operation counts as failed")
+    parser.add_argument("--no-encrypt", action="store_true", help="Do not encrypt messages between parties")
+    parser.add_argument("--state-dir", type=Path, help="Persist party state here instead of in memory")
+    parser.add_argument("--state-journal", action="store_true", help="Journal changes to persisted state")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show server logging")
+    return parser.parse_args(argv)
+
+
+def print_report(results: List[PhaseStats], benchmark: DropboxBenchmark, as_json: bool):
+    reports = [stats.report() for stats in results]
+    summary = {
+        "phases": reports,
+        "retrieved": benchmark.retrieved,
+        "duplicates": benchmark.duplicates,
+        "mismatched": benchmark.mismatched,
+        "unretrieved": sum(len(messages) for messages in benchmark.sent.values()),
+    }
+
+    if as_json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    columns = ["phase", "ops", "failures", "elapsed_s", "ops_per_s", "p50_ms", "p90_ms", "p99_ms", "max_ms",
+               "preproducts_per_op", "bytes_per_op", "messages_per_op"]
+    print("  ".join(f"{column:>12}" for column in columns))
+    for report in reports:
+        print("  ".join(f"{report[column]:>12.2f}" if isinstance(report[column], float) else f"{report[column]:>12}"
+                        for column in columns))
+    print(f"\nRetrieved {summary['retrieved']} messages, {summary['unretrieved']} not retrieved, "
+          f"{summary['duplicates']} duplicates, {summary['mismatched']} mismatched.")
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    init_logging()
+    if not args.verbose:
+        logging.getLogger("prism").setLevel(logging.WARNING)
+
+    overrides = {
+        "mpc_nparties": args.parties,
+        "threshold": args.threshold,
+        "mpc_lf_encrypt_peer": not args.no_encrypt,
+        # Spans are still created, but not reported anywhere
+        "production": True,
+    }
+    if args.batch_size:
+        overrides["mpc_preproduct_batch_size"] = args.batch_size
+    if args.state_journal:
+        overrides["state_journal"] = True
+    load_dict_config(overrides)
+    init_tracer(structlog.get_logger("prism"), configuration, service="dropbox-benchmark")
+
+    benchmark = DropboxBenchmark(args)
+    results = trio.run(benchmark.run)
+    print_report(results, benchmark, args.json)
+
+
+if __name__ == "__main__":
+    main()
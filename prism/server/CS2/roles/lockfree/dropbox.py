@@ -21,6 +21,7 @@ from typing import List, Dict, Set, Optional, Tuple
 
 from prism.common.crypto.halfkey import PublicKey
 from prism.server.CS2.roles.lockfree.fragment import Fragment
+from prism.server.CS2.roles.lockfree.fragment_index import FragmentIndex
 from prism.server.CS2.roles.lockfree.mpc import MPCRole, mpc_op
 from prism.server.CS2.roles.lockfree.peer import DropboxPeer
 from prism.server.CS2.roles.lockfree.poll import Poll
@@ -28,6 +29,7 @@ from prism.common.message import PrismMessage, Share, TypeEnum, ActionEnum, Half
 from prism.common.config import configuration
 from prism.common.crypto.server_message import decrypt, encrypt_data
 from prism.common.crypto.util import make_nonce
+from prism.common.state import StateChanges
 from prism.common.tracing import inject_span_context, extract_span_context, PrismScope
 
 
@@ -47,8 +49,8 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
     LockFreeDropbox.retrieve_task().
     """
 
-    peers: List[DropboxPeer]
     stored_fragments: Dict[bytes, Fragment]
+    fragment_index: FragmentIndex
     retrieved_fragments: Set[bytes]
 
     def __init__(self, **kwargs):
@@ -56,6 +58,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
 
         self.stored_fragments = {}
         self.retrieved_fragments = set()
+        self._fragment_changes = StateChanges()
         self.store_limiter = trio.CapacityLimiter(configuration.mpc_lf_concurrent_store_limit)
         self.find_limiter = trio.CapacityLimiter(configuration.mpc_lf_concurrent_find_limit)
         self.active_polls = []
@@ -126,7 +129,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
         for response in await self.send_and_gather(peers, requests,
                                                    timeout_sec=configuration.mpc_lf_store_timeout *
                                                                configuration.mpc_lf_timeout_mult):
-            self.peers[response.party_id].stored_fragments.add(fragment_id)
+            self.fragment_index.add(self.peers[response.party_id], fragment_id)
         self.save_committee()
 
         stored_peers = [peer for peer in self.online_peers if fragment_id in peer.stored_fragments and peer.ready]
@@ -153,6 +156,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
         share = Share(decrypted.pseudonym_share, self.party_id)
         fragment = Fragment(fragment_id, share, decrypted.ciphertext, context)
         self.stored_fragments[fragment_id] = fragment
+        self._fragment_changes.set(("stored", fragment_id.hex()), fragment.json())
         self.save_fragments()
 
         with self.trace("store-fragment", context) as scope:
@@ -161,7 +165,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
                 scope.debug(f"STO: trace {scope.trace_id}, share: {decrypted.pseudonym_share}, "
                             f"party_id {self.party_id}")
 
-        self.peers[self.party_id].stored_fragments.add(fragment_id)
+        self.fragment_index.add(self.peers[self.party_id], fragment_id)
         self.save_committee()
 
         await self.respond_to(message, op_success=True)
@@ -185,13 +189,13 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
             while poll.live:
                 threshold = self.sharing.threshold
                 limit = configuration.mpc_lf_find_limit
-                fragments_to_check = poll.fragments_to_check(self.online_peers, threshold, limit)
+                fragments_to_check = self.fragments_to_check(poll, threshold, limit)
 
                 while fragments_to_check and (not poll.expiration or poll.live):
                     self.find_limiter.total_tokens = configuration.mpc_lf_concurrent_find_limit
                     async with self.find_limiter:
                         await self.attempt_poll_task(nursery, poll, fragments_to_check)
-                    fragments_to_check = poll.fragments_to_check(self.online_peers, threshold, limit)
+                    fragments_to_check = self.fragments_to_check(poll, threshold, limit)
 
                 # If the poll has no expiration date, then finish after checking once
                 if not poll.expiration:
@@ -203,6 +207,10 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
             scope.debug(f"POLL: Poll request {poll.nonce.hex()[:6]} ended.")
         self.active_polls.remove(poll)
 
+    def fragments_to_check(self, poll: Poll, threshold: int, limit: int) -> Set[bytes]:
+        party_ids = {peer.party_id for peer in self.online_peers}
+        return poll.fragments_to_check(self.fragment_index, party_ids, threshold, limit)
+
     def peers_for_fragments(self, poll: Poll, fragments: Set[bytes]) -> List[DropboxPeer]:
         """Picks some peers to use for a check task. Tries to pick a set of peers of size threshold+1 if available,
         but will settle for threshold peers."""
@@ -265,8 +273,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
             poll.scope.error("POLL: Not enough successful results to finish retrieve.")
             return set()
 
-        shares = list(zip(*(m.mpc_map.shares for m in successes)))
-        results = [self.sharing.open(share_set) for share_set in shares]
+        results = self.sharing.open_all(zip(*(m.mpc_map.shares for m in successes)))
         poll.scope.debug(f"Results: {results}")
         checked_fragment_ids = [frag_id for frag_id, result in zip(list(fragments), results) if result is not None]
         poll.checked_fragments.update(checked_fragment_ids)
@@ -293,7 +300,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
 
         pseudo_share = Share(read_peer.pseudonym_share, self.party_id)
         frags = [self.stored_fragments.get(fragment_id, Fragment.dummy()) for fragment_id in targets]
-        diffs = [self.sharing.sub(frag.pseudonym_share, pseudo_share) for frag in frags]
+        diffs = self.sharing.sub_all([frag.pseudonym_share for frag in frags], [pseudo_share] * len(frags))
 
         rand_diffs = await self.mulm(
             diffs,
@@ -391,7 +398,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
         request = self.request(self.handle_delete_op, op_id, target_fragments=[message.fragment_id])
         peers = [peer for peer in self.online_peers if message.fragment_id in peer.stored_fragments]
         for peer in peers:
-            peer.stored_fragments.remove(message.fragment_id)
+            self.fragment_index.remove(peer, message.fragment_id)
         # Don't await a response, because we don't actually care
         await self.send_to_peers(peers, request)
 
@@ -511,6 +518,8 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
             if frag_to_delete:
                 self._logger.debug(f"DEL: Deleted {frag_to_delete}")
                 self.retrieved_fragments.add(fragment_id)
+                self._fragment_changes.delete(("stored", fragment_id.hex()))
+                self._fragment_changes.set(("retrieved", fragment_id.hex()), True)
                 self.save_fragments()
 
     @property
@@ -527,6 +536,15 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
 
         return True
 
+    @property
+    def peers(self) -> List[DropboxPeer]:
+        return self._peers
+
+    @peers.setter
+    def peers(self, peers: List[DropboxPeer]):
+        self._peers = peers
+        self.fragment_index = FragmentIndex(peers)
+
     # Overridden for type checking
     @property
     def online_peers(self) -> List[DropboxPeer]:
@@ -613,15 +631,19 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
         for frag_id, fragment in self.stored_fragments.items():
             logger.debug(f"  {frag_id.hex()[:8]} -> {fragment}")
 
-    def save_fragments(self):
-        d = {
+    def fragments_json(self) -> dict:
+        return {
             "stored": {
                 fragment_id.hex(): fragment.json()
                 for fragment_id, fragment in self.stored_fragments.items()
             },
-            "retrieved": [fragment_id.hex() for fragment_id in self.retrieved_fragments]
+            # a map rather than a list, so that retrieved fragments can be saved one at a time
+            "retrieved": {fragment_id.hex(): True for fragment_id in self.retrieved_fragments},
         }
-        self._state_store.save_state("dropbox-lf-fragments", d)
+
+    def save_fragments(self):
+        changes, self._fragment_changes = self._fragment_changes, StateChanges()
+        self._state_store.save_changes("dropbox-lf-fragments", changes, self.fragments_json)
 
     def load_fragments(self):
         state = self._state_store.load_state("dropbox-lf-fragments")
@@ -632,6 +654,7 @@ class LockFreeDropbox(MPCRole, registry_name="DROPBOX_LF"):
             bytes.fromhex(fragment_id): Fragment.from_json(fragment)
             for fragment_id, fragment in state["stored"].items()
         }
+        # older states list the retrieved fragments
         self.retrieved_fragments = {bytes.fromhex(fragment_id) for fragment_id in state["retrieved"]}
 
     def save_committee(self):
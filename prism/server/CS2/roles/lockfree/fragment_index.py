@@ -0,0 +1,112 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple
+
+from prism.server.CS2.roles.lockfree.peer import DropboxPeer
+
+
+class FragmentBucket:
+    """
+    The fragments held by exactly the same set of peers, in the order they joined the bucket.
+    Every entry is tagged with a sequence number that only ever grows, so that a poll can resume a scan after the
+    last entry it looked at. Fragments that leave the bucket are dropped lazily.
+    """
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.fragments: List[bytes] = []
+        self.live: Dict[bytes, int] = {}
+
+    def __len__(self):
+        return len(self.live)
+
+    def append(self, fragment_id: bytes, seq: int):
+        self.seqs.append(seq)
+        self.fragments.append(fragment_id)
+        self.live[fragment_id] = seq
+
+    def discard(self, fragment_id: bytes):
+        self.live.pop(fragment_id, None)
+        if len(self.seqs) > 2 * len(self.live) + 16:
+            entries = [(seq, frag) for seq, frag in zip(self.seqs, self.fragments) if self.live.get(frag) == seq]
+            self.seqs = [seq for seq, _ in entries]
+            self.fragments = [frag for _, frag in entries]
+
+    def scan(self, after: int) -> Iterator[Tuple[int, bytes]]:
+        """Yields (seq, fragment_id) for the fragments in the bucket with a sequence number greater than after."""
+        for i in range(bisect_right(self.seqs, after), len(self.seqs)):
+            seq, fragment_id = self.seqs[i], self.fragments[i]
+            if self.live.get(fragment_id) == seq:
+                yield seq, fragment_id
+
+
+class FragmentIndex:
+    """
+    Tracks which peers hold each stored fragment, grouping fragments into buckets keyed by the set of party IDs that
+    hold them. All changes to DropboxPeer.stored_fragments should go through add() and remove() to keep the index
+    up to date.
+    """
+
+    def __init__(self, peers: Iterable[DropboxPeer] = ()):
+        self.holders: Dict[bytes, FrozenSet[int]] = {}
+        self.buckets: Dict[FrozenSet[int], FragmentBucket] = {}
+        self._seq = 0
+
+        held: Dict[bytes, Set[int]] = {}
+        for peer in peers:
+            for fragment_id in peer.stored_fragments:
+                held.setdefault(fragment_id, set()).add(peer.party_id)
+        for fragment_id, party_ids in held.items():
+            self._move(fragment_id, frozenset(party_ids))
+
+    def __len__(self):
+        return len(self.holders)
+
+    def add(self, peer: DropboxPeer, fragment_id: bytes):
+        """Records that peer now stores fragment_id."""
+        peer.stored_fragments.add(fragment_id)
+        holders = self.holders.get(fragment_id, frozenset())
+        if peer.party_id not in holders:
+            self._move(fragment_id, holders | {peer.party_id})
+
+    def remove(self, peer: DropboxPeer, fragment_id: bytes):
+        """Records that peer no longer stores fragment_id."""
+        peer.stored_fragments.discard(fragment_id)
+        holders = self.holders.get(fragment_id, frozenset())
+        if peer.party_id in holders:
+            self._move(fragment_id, holders - {peer.party_id})
+
+    def _move(self, fragment_id: bytes, holders: FrozenSet[int]):
+        old = self.holders.pop(fragment_id, None)
+        if old is not None:
+            bucket = self.buckets[old]
+            bucket.discard(fragment_id)
+            if not bucket:
+                del self.buckets[old]
+
+        if not holders:
+            return
+
+        self._seq += 1
+        self.holders[fragment_id] = holders
+        self.buckets.setdefault(holders, FragmentBucket()).append(fragment_id, self._seq)
+
+    def available(self, party_ids: Set[int], threshold: int) -> Iterator[Tuple[FrozenSet[int], FragmentBucket]]:
+        """Yields the buckets whose fragments are held by at least threshold of the given parties."""
+        for holders, bucket in self.buckets.items():
+            if len(holders & party_ids) >= threshold:
+                yield holders, bucket
@@ -11,6 +11,9 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+from typing import Any, Dict, Optional
+
+from prism.common.transport.enums import OverflowPolicy
 from prism.common.transport.transport import MessageHook, Package
 from prism.common.message import ActionEnum, TypeEnum
 
@@ -19,12 +22,25 @@ class MPCResponseHook(MessageHook):
     op_id: bytes
     op_action: ActionEnum
 
-    def __init__(self, pseudonym: bytes, party_id: int, op_id: bytes, op_action: ActionEnum = None):
-        super().__init__()
+    def __init__(
+            self,
+            pseudonym: bytes,
+            party_id: int,
+            op_id: bytes,
+            op_action: ActionEnum = None,
+            expected: Optional[int] = None,
+    ):
+        # the waiting task stops listening after the expected number of responses, so the queue never needs more
+        # room, and put() must not block the transport's dispatch
+        super().__init__(expected, OverflowPolicy.DROP_NEWEST if expected else None)
+        self.expected = expected
+        self.surplus = 0
         self.pseudonym = pseudonym
         self.party_id = party_id
         self.op_id = op_id
         self.op_action = op_action
+        self.dispatch_types = frozenset([TypeEnum.MPC_RESPONSE])
+        self.dispatch_key = ("request_id", op_id)
 
     def match(self, package: Package) -> bool:
         message = package.message
@@ -45,3 +61,15 @@ class MPCResponseHook(MessageHook):
             return False
 
         return True
+
+    async def put(self, package: Package):
+        if self.expected and self.queued >= self.expected:
+            # more peers answered than the waiting task needs, which is normal rather than an overflow
+            self.surplus += 1
+            return
+        await super().put(package)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["surplus"] = self.surplus
+        return stats
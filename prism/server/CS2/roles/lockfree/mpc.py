@@ -15,9 +15,10 @@ import itertools
 import math
 import os
 import time
+from dataclasses import fields
 from datetime import datetime, timedelta
 from random import randrange
-from typing import List, Callable, Union, Sequence, Optional
+from typing import List, Callable, Union, Sequence, Optional, Dict, Tuple
 
 import structlog
 import trio
@@ -27,6 +28,7 @@ from prism.common.constant import TIMEOUT_MS_MAX
 from prism.common.logging import MPC_LOG
 from prism.common.util import frequency_limit
 from prism.server.CS2.roles.announcing_role import AnnouncingRole
+from prism.server.CS2.roles.lockfree.batcher import PeerBatcher
 from prism.server.CS2.roles.lockfree.hook import MPCResponseHook
 from prism.server.CS2.roles.lockfree.peer import Peer
 from prism.server.CS2.roles.lockfree.preproduct import PreproductStore, Triple, PreproductBatch
@@ -37,7 +39,7 @@ from prism.common.config import configuration
 from prism.common.crypto.halfkey.keyexchange import KeySystem
 from prism.common.crypto.server_message import decrypt, encrypt
 from prism.common.crypto.util import make_nonce
-from prism.common.tracing import inject_span_context
+from prism.common.tracing import inject_span_context, extract_span_context
 
 
 def mpc_op(a: ActionEnum):
@@ -52,6 +54,24 @@ def mpc_op(a: ActionEnum):
     return decorator
 
 
+def _action_handlers(cls: type) -> Dict[ActionEnum, Callable]:
+    """Collect the @mpc_op methods of a class, respecting overrides in subclasses."""
+    members = {}
+    for klass in reversed(cls.__mro__):
+        members.update(vars(klass))
+
+    return {
+        attr.__annotations__["action_enum"]: attr
+        for attr in members.values()
+        if callable(attr) and "action_enum" in getattr(attr, "__annotations__", {})
+    }
+
+
+# The fields that MPCRole.mpc_message() slots keyword arguments into
+_PRISM_FIELDS = frozenset(f.name for f in fields(PrismMessage))
+_MPC_FIELDS = frozenset(f.name for f in fields(MPCMap))
+
+
 class MPCRole(AnnouncingRole):
     """
     A base class for roles that perform MPC operations. Includes management of preproducts such as triples and shared
@@ -82,6 +102,12 @@ class MPCRole(AnnouncingRole):
     party_id: int
     preproducts: PreproductStore
     sharing: Sharing = None
+    # ActionEnum -> @mpc_op method, collected once per class
+    action_handlers: Dict[ActionEnum, Callable] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.action_handlers = _action_handlers(cls)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -93,6 +119,10 @@ class MPCRole(AnnouncingRole):
 
         self.peers = []
         self.party_id = -1
+        # Nursery for sending batched messages, only available while main() runs
+        self.batch_nursery: Optional[trio.Nursery] = None
+        self.batchers: Dict[int, PeerBatcher] = {}
+        self.sharings: Dict[Tuple[int, int, int], Sharing] = {}
 
         self.preproducts = PreproductStore(self._logger, self._mpc_logger, self._state_store)
         self.sharing = self.configure_secret_sharing()
@@ -144,16 +174,22 @@ class MPCRole(AnnouncingRole):
                 nursery.start_soon(self.preproduct_group_task, group)
 
     async def preproduct_group_task(self, group: List[Peer]):
-        # TODO Document
+        """
+        Keeps the supply of preproducts owned by exactly this group of peers above the refresh threshold.
+        Sleeps until claims bring the supply below the threshold, then generates batches until it is replenished.
+        """
         while True:
             batch_size = configuration.mpc_preproduct_batch_size
             min_reserve = batch_size * configuration.mpc_preproduct_refresh_threshold
-            remaining = self.preproducts.total_remaining(group, exact=True)
-            if remaining < min_reserve:
-                if all(self.online(peer) for peer in group):
-                    await self.generate_preproduct_task(batch_size, group)
-                elif frequency_limit("preproduct-peers-online"):
-                    self._logger.warning(f"Not enough peers online for preproducts with peer group {group}")
+            await self.preproducts.wait_for_shortage(group, min_reserve, exact=True)
+
+            if all(self.online(peer) for peer in group):
+                if await self.generate_preproduct_task(batch_size, group):
+                    continue
+            elif frequency_limit("preproduct-peers-online"):
+                self._logger.warning(f"Not enough peers online for preproducts with peer group {group}")
+
+            # Back off before retrying a failed batch or waiting for peers to come online
             await trio.sleep(0.1)
 
     def preproduct_groups(self) -> List[List[Peer]]:
@@ -208,9 +244,10 @@ class MPCRole(AnnouncingRole):
         timeout = configuration.mpc_lf_batch_timeout * configuration.mpc_lf_timeout_mult * batch_size + channel_padding
         return timeout
 
-    async def generate_preproduct_task(self, size: int, peers: List[Peer]):
+    async def generate_preproduct_task(self, size: int, peers: List[Peer]) -> bool:
         """
         Generates a batch of preproducts of a certain size with the listed peers.
+        Returns whether the batch was generated.
 
         Requires 3 rounds of communication.
         """
@@ -233,6 +270,7 @@ class MPCRole(AnnouncingRole):
             for success in successes:
                 self.peers[success.party_id].preproduct_batches.add(batch_id)
             self.save_committee()
+            self.preproducts.notify_changed()
             with self.trace(
                 "preprocessing-success", parent=preprocessing_context, batch_id=batch_id.hex(), timeout=timeout
             ) as scope:
@@ -248,8 +286,10 @@ class MPCRole(AnnouncingRole):
                     f"PRE: Batch {batch_id.hex()[:6]} failed, {len(successes)} responses after {duration}s "
                     f"from peers: {peers}."
                 )
-                if batch_id in self.preproducts.batches:
-                    del self.preproducts.batches[batch_id]
+                self.preproducts.remove_batch(batch_id)
+            return False
+
+        return True
 
     @mpc_op(ActionEnum.ACTION_OFFLINE_INIT)
     async def preproduct_op(self, message: PrismMessage):
@@ -352,11 +392,11 @@ class MPCRole(AnnouncingRole):
         high_degree = low_degree * 2
 
         # Step 1. Compute [x*y]_high = [x]_low * [y]_low
-        xy_high = [self.sharing.mul(x, y) for x, y in zip(xs, ys)]
+        xy_high = self.sharing.mul_all(xs, ys)
 
         # Step 2. Construct low and high degree shares of random numbers, [r]_low and [r]_high
         ss_low = self.sharing
-        ss_high = Sharing(nparties=ss_low.nparties, threshold=high_degree + 1, modulus=ss_low.modulus)
+        ss_high = self.sharing_for(high_degree + 1)
         rs = [randrange(1, self.sharing.modulus) for _ in range(len(xs))]
         local_r_low = [ss_low.share(r) for r in rs]
         local_r_high = [ss_high.share(r) for r in rs]
@@ -382,7 +422,7 @@ class MPCRole(AnnouncingRole):
 
         # Step 3. Add high degree random share to high degree product share, resulting in
         # [z]_high = [r-x*y]_high = [r]_high - [x*y]_high
-        z_high = [ss_high.sub(r, xy) for r, xy in zip(r_high, xy_high)]
+        z_high = ss_high.sub_all(r_high, xy_high)
 
         # Step 4. Open z
         zs = await self.open_multiple(
@@ -393,7 +433,7 @@ class MPCRole(AnnouncingRole):
             return []
 
         # Step 5. Return [x*y]_low = [r]_low - (r-x*y)
-        result = [ss_low.subc(r, z) for r, z in zip(r_low, zs)]
+        result = ss_low.subc_all(r_low, zs)
 
         if configuration.debug_extra:
             self._mpc_logger.debug(
@@ -444,8 +484,7 @@ class MPCRole(AnnouncingRole):
         )
         if not responses:
             return []
-        all_shares = zip(*(m.mpc_map.shares for m in responses))
-        return [sharing.open(shares) for shares in all_shares]
+        return sharing.open_all(zip(*(m.mpc_map.shares for m in responses)))
 
     async def mulm(
         self,
@@ -466,8 +505,8 @@ class MPCRole(AnnouncingRole):
         #        of our polynomial to skip the degree reduction via triple
         # if (self.sharing.threshold - 1) * 2 < len(peers):
         #     return [self.sharing.mul(x, y) for x, y in zip(xs, ys)]
-        epsilon_shares = [self.sharing.sub(x, t.a) for x, t in zip(xs, triples)]
-        delta_shares = [self.sharing.sub(y, t.b) for y, t in zip(ys, triples)]
+        epsilon_shares = self.sharing.sub_all(xs, [t.a for t in triples])
+        delta_shares = self.sharing.sub_all(ys, [t.b for t in triples])
 
         eds = await self.open_multiple(
             op_id,
@@ -482,7 +521,7 @@ class MPCRole(AnnouncingRole):
         epsilon_open = eds[: len(xs)]
         delta_open = eds[len(xs) :]
 
-        return [self.sharing.mul_ed(e, d, t) for e, d, t in zip(epsilon_open, delta_open, triples)]
+        return self.sharing.mul_ed_all(epsilon_open, delta_open, triples)
 
     async def distribute_shares(
         self,
@@ -543,8 +582,8 @@ class MPCRole(AnnouncingRole):
 
     def mpc_message(self, msg_type: TypeEnum, action: ActionEnum, op_id: bytes, **kwargs) -> PrismMessage:
         """Common constructor for MPC messages."""
-        prism_kws = {k: v for k, v in kwargs.items() if PrismMessage.lookup_field_index(k) != -1}
-        mpc_kws = {k: v for k, v in kwargs.items() if MPCMap.lookup_field_index(k) != -1}
+        prism_kws = {k: v for k, v in kwargs.items() if k in _PRISM_FIELDS}
+        mpc_kws = {k: v for k, v in kwargs.items() if k in _MPC_FIELDS}
 
         return PrismMessage(
             msg_type=msg_type,
@@ -599,7 +638,7 @@ class MPCRole(AnnouncingRole):
         Return a list of messages sorted by party ID, ascending.
         """
         responses = []
-        hook = MPCResponseHook(self.pseudonym, self.party_id, op_id, action)
+        hook = MPCResponseHook(self.pseudonym, self.party_id, op_id, action, expected=count)
         try:
             await self._transport.register_hook(hook)
             with trio.move_on_after(timeout_sec):
@@ -659,7 +698,52 @@ class MPCRole(AnnouncingRole):
             context: SpanContext = None,
             timeout_sec: float = math.inf,
     ) -> bool:
-        """Send a message to a specific peer."""
+        """Send a message to a specific peer, batched with other messages sent to that peer at about the same time."""
+        delay_ms = configuration.get("mpc_lf_batch_delay_ms", 0)
+        if peer.local or delay_ms <= 0 or not self.batch_nursery:
+            return await self.send_package(peer, message, context, timeout_sec)
+
+        batcher = self.batchers.get(peer.party_id)
+        if not batcher:
+            async def send_batch(messages: List[PrismMessage], contexts: List[SpanContext], batch_timeout: float):
+                return await self.send_batch(self.peers[peer.party_id], messages, contexts, batch_timeout)
+
+            batcher = PeerBatcher(send_batch, self.batch_nursery, delay_ms / 1000,
+                                  configuration.mpc_lf_batch_max_bytes)
+            self.batchers[peer.party_id] = batcher
+
+        return await batcher.send(message, context, timeout_sec)
+
+    async def send_batch(
+            self,
+            peer: Peer,
+            messages: List[PrismMessage],
+            contexts: List[Optional[SpanContext]],
+            timeout_sec: float = math.inf,
+    ) -> bool:
+        """Send several messages to a peer in a single MPC_BATCH envelope, split up again by handle_mpc_batch.
+        Each message carries its own span context, and the envelope is sent in the context of the first."""
+        if len(messages) == 1:
+            return await self.send_package(peer, messages[0], contexts[0], timeout_sec)
+
+        submessages = []
+        for message, context in zip(messages, contexts):
+            # Keep the hashes of identical messages distinct once they are split up
+            if not message.nonce:
+                message = message.clone(nonce=make_nonce())
+            submessages.append(inject_span_context(message, context))
+
+        batch = PrismMessage(msg_type=TypeEnum.MPC_BATCH, party_id=self.party_id, submessages=submessages)
+        return await self.send_package(peer, batch, contexts[0], timeout_sec)
+
+    async def send_package(
+            self,
+            peer: Peer,
+            message: PrismMessage,
+            context: SpanContext = None,
+            timeout_sec: float = math.inf,
+    ) -> bool:
+        """Encrypt and address a message for a specific peer, then send it immediately."""
         if not peer.local:
             message = self.encrypt_peer_message(peer, message)
 
@@ -688,6 +772,15 @@ class MPCRole(AnnouncingRole):
         else:
             self._logger.error(f"Got request for unknown op: {action}")
 
+    def sharing_for(self, threshold: int) -> Sharing:
+        """A sharing system like self.sharing, but with a different threshold. Created once and then reused."""
+        key = (self.sharing.nparties, threshold, self.sharing.modulus)
+        sharing = self.sharings.get(key)
+        if not sharing:
+            sharing = Sharing(nparties=key[0], threshold=threshold, modulus=key[2])
+            self.sharings[key] = sharing
+        return sharing
+
     def configure_secret_sharing(self) -> Sharing:
         """Generate a Sharing object for performing secret sharing operations using parameters from config."""
         nparties = configuration.get("mpc_nparties")
@@ -805,12 +898,7 @@ class MPCRole(AnnouncingRole):
         """
         Figures out the op that should handle an MPC_REQUEST with the given ActionEnum.
         """
-        for item in dir(self.__class__):
-            attr = getattr(self.__class__, item)
-            if not callable(attr) or not hasattr(attr, "__annotations__"):
-                continue
-            if attr.__annotations__.get("action_enum") == action:
-                return attr
+        return self.action_handlers.get(action)
 
     def encrypt_peer_message(self, peer: Peer, message: PrismMessage) -> Optional[PrismMessage]:
         if not peer.half_key or not peer.last_hello_ack or not configuration.mpc_lf_encrypt_peer:
@@ -818,7 +906,7 @@ class MPCRole(AnnouncingRole):
 
         nonce = make_nonce()
         peer_key = peer.half_key.to_key()
-        ciphertext = encrypt(message, private_key=self.private_key, peer_key=peer_key, nonce=nonce)
+        ciphertext = encrypt(message, private_key=self.private_key, peer_key=peer_key, nonce=nonce, cache_key=True)
 
         if not ciphertext:
             self._logger.debug(f"Failed to encrypt message for {peer}")
@@ -840,7 +928,7 @@ class MPCRole(AnnouncingRole):
             return
 
         peer_key = source_peer.half_key.to_key()
-        decrypted = decrypt(message, self.private_key, pub_key=peer_key)
+        decrypted = decrypt(message, self.private_key, pub_key=peer_key, cache_key=True)
         if decrypted:
             decrypted = decrypted.clone(
                 dest_party_id=message.dest_party_id,
@@ -848,6 +936,15 @@ class MPCRole(AnnouncingRole):
             )
             await self._transport.local_link.send(decrypted, context)
 
+    async def handle_mpc_batch(self, _nursery: trio.Nursery, message: PrismMessage, context: SpanContext):
+        """Splits a batch of messages from a peer, so that each is matched against hooks on its own."""
+        for submessage in message.submessages or []:
+            submessage = submessage.clone(
+                dest_party_id=message.dest_party_id,
+                pseudonym=(submessage.pseudonym or message.pseudonym)
+            )
+            await self._transport.local_link.send(submessage, extract_span_context(submessage) or context)
+
     def debug_dump(self, logger):
         super().debug_dump(logger)
         logger.debug("Peers:")
@@ -866,9 +963,20 @@ class MPCRole(AnnouncingRole):
             self._logger.error("MPCRole started with no configured peers")
             return
 
-        async with trio.open_nursery() as nursery:
-            nursery.start_soon(super().main)
-            nursery.start_soon(self.preproduct_task)
-            nursery.start_soon(self.handler_loop, nursery, self.mpc_op_task, True, TypeEnum.MPC_REQUEST)
-            nursery.start_soon(self.handler_loop, nursery, self.handle_enc_peer, True, TypeEnum.ENCRYPT_PEER_MESSAGE)
-            nursery.start_soon(self.handshake_task)
+        try:
+            async with trio.open_nursery() as nursery:
+                self.batch_nursery = nursery
+                nursery.start_soon(super().main)
+                nursery.start_soon(self.preproduct_task)
+                nursery.start_soon(self.handler_loop, nursery, self.mpc_op_task, True, TypeEnum.MPC_REQUEST)
+                nursery.start_soon(self.handler_loop, nursery, self.handle_enc_peer, True,
+                                   TypeEnum.ENCRYPT_PEER_MESSAGE)
+                nursery.start_soon(self.handler_loop, nursery, self.handle_mpc_batch, True, TypeEnum.MPC_BATCH)
+                nursery.start_soon(self.handshake_task)
+        finally:
+            self.batch_nursery = None
+            self.batchers.clear()
+            self.sharings.clear()
+
+
+MPCRole.action_handlers = _action_handlers(MPCRole)
@@ -13,16 +13,14 @@
 #  limitations under the License.
 from __future__ import annotations
 
-import random
 from dataclasses import dataclass, field
 from datetime import datetime
-from functools import reduce
-from typing import Optional, Dict, Set, List
+from typing import Optional, Dict, FrozenSet, Set, List
 
 import structlog
 from jaeger_client import SpanContext
 
-from prism.server.CS2.roles.lockfree.peer import DropboxPeer
+from prism.server.CS2.roles.lockfree.fragment_index import FragmentIndex
 from prism.common.transport.transport import Link
 from prism.common.message import PrismMessage, TypeEnum, HalfKeyMap, LinkAddress
 from prism.common.crypto.halfkey.keyexchange import PublicKey
@@ -40,6 +38,7 @@ class Poll:
     context: SpanContext
     link_addresses: List[LinkAddress]
     checked_fragments: Set[bytes] = field(default_factory=set)
+    cursors: Dict[FrozenSet[int], int] = field(default_factory=dict)
     links: List[Link] = field(default_factory=list)
     poll_logger = structlog.get_logger(__name__ + " Poll")
     scope: PrismScope = field(default=None)
@@ -59,37 +58,34 @@ class Poll:
     def trace(self) -> str:
         return self.context and hex(self.context.trace_id)[2:]
 
-    def fragments_to_check(self, peers: List[DropboxPeer], threshold: int, limit: int = 10) -> Set[bytes]:
+    def fragments_to_check(self, index: FragmentIndex, party_ids: Set[int], threshold: int, limit: int = 10) \
+            -> Set[bytes]:
         """
         Decides on a set of fragments to check against this poll request.
         For simplicity of checking, all fragments in the returned set must be
         available on a single subset of peers of size >= threshold.
-        """
 
-        # Step 1. Collect a set of stored fragments from all peers that we haven't already checked.
-        fragments = set()
-        for peer in peers:
-            fragments.update(peer.stored_fragments)
-        fragments.difference_update(self.checked_fragments)
-        fragments = list(fragments)
-
-        # Step 2. Select a pivot fragment that is available on #peers >= threshold
-        pivot = None
-        pivot_peers = None
-        random.shuffle(fragments)
-        for fragment in fragments:
-            pivot_peers = [peer for peer in peers if fragment in peer.stored_fragments]
-            if len(pivot_peers) >= threshold:
-                pivot = fragment
-                break
-
-        if not pivot:
-            return set()
-
-        # Step 3. Choose up to #limit fragments available on all the same peers as the pivot
-        peer_fragments = [peer.stored_fragments for peer in pivot_peers]
-        common_fragments = reduce(lambda acc, fragset: acc.intersection(fragset), peer_fragments)
-        return set(random.sample(list(common_fragments), min(len(common_fragments), limit)))
+        Fragments are taken from one bucket of the index at a time, resuming after the longest run of fragments in
+        that bucket that this poll has already checked, so the cost is proportional to the batch size.
+        """
+        for holders, bucket in index.available(party_ids, threshold):
+            cursor = self.cursors.get(holders, 0)
+            fragments = set()
+            for seq, fragment_id in bucket.scan(cursor):
+                if fragment_id in self.checked_fragments:
+                    if not fragments:
+                        cursor = seq
+                    continue
+
+                fragments.add(fragment_id)
+                if len(fragments) >= limit:
+                    break
+
+            self.cursors[holders] = cursor
+            if fragments:
+                return fragments
+
+        return set()
 
     def reply(self, submessages: List[PrismMessage]) -> PrismMessage:
         """Construct a reply to the polling client, given a list of retrieved encrypted submessages."""
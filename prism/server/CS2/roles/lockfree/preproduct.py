@@ -17,7 +17,7 @@ from typing import Dict, List, Optional, Set, Tuple
 
 import trio
 
-from prism.common.state import StateStore
+from prism.common.state import StateChanges, StateStore
 from prism.common.util import frequency_limit
 from prism.server.CS2.roles.lockfree.peer import Peer
 from prism.common.config import configuration
@@ -175,16 +175,33 @@ class PreproductBatch:
 
 
 class PreproductStore:
+    """
+    The preproduct batches this peer participates in.
+    Anything that changes the supply of preproducts must call notify_changed(), which wakes up the tasks waiting
+    in claim_chunk() for preproducts to arrive and in wait_for_shortage() for the supply to run low.
+    """
+
     batches: Dict[bytes, PreproductBatch]
 
     def __init__(self, logger, mpc_logger, state_store: StateStore):
         self.state_store = state_store
         self.batches = {}
+        self._changes = StateChanges()
         self._logger = logger
         self._mpc_logger = mpc_logger
+        self._changed = trio.Event()
 
         self.load_state()
 
+    def notify_changed(self):
+        self._changed.set()
+        self._changed = trio.Event()
+
+    async def wait_for_shortage(self, peers: List[Peer], level: int, exact: bool = False):
+        """Waits until fewer than level preproducts remain for the given peers."""
+        while self.total_remaining(peers, exact=exact) >= level:
+            await self._changed.wait()
+
     async def claim_chunk(self, size: int, peers: List[Peer]) -> PreproductInfo:
         """
         Return a chunk of preproducts from a batch that includes the requested peers.
@@ -196,7 +213,7 @@ class PreproductStore:
                 if frequency_limit("preproduct_availability"):
                     self._logger.debug("Awaiting preproduct availability.")
 
-                await trio.sleep(0.5)
+                await self._changed.wait()
                 continue
 
             my_batches = sorted(
@@ -215,6 +232,7 @@ class PreproductStore:
             to_claim = size
             for batch in my_batches:
                 batch_id, start, chunk_size = batch.claim_chunk(min(batch.remaining, to_claim))
+                self._changes.set(("batches", batch_id.hex(), "next"), batch.next)
                 batches.append(batch_id)
                 starts.append(start)
                 sizes.append(chunk_size)
@@ -225,6 +243,7 @@ class PreproductStore:
                     break
 
             self.save_state()
+            self.notify_changed()
             return PreproductInfo(batches, starts, sizes)
 
     def get_chunk(self, info: PreproductInfo) -> Optional[PreproductChunk]:
@@ -233,7 +252,11 @@ class PreproductStore:
         for batch_id, start, size in zip(info.batches, info.starts, info.sizes):
             if batch_id not in self.batches:
                 return None
-            chunk = self.batches[batch_id].get_chunk(start, size)
+            batch = self.batches[batch_id]
+            chunk = batch.get_chunk(start, size)
+            for i in range(start, min(start + size, batch.size)):
+                self._changes.set(("batches", batch_id.hex(), "triples", i), None)
+                self._changes.set(("batches", batch_id.hex(), "random_numbers", i), None)
             if not chunk:
                 return None
             triples.extend(chunk.triples)
@@ -253,19 +276,28 @@ class PreproductStore:
 
     def add_batch(self, batch: PreproductBatch):
         self.batches[batch.batch_id] = batch
+        self._changes.set(("batches", batch.batch_id.hex()), batch.json())
         self.save_state()
+        self.notify_changed()
         if configuration.debug_extra:
             self._mpc_logger.debug("Added batch", batch=batch.json())
 
-    def save_state(self):
-        d = {
+    def remove_batch(self, batch_id: bytes):
+        if self.batches.pop(batch_id, None):
+            self._changes.delete(("batches", batch_id.hex()))
+            self.notify_changed()
+
+    def state_json(self) -> dict:
+        return {
             "batches": {
                 batch_id.hex(): batch.json()
                 for batch_id, batch in self.batches.items()
             }
         }
 
-        self.state_store.save_state("preproduct", d)
+    def save_state(self):
+        changes, self._changes = self._changes, StateChanges()
+        self.state_store.save_changes("preproduct", changes, self.state_json)
 
     def load_state(self):
         state = self.state_store.load_state("preproduct")
@@ -13,7 +13,7 @@
 #  limitations under the License.
 from __future__ import annotations
 
-from typing import List, Optional, Sequence
+from typing import List, Optional, Sequence, Iterable, Union
 
 from prism.server.CS2.roles.lockfree.preproduct import Triple
 from prism.common.crypto.secretsharing import get_ssobj
@@ -68,6 +68,10 @@ class Sharing:
         attempting to calculate."""
         return Share(0, x=-1)
 
+    @staticmethod
+    def _is_dummy(share: Optional[Share]) -> bool:
+        return share is None or share.x == -1
+
     def share(self, secret: int) -> List[Share]:
         return self.secret_sharing.share(secret)
 
@@ -112,6 +116,84 @@ class Sharing:
             self.add(self.add(triple.c, self.mulc(triple.b, epsilon)), self.mulc(triple.a, delta)), epsilon * delta
         )
 
+    # Vector operations. Each takes whole sequences of shares and applies the corresponding scalar operation
+    # elementwise, with the same dummy handling, but without per-element dispatch through the decorator.
+
+    def open_all(self, share_sets: Iterable[Sequence[Share]]) -> List[Optional[int]]:
+        """Open many secrets at once. Each share set is handled as in open()."""
+        threshold = self.threshold
+        results: List[Optional[int]] = []
+        pending = []
+        for shares in share_sets:
+            real_shares = [share for share in shares if share and share.x != -1]
+            if len(real_shares) >= threshold:
+                pending.append((len(results), real_shares))
+            results.append(None)
+
+        opened = self.secret_sharing.reconstruct_all([real_shares for _, real_shares in pending])
+        for (i, _), value in zip(pending, opened):
+            results[i] = value
+        return results
+
+    def add_all(self, a: Sequence[Optional[Share]], b: Sequence[Optional[Share]]) -> List[Share]:
+        modulus = self.modulus
+        dummy = self.dummy
+        return [
+            dummy if self._is_dummy(x) or self._is_dummy(y) else Share((x.share + y.share) % modulus, x.x)
+            for x, y in zip(a, b)
+        ]
+
+    def sub_all(self, a: Sequence[Optional[Share]], b: Sequence[Optional[Share]]) -> List[Share]:
+        modulus = self.modulus
+        dummy = self.dummy
+        return [
+            dummy if self._is_dummy(x) or self._is_dummy(y) else Share((x.share - y.share) % modulus, x.x)
+            for x, y in zip(a, b)
+        ]
+
+    def subc_all(self, a: Sequence[Optional[Share]], b: Sequence[Optional[int]]) -> List[Share]:
+        modulus = self.modulus
+        dummy = self.dummy
+        return [
+            dummy if self._is_dummy(x) or y is None else Share((x.share - y) % modulus, x.x)
+            for x, y in zip(a, b)
+        ]
+
+    def mul_all(self, a: Sequence[Optional[Share]], b: Sequence[Optional[Share]]) -> List[Share]:
+        """Warning: Returns shares of a higher degree than the inputs."""
+        modulus = self.modulus
+        dummy = self.dummy
+        return [
+            dummy if self._is_dummy(x) or self._is_dummy(y) else Share((x.share * y.share) % modulus, x.x)
+            for x, y in zip(a, b)
+        ]
+
+    def mulc_all(self, a: Sequence[Optional[Share]], b: Union[int, Sequence[Optional[int]]]) -> List[Share]:
+        """Multiply each share by a constant, or by the corresponding element of a sequence of constants."""
+        if isinstance(b, int):
+            b = [b] * len(a)
+        modulus = self.modulus
+        dummy = self.dummy
+        return [
+            dummy if self._is_dummy(x) or y is None else Share((x.share * y) % modulus, x.x)
+            for x, y in zip(a, b)
+        ]
+
+    def mul_ed_all(
+        self, epsilons: Sequence[Optional[int]], deltas: Sequence[Optional[int]], triples: Sequence[Triple]
+    ) -> List[Share]:
+        """Finish a batch of Beaver multiplications: [xy] = [c] + e[b] + d[a] + ed"""
+        modulus = self.modulus
+        dummy = self.dummy
+        results = []
+        for e, d, t in zip(epsilons, deltas, triples):
+            if e is None or d is None or t is None or \
+                    self._is_dummy(t.a) or self._is_dummy(t.b) or self._is_dummy(t.c):
+                results.append(dummy)
+            else:
+                results.append(Share((t.c.share + t.b.share * e + t.a.share * d + e * d) % modulus, t.c.x))
+        return results
+
     @staticmethod
     def from_message(message: PrismMessage) -> Sharing:
         ss_map = message.secret_sharing
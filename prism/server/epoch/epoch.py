@@ -20,6 +20,7 @@ import structlog
 import trio
 
 from prism.common.crypto.halfkey import EllipticCurveDiffieHellman, PrivateKey
+from prism.common.crypto.server_message import SHARED_KEYS
 from prism.common.message import PrismMessage, TypeEnum, HalfKeyMap
 from prism.common.state import EpochStateStore
 from prism.common.transport.channel_select import rank_channels
@@ -197,6 +198,7 @@ class Epoch:
 
         self.logger.debug(f"Shutting down links for epoch {self.name}")
         await self.transport.shutdown()
+        SHARED_KEYS.forget(self.private_key)
 
     def save_data(self):
         return {
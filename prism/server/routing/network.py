@@ -11,11 +11,12 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import heapq
+from collections import defaultdict
 from time import time
-from typing import Optional, Set, Dict
+from typing import Optional, Set, Dict, Iterable, List, Tuple
 
 import trio
-from networkx import shortest_path, DiGraph
 
 from prism.common.logging import get_logger
 from prism.common.message import PrismMessage
@@ -24,6 +25,137 @@ from prism.server.CS2.ark_store import ArkStore
 from prism.server.routing.neighborhood import Neighborhood
 
 
+class ShortestPathTree:
+    """
+    A shortest-path tree (by hop count) rooted at the local node over the directed graph described by the LSP
+    database, maintained incrementally in the style of dynamic SPF: when the out-edges of one node change, only the
+    part of the tree below removed edges is recomputed, and added edges only propagate the distances they improve.
+    """
+
+    def __init__(self, root: bytes):
+        self.root = root
+        self.out_edges: Dict[bytes, Set[bytes]] = {}
+        self.in_edges: Dict[bytes, Set[bytes]] = defaultdict(set)
+        self.distance: Dict[bytes, int] = {root: 0}
+        self.parent: Dict[bytes, bytes] = {}
+        self.children: Dict[bytes, Set[bytes]] = defaultdict(set)
+        # the first hop on the path to every reachable node other than the root
+        self.first_hop: Dict[bytes, bytes] = {}
+
+    def set_edges(self, source: bytes, targets: Iterable[bytes]) -> bool:
+        """Replace the out-edges of source. Returns whether the set of reachable nodes changed."""
+        targets = set(targets)
+        targets.discard(source)
+        old_targets = self.out_edges.get(source, set())
+        removed = old_targets - targets
+        added = targets - old_targets
+        if not removed and not added:
+            return False
+
+        reachable_before = len(self.distance)
+        # apply removals before additions, so that reconnecting the nodes cut off by removed edges only relies on
+        # distances that are still valid
+        self.out_edges[source] = old_targets - removed
+        for target in removed:
+            self.in_edges[target].discard(source)
+            if not self.in_edges[target]:
+                del self.in_edges[target]
+        moved, lost = self._remove_edges(source, removed)
+
+        if targets:
+            self.out_edges[source] = targets
+        else:
+            self.out_edges.pop(source, None)
+        for target in added:
+            self.in_edges[target].add(source)
+        moved.extend(self._add_edges(source, added))
+        self._update_first_hops(moved)
+        return lost or reachable_before != len(self.distance)
+
+    def _detach(self, node: bytes):
+        parent = self.parent.pop(node, None)
+        if parent is not None:
+            self.children[parent].discard(node)
+        self.distance.pop(node, None)
+        self.first_hop.pop(node, None)
+
+    def _attach(self, node: bytes, parent: bytes, distance: int):
+        old_parent = self.parent.get(node)
+        if old_parent is not None:
+            self.children[old_parent].discard(node)
+        self.parent[node] = parent
+        self.children[parent].add(node)
+        self.distance[node] = distance
+
+    def _remove_edges(self, source: bytes, removed: Set[bytes]) -> Tuple[List[bytes], bool]:
+        """Returns the nodes that got a new parent, and whether any node became unreachable."""
+        # nodes that hang off a removed tree edge lose their distance, as does everything below them
+        orphans = [target for target in removed if self.parent.get(target) == source]
+        if not orphans:
+            return [], False
+
+        affected = set()
+        stack = orphans
+        while stack:
+            node = stack.pop()
+            if node in affected:
+                continue
+            affected.add(node)
+            stack.extend(self.children.get(node, ()))
+        for node in affected:
+            self._detach(node)
+
+        # reconnect the affected nodes through the remaining, unaffected part of the tree
+        heap = []
+        for node in affected:
+            for parent in self.in_edges.get(node, ()):
+                if parent in self.distance:
+                    heapq.heappush(heap, (self.distance[parent] + 1, node, parent))
+        moved = []
+        while heap:
+            distance, node, parent = heapq.heappop(heap)
+            if node in self.distance:
+                continue
+            self._attach(node, parent, distance)
+            moved.append(node)
+            for target in self.out_edges.get(node, ()):
+                if target not in self.distance:
+                    heapq.heappush(heap, (distance + 1, target, node))
+        return moved, len(moved) < len(affected)
+
+    def _add_edges(self, source: bytes, added: Set[bytes]) -> List[bytes]:
+        if source not in self.distance:
+            return []
+
+        queue = [(source, target) for target in added]
+        moved = []
+        while queue:
+            next_queue = []
+            for parent, node in queue:
+                distance = self.distance[parent] + 1
+                if node in self.distance and self.distance[node] <= distance:
+                    continue
+                self._attach(node, parent, distance)
+                moved.append(node)
+                next_queue.extend((node, target) for target in self.out_edges.get(node, ()))
+            queue = next_queue
+        return moved
+
+    def _update_first_hops(self, moved: List[bytes]):
+        # nodes that got a new parent pass their (possibly new) first hop down to their subtrees
+        updated = set()
+        for node in sorted(set(moved), key=lambda n: self.distance[n]):
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                if current in updated:
+                    continue
+                updated.add(current)
+                parent = self.parent[current]
+                self.first_hop[current] = current if parent == self.root else self.first_hop[parent]
+                stack.extend(self.children.get(current, ()))
+
+
 class LinkStateNetwork:
     def __init__(self, pseudonym: bytes, epoch: str, neighborhood: Neighborhood, ark_store: ArkStore):
         self.logger = get_logger(__name__, epoch=epoch)
@@ -32,7 +164,8 @@ class LinkStateNetwork:
         self.neighborhood = neighborhood
         self.ark_store = ark_store
         self.database: Dict[bytes, PrismMessage] = {}
-        self.routing_table: Dict[bytes, bytes] = {}
+        self.paths = ShortestPathTree(pseudonym)
+        self.routing_table: Dict[bytes, bytes] = self.paths.first_hop
 
     def __len__(self):
         return len(self.database)
@@ -49,39 +182,26 @@ class LinkStateNetwork:
             return False
 
         self.database[lsp.pseudonym] = lsp
-        self._update_routing_table()
+        self._update_routing_table(lsp.pseudonym)
         return True
 
-    def _update_routing_table(self):
-        previously_reachable = set(self.routing_table.keys())
+    def _update_routing_table(self, source: bytes):
+        """Apply the edges announced by the LSP from source to the shortest-path tree."""
+        lsp = self.database.get(source)
+        if lsp and (lsp.micro_timestamp / 1e6) + lsp.ttl > time():
+            targets = [neighbor.pseudonym for neighbor in lsp.neighbors]
+        else:
+            targets = []
 
-        cost_by_directional_edges = {
-            (source, neighbor.pseudonym): neighbor.cost
-            for source, lsp in self.database.items()
-            for neighbor in lsp.neighbors
-            if (lsp.micro_timestamp / 1e6) + lsp.ttl > time()
-        }
-
-        graph = DiGraph()
-
-        for (src, dst), cost in cost_by_directional_edges.items():
-            graph.add_weighted_edges_from([(src, dst, cost)])
-
-        if not graph.has_node(self.pseudonym):
+        if not self.paths.set_edges(source, targets):
             return
 
-        paths = shortest_path(graph, source=self.pseudonym)
-        self.routing_table = {target: path[1] for target, path in paths.items()
-                              if len(path) > 1 and target != self.pseudonym}
-
-        now_reachable = set(self.routing_table.keys())
-        self.ark_store.reachable_pseudonyms = now_reachable.union({self.pseudonym})
-        if now_reachable != previously_reachable:
-            with trace_context(self.logger,
-                               "updated-LS-table",
-                               epoch=self.epoch,
-                               lsp_table_size=len(self.routing_table)):
-                pass
+        self.ark_store.reachable_pseudonyms = set(self.routing_table.keys()).union({self.pseudonym})
+        with trace_context(self.logger,
+                           "updated-LS-table",
+                           epoch=self.epoch,
+                           lsp_table_size=len(self.routing_table)):
+            pass
 
     def _remove_expired(self):
         expired = []
@@ -89,10 +209,9 @@ class LinkStateNetwork:
             if (lsp.micro_timestamp / 1e6) + lsp.ttl < time():
                 expired.append(source)
 
-        if expired:
-            for source in expired:
-                del self.database[source]
-            self._update_routing_table()
+        for source in expired:
+            del self.database[source]
+            self._update_routing_table(source)
 
     def hop(self, destination: bytes) -> Optional[bytes]:
         if destination in self.neighborhood and self.neighborhood[destination].online:
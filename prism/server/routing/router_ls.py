@@ -37,7 +37,7 @@ from ...common.logging import get_logger
 from ...common.message_utils import encrypt_message
 from ...common.state import StateStore
 from ...common.tracing import trace_context
-from ...common.transport.enums import ConnectionType, LinkDirection
+from ...common.transport.enums import ConnectionType, LinkDirection, OverflowPolicy
 from ...common.transport.epoch_transport import EpochTransport
 from ...common.transport.hooks import MessageTypeHook
 from ...common.transport.transport import Link, MessageHook, Package
@@ -46,8 +46,11 @@ from ...common.util import frequency_limit, frequency_limit_reset, frequency_lim
 
 class DelegateAckHook(MessageHook):
     def __init__(self, request_id: bytes):
-        super().__init__()
+        # only the first ACK is of interest
+        super().__init__(capacity=1, overflow=OverflowPolicy.DROP_NEWEST)
         self.request_id = request_id
+        self.dispatch_types = frozenset([TypeEnum.LSP_FWD_ADDR_ACK])
+        self.dispatch_key = ("nonce", request_id)
 
     def match(self, package: Package) -> bool:
         return package.message.msg_type == TypeEnum.LSP_FWD_ADDR_ACK and package.message.nonce == self.request_id
@@ -769,6 +772,8 @@ class LinkStateRouter(Router):
         logger.debug(f"Ongoing floods: {self.flood_limiter.borrowed_tokens}/{self.flood_limiter.total_tokens}")
         logger.debug(f"Queued floods: {self.flood_limiter.statistics().tasks_waiting}")
         logger.debug(f"Originated floods: {self.floods_triggered}")
+        logger.debug(f"Seen messages: {len(self.deduplicator)} "
+                     f"({self.deduplicator.expired} expired, {self.deduplicator.evicted} evicted)")
 
         logger.debug(f"Router: Incoming links:")
         for link in self.incoming_links:
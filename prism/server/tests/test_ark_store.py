@@ -0,0 +1,71 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import os
+import random
+from time import time
+
+from prism.common.message import PrismMessage, TypeEnum
+from prism.common.state import DummyStateStore
+from prism.server.CS2.ark_store import ArkStore
+from prism.server.server_data import ServerData
+
+
+def make_ark(rng: random.Random) -> PrismMessage:
+    return PrismMessage(
+        msg_type=TypeEnum.ANNOUNCE_ROLE_KEY,
+        pseudonym=os.urandom(32),
+        name=f"prism-server-{rng.randint(1, 100000)}",
+        role="EMIX",
+        epoch="genesis",
+        expiration=int(time()) + 3600,
+        certificate=os.urandom(rng.randint(10, 400)),
+    )
+
+
+def test_broadcast_batches_fill_mtu():
+    rng = random.Random(7)
+    server_data = ServerData(
+        id="server", certificate=b"", DH_public_dict={}, pseudonym=os.urandom(32),
+        role_name="EMIX", committee="", epoch="genesis", proof=None,
+    )
+    store = ArkStore(DummyStateStore(), "genesis", server_data.pseudonym)
+    for _ in range(60):
+        ark = make_ark(rng)
+        store.record(ark)
+        store.reachable_pseudonyms.add(ark.pseudonym)
+
+    for mtu in [100, 600, 2000, 5000, 100000]:
+        expected_order = sorted(store.valid_servers, key=lambda s: s.last_broadcast)
+        message = store.broadcast_message(server_data, mtu)
+        if message is None:
+            assert len(message_for(server_data, expected_order[:1], int(time() * 1e6)).encode()) > mtu
+            continue
+
+        batch = message.submessages
+        assert batch == [rec.ark for rec in expected_order[: len(batch)]]
+        assert len(message.encode()) <= mtu
+        if len(batch) < len(expected_order):
+            larger = message_for(server_data, expected_order[: len(batch) + 1], message.micro_timestamp)
+            assert len(larger.encode()) > mtu
+
+
+def message_for(server_data: ServerData, records, micro_timestamp: int) -> PrismMessage:
+    return PrismMessage(
+        msg_type=TypeEnum.ARKS,
+        pseudonym=server_data.pseudonym,
+        epoch=server_data.epoch,
+        micro_timestamp=micro_timestamp,
+        submessages=[rec.ark for rec in records],
+        dead_servers=[],
+    )
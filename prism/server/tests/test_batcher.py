@@ -0,0 +1,86 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import trio
+
+from prism.common.message import PrismMessage, TypeEnum
+from prism.server.CS2.roles.lockfree.batcher import PeerBatcher
+
+
+async def test_batches_coalesce(autojump_clock):
+    sent = []
+
+    async def send(messages, contexts, _timeout):
+        assert len(contexts) == len(messages)
+        sent.append((trio.current_time(), [message.nonce for message in messages]))
+        return True
+
+    message_size = PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, nonce=bytes(1)).data_size()
+    results = []
+
+    async def send_one(i: int):
+        results.append(await batcher.send(PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, nonce=bytes([i]))))
+
+    async with trio.open_nursery() as nursery:
+        batcher = PeerBatcher(send, nursery, delay_sec=0.01, max_bytes=3 * message_size)
+        for i in range(5):
+            nursery.start_soon(send_one, i)
+        await trio.sleep(1)
+        nursery.start_soon(send_one, 5)
+
+    assert results == [True] * 6
+    # The first three messages fill a batch, the next two wait out the delay, and the last goes alone
+    assert [len(nonces) for _, nonces in sent] == [3, 2, 1]
+    assert sent[0][0] == 0 and sent[1][0] == 0.01
+    assert batcher.batches_sent == 3 and batcher.messages_sent == 6
+
+
+async def test_cancelled_sender_leaves_batch(autojump_clock):
+    sent = []
+
+    async def send(messages, _contexts, _timeout):
+        sent.append([message.nonce for message in messages])
+        return True
+
+    async with trio.open_nursery() as nursery:
+        batcher = PeerBatcher(send, nursery, delay_sec=0.01, max_bytes=10_000)
+        with trio.move_on_after(0.005):
+            await batcher.send(PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, nonce=b"gone"))
+        assert await batcher.send(PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, nonce=b"kept"))
+
+    assert sent == [[b"kept"]]
+
+
+async def test_batches_stay_under_max_bytes(autojump_clock):
+    sent = []
+
+    async def send(messages, _contexts, _timeout):
+        sent.append([message.nonce for message in messages])
+        return True
+
+    def message(nonce: bytes) -> PrismMessage:
+        return PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, nonce=nonce)
+
+    max_bytes = message(bytes(100)).data_size()
+    nonces = [bytes(40), bytes(40), bytes(40), bytes(200), bytes(10)]
+
+    async with trio.open_nursery() as nursery:
+        batcher = PeerBatcher(send, nursery, delay_sec=0.01, max_bytes=max_bytes)
+        for nonce in nonces:
+            nursery.start_soon(batcher.send, message(nonce))
+            await trio.sleep(0)
+
+    # The oversized message goes out on its own, and every other batch fits
+    assert [[len(nonce) for nonce in batch] for batch in sent] == [[40, 40], [40], [200], [10]]
+    for batch in sent:
+        assert len(batch) == 1 or sum(message(nonce).data_size() for nonce in batch) <= max_bytes
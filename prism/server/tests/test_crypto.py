@@ -23,6 +23,7 @@ from typing import *
 from prism.common.crypto.halfkey import EllipticCurveDiffieHellman
 from prism.common.crypto.halfkey.keyexchange import KeySystem
 from prism.common.crypto.ibe import IdentityBasedEncryption
+from prism.common.crypto.server_message import SharedKeyCache
 from prism.common.crypto.util import make_aes_key, make_nonce
 from prism.common.message import PrismMessage, TypeEnum
 from prism.common.message_utils import encrypt_user_message, decrypt_user_message
@@ -178,3 +179,22 @@ def test_ecc_loading():
     alice_public = alice_key.public_key()
     loaded_public = KeySystem.load_public(alice_public.cbor())
     assert alice_public == loaded_public
+
+
+def test_shared_key_cache():
+    alice_key = EllipticCurveDiffieHellman().generate_private()
+    bob_key = EllipticCurveDiffieHellman().generate_private()
+    peer_bob_key = KeySystem.load_public(bob_key.public_key().cbor())
+    cache = SharedKeyCache(max_size=2)
+
+    shared_key = cache.exchange(alice_key, peer_bob_key)
+    assert shared_key == alice_key.exchange(peer_bob_key, b'')
+    assert cache.exchange(alice_key, KeySystem.load_public(bob_key.public_key().cbor())) == shared_key
+    assert len(cache) == 1
+
+    for _ in range(3):
+        cache.exchange(bob_key, EllipticCurveDiffieHellman().generate_private().public_key())
+    assert len(cache) == 2, "cache is bounded"
+
+    cache.forget(bob_key)
+    assert len(cache) == 0
@@ -0,0 +1,59 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import time
+
+from prism.common.deduplicate import MessageDeduplicator
+from prism.common.message import LazyPrismMessage, PrismMessage, TypeEnum, DebugMap
+
+
+class Config(dict):
+    __getattr__ = dict.__getitem__
+
+
+def test_dedup_keys():
+    dedup = MessageDeduplicator(Config(msg_seen_ttl=100, msg_seen_sleep=10, msg_seen_max=0))
+    message = PrismMessage(msg_type=TypeEnum.USER_MESSAGE, nonce=b"nonce")
+    assert dedup.is_msg_new(message)
+    assert not dedup.is_msg_new(LazyPrismMessage(message.encode()))
+    debug = message.clone(debug_info=DebugMap(tag="tag"))
+    assert dedup.is_msg_new(debug)
+    assert not dedup.is_msg_new(LazyPrismMessage(debug.encode()))
+    assert dedup.is_msg_new(b"nonce")
+    assert not dedup.is_msg_new(b"nonce")
+    assert len(MessageDeduplicator.key(message)) == 16
+
+
+def test_dedup_expiry():
+    dedup = MessageDeduplicator(Config(msg_seen_ttl=100, msg_seen_sleep=10, msg_seen_max=0))
+    for i in range(10):
+        dedup.is_msg_new(bytes([i]))
+
+    now = time.monotonic()
+    assert dedup.purge(now + 50) == 0
+    assert dedup.purge(now + 120) == 10
+    assert len(dedup) == 0 and dedup.expired == 10
+    assert dedup.is_msg_new(bytes([0]))
+
+
+def test_dedup_cap():
+    dedup = MessageDeduplicator(Config(msg_seen_ttl=100, msg_seen_sleep=10, msg_seen_max=3))
+    for i in range(5):
+        dedup.is_msg_new(bytes([i]))
+    assert len(dedup) == 3 and dedup.evicted == 2
+
+    # seeing a key again makes it the most recent
+    assert not dedup.is_msg_new(bytes([2]))
+    dedup.is_msg_new(bytes([5]))
+    assert not dedup.is_msg_new(bytes([2]))
+    assert dedup.is_msg_new(bytes([3]))
@@ -0,0 +1,66 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from prism.server.CS2.roles.lockfree.fragment_index import FragmentIndex
+from prism.server.CS2.roles.lockfree.peer import DropboxPeer
+from prism.server.CS2.roles.lockfree.poll import Poll
+
+
+def make_poll() -> Poll:
+    return Poll(nonce=b"nonce", half_key=None, expiration=None, peer_fragments={}, context=None, link_addresses=[])
+
+
+def test_fragment_buckets():
+    peers = [DropboxPeer(i, f"peer{i}") for i in range(3)]
+    peers[0].stored_fragments.add(b"old")
+    index = FragmentIndex(peers)
+    assert index.holders == {b"old": {0}}
+
+    for i in range(20):
+        index.add(peers[0], bytes([i]))
+        index.add(peers[1], bytes([i]))
+    index.add(peers[2], bytes([0]))
+    assert len(index.buckets[frozenset({0, 1})]) == 19
+    assert bytes([0]) in peers[2].stored_fragments
+
+    index.remove(peers[0], b"old")
+    assert b"old" not in index.holders and frozenset({0}) not in index.buckets
+    assert [holders for holders, _ in index.available({0, 1}, 2)] == [frozenset({0, 1}), frozenset({0, 1, 2})]
+    assert not list(index.available({0, 2}, 3))
+
+
+def test_poll_cursor():
+    peers = [DropboxPeer(i, f"peer{i}") for i in range(2)]
+    index = FragmentIndex(peers)
+    for i in range(25):
+        for peer in peers:
+            index.add(peer, bytes([i]))
+
+    poll = make_poll()
+    checked = []
+    fragments = poll.fragments_to_check(index, {0, 1}, 2, limit=10)
+    while fragments:
+        assert len(fragments) <= 10
+        checked.extend(fragments)
+        poll.checked_fragments.update(fragments)
+        fragments = poll.fragments_to_check(index, {0, 1}, 2, limit=10)
+    assert sorted(checked) == [bytes([i]) for i in range(25)]
+    assert not poll.fragments_to_check(index, {0}, 2)
+
+    # Fragments stored after the poll started are still picked up
+    for peer in peers:
+        index.add(peer, b"new")
+    assert poll.fragments_to_check(index, {0, 1}, 2) == {b"new"}
+
+    # Fragments that were selected but never checked are offered again
+    assert poll.fragments_to_check(index, {0, 1}, 2) == {b"new"}
@@ -11,16 +11,23 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import hashlib
+from dataclasses import MISSING
 from enum import IntEnum
+from inspect import isclass
 from ipaddress import ip_address
+import os
+import random
 from time import sleep
+from typing import List
 
 import pytest
 from cbor2 import dumps, loads
 
 from prism.common.message import create_ARK, create_HKM, \
     PrismMessage, TypeEnum, HalfKeyMap, HalfKeyTypeEnum, ListenerMap, ServerMap, DebugMap, SecretSharingMap, \
-    SecretSharingType, MPCMap, ActionEnum
+    SecretSharingType, MPCMap, ActionEnum, CBORFactory, Share, PreproductInfo, DropboxModeType, CipherEnum, \
+    NeighborInfoMap, LinkAddress, LazyPrismMessage
 
 
 @pytest.fixture
@@ -45,6 +52,26 @@ def test_type_enum():
         TypeEnum(100)
 
 
+def test_enum_labels():
+    assert str(TypeEnum.READ_DROPBOX) == "Read Dropbox"
+    assert f"{TypeEnum.LSP:>5}" == "  LSP"
+    assert str(TypeEnum.LSP_FWD_ADDR) == "UNKNOWN TypeEnum (LSP_FWD_ADDR)"
+    assert str(ActionEnum.ACTION_STORE) == "store"
+    assert str(HalfKeyTypeEnum.ECDH) == "Elliptic Curve Diffie-Hellman"
+
+    for key in [3, "READ_DROPBOX", "Read Dropbox"]:
+        assert TypeEnum.lookup(key) is TypeEnum.READ_DROPBOX
+    assert ActionEnum.lookup("store") is ActionEnum.ACTION_STORE
+    with pytest.raises(KeyError):
+        TypeEnum.lookup("no such type")
+
+    assert TypeEnum.LSP_FLOOD.is_control and not TypeEnum.LSP_FLOOD.is_mpc
+    assert TypeEnum.MPC_RESPONSE.is_mpc
+    assert TypeEnum.ARKS.is_ark
+    assert TypeEnum.WRITE_OBLIVIOUS_DROPBOX.is_client
+    assert TypeEnum.ENC_LSP_FWD_ADDR.is_encrypted and not TypeEnum.LSP.is_encrypted
+
+
 def test_ARK():
     ark = create_ARK(b'', half_key=create_HKM({}),
                      name='test ARK', pseudonym=b'bla ba',
@@ -299,3 +326,177 @@ def test_mpc_hello():
     data = dumps(msg.as_cbor_dict())
     new_msg = PrismMessage.from_cbor_dict(loads(data))
     assert isinstance(new_msg, PrismMessage), 'message from CBOR is indeed PRISM'
+
+
+def reflective_as_cbor_dict(msg: CBORFactory) -> dict:
+    # reference implementation that reflects over the dataclass fields for every call
+    result = {}
+    for index, dc_field in enumerate(msg.__dataclass_fields__.values()):
+        value = getattr(msg, dc_field.name)
+        if value is not None:
+            if issubclass(dc_field.type if isclass(dc_field.type) else dc_field.type.__class__, CBORFactory):
+                result[index] = reflective_as_cbor_dict(value)
+            elif isinstance(value, IntEnum):
+                result[index] = int(value)
+            elif isinstance(value, List):
+                result[index] = [reflective_as_cbor_dict(x) if isinstance(x, CBORFactory) else x for x in value]
+            else:
+                result[index] = value
+    return result
+
+
+def reflective_from_cbor_dict(cls, d: dict):
+    # reference implementation that reflects over the dataclass fields for every call
+    arg_dict = {}
+    for index, feld in enumerate(cls.__dataclass_fields__.values()):
+        if not feld.init or d.get(index) is None:
+            continue
+        if issubclass(feld.type if isclass(feld.type) else feld.type.__class__, CBORFactory):
+            nested_cls = globals()[feld.metadata['cls']] if feld.type == CBORFactory else feld.type
+            arg_dict[feld.name] = reflective_from_cbor_dict(nested_cls, d[index])
+        elif isinstance(d[index], list):
+            args = feld.type.__args__
+            if isclass(args[0]) and issubclass(args[0], CBORFactory):
+                nested_cls = globals()[feld.metadata['cls']] if args[0] == CBORFactory else args[0]
+                arg_dict[feld.name] = [reflective_from_cbor_dict(nested_cls, x) for x in d[index]]
+            elif getattr(args[0], "__origin__", None) is tuple:
+                arg_dict[feld.name] = [tuple(datum) for datum in d[index]]
+            else:
+                arg_dict[feld.name] = d[index]
+        else:
+            arg_dict[feld.name] = feld.type(d[index])
+    return cls(**arg_dict)
+
+
+def codec_samples() -> List[CBORFactory]:
+    dh_map = HalfKeyMap(HalfKeyTypeEnum.ECDH, ECDH_public_bytes=b'bla bla')
+    lm = ListenerMap(IP_address=ip_address('192.168.33.44').packed, port=1234)
+    debug_map = DebugMap(trace_info=['uber-trace-id', '9a0cfe62a2a14233:7df423b8a2a5f089:233eecbc8f6db6e0:1'],
+                         tag='a tag')
+    mpc_map = MPCMap(action=ActionEnum.ACTION_STORE_FRAGMENT, request_id=b'12345', origin='foo',
+                     offline_params=[1.5, 2.0], share_pseudonym=Share(share=42, x=1),
+                     shares=[Share(share=1, x=1), Share(share=2, x=2, coeffcommits=[3, 4])],
+                     preproduct_info=PreproductInfo(batches=[b'batch'], starts=[0], sizes=[10]),
+                     participants=[0, 1, 2], target_fragments=[b'f1', b'f2'], op_success=True)
+    inner = PrismMessage(TypeEnum.USER_MESSAGE, messagetext='Hello Bob!', name='alice@example.com')
+    return [
+        dh_map,
+        lm,
+        debug_map,
+        mpc_map,
+        ServerMap(listening_on=[lm, lm]),
+        SecretSharingMap(sharing_type=SecretSharingType.SHAMIR, parties=5, threshold=4, modulus=123),
+        inner,
+        PrismMessage(TypeEnum.SEND_TO_DROPBOX, sub_msg=inner, half_key=dh_map, debug_info=debug_map, hop_count=2),
+        PrismMessage(TypeEnum.MPC_REQUEST, mpc_map=mpc_map, secret_sharing=SecretSharingMap(
+            sharing_type=SecretSharingType.SHAMIR, parties=5, threshold=4, modulus=123), party_id=3),
+        PrismMessage(TypeEnum.MPC_HELLO, hello_list=[(2, 'foo'), (0, 'bla')], worker_keys=[dh_map, dh_map]),
+        PrismMessage(TypeEnum.WRITE_OBLIVIOUS_DROPBOX, submessages=[inner, inner], dropbox_mode=DropboxModeType(1),
+                     cipher=CipherEnum.AES_GCM),
+        PrismMessage(TypeEnum.LSP, neighbors=[NeighborInfoMap(pseudonym=b'abc', cost=1)], ls_acks=[1, 2],
+                     link_addresses=[LinkAddress(channel_id='ch', link_address='addr')], degraded=False),
+    ]
+
+
+def test_codec_tables_match_reflection():
+    for msg in codec_samples():
+        cbor_dict = msg.as_cbor_dict()
+        assert cbor_dict == reflective_as_cbor_dict(msg)
+        decoded = loads(dumps(cbor_dict))
+        assert type(msg).from_cbor_dict(decoded) == reflective_from_cbor_dict(type(msg), decoded) == msg
+        assert type(msg).decode(msg.encode()) == msg
+
+
+def test_codec_field_indices():
+    for cls in [PrismMessage, MPCMap, HalfKeyMap, Share]:
+        for index, name in enumerate(cls.__dataclass_fields__):
+            assert cls.lookup_field_index(name) == index
+
+
+def test_digest_is_memoized(pm):
+    debug_pm = pm.clone(debug_info=DebugMap(tag="tag"))
+    assert debug_pm.digest() == hashlib.sha256(debug_pm.clone(debug_info=None).encode()).digest()
+    assert debug_pm.digest() is debug_pm.digest()
+    assert debug_pm.hexdigest() == debug_pm.digest().hex()
+    assert debug_pm.clone(messagetext="changed").digest() != debug_pm.digest()
+
+
+def test_clone_shares_nested_values(pm):
+    wrapped = PrismMessage(msg_type=TypeEnum.SEND_TO_EMIX, sub_msg=pm, ciphertext=b'payload')
+    cloned = wrapped.clone(hop_count=1, msg_type=int(TypeEnum.SEND_TO_DROPBOX), cipher=None)
+    assert cloned.hop_count == 1
+    assert cloned.msg_type is TypeEnum.SEND_TO_DROPBOX
+    assert cloned.sub_msg is pm
+    assert cloned.ciphertext is wrapped.ciphertext
+    assert wrapped.hop_count is None
+
+    # CBOR dicts for nested fields are still accepted:
+    assert wrapped.clone(sub_msg=pm.as_cbor_dict()).sub_msg == pm
+    assert wrapped.clone(no_such_field=1) == wrapped
+
+
+def test_lazy_decode(pm):
+    wrapped = PrismMessage(msg_type=TypeEnum.SEND_TO_EMIX, sub_msg=pm, pseudonym=b'pseudonym',
+                           debug_info=DebugMap(tag="tag"))
+    data = wrapped.encode()
+    lazy = LazyPrismMessage(data)
+    assert lazy.msg_type is TypeEnum.SEND_TO_EMIX
+    assert lazy.pseudonym == b'pseudonym'
+    assert lazy.nonce is None
+    assert lazy.sub_msg == pm
+    assert lazy.encode() is data
+    assert lazy.digest() == wrapped.digest()
+    assert lazy.materialize() == wrapped
+    assert lazy.clone(pseudonym=b'other').pseudonym == b'other'
+
+
+def sample_value(kind, target, rng: random.Random, depth: int):
+    if kind == "enum":
+        return rng.choice(list(target))
+    if kind == "nested":
+        return sample_factory(target if isclass(target) else PrismMessage, rng, depth + 1)
+    if kind == "list_nested":
+        nested_cls = target if isclass(target) else PrismMessage
+        return [sample_factory(nested_cls, rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    if kind == "list_tuple":
+        return [(rng.randint(0, 1000), "x" * rng.randint(0, 30)) for _ in range(rng.randint(0, 3))]
+    if kind == "list":
+        return [rng.choice([rng.randint(-2 ** 70, 2 ** 70), os.urandom(rng.randint(0, 30)), "ü" * 5, 0.5])
+                for _ in range(rng.randint(0, 30))]
+    if target is bool:
+        return rng.random() < 0.5
+    if target is int:
+        return rng.choice([0, 23, 24, 255, 256, 65536, 2 ** 32, -1, -25, -2 ** 40, 2 ** 64, -2 ** 64 - 1, 2 ** 100])
+    if target is bytes:
+        return os.urandom(rng.choice([0, 23, 24, 255, 256, 70000]))
+    if target is str:
+        return rng.choice(["", "hello", "x" * 300, "prism ∆ message"])
+    return None
+
+
+def sample_factory(cls, rng: random.Random, depth: int = 0):
+    table = cls._codec_table()
+    required = {name for name, feld in cls.__dataclass_fields__.items() if feld.default is MISSING}
+    values = {name: sample_value(kind, target, rng, depth)
+              for name, (kind, target) in table.init_fields.items()
+              if name in required or (depth < 2 and rng.random() < 0.7)}
+    return cls(**values)
+
+
+def test_data_size_matches_encoding():
+    rng = random.Random(19)
+
+    def subclasses(cls):
+        for subclass in cls.__subclasses__():
+            yield subclass
+            yield from subclasses(subclass)
+
+    for cls in subclasses(CBORFactory):
+        for _ in range(20):
+            factory = sample_factory(cls, rng)
+            assert factory.data_size() == len(factory.encode()), cls
+
+    for msg_type in TypeEnum:
+        message = PrismMessage(msg_type=msg_type, sub_msg=sample_factory(PrismMessage, rng))
+        assert message.data_size() == len(message.encode())
+        assert LazyPrismMessage(message.encode()).data_size() == message.data_size()
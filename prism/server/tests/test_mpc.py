@@ -0,0 +1,57 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from types import SimpleNamespace
+
+from prism.common.message import ActionEnum, MPCMap, PrismMessage, TypeEnum
+from prism.common.transport.transport import Package
+from prism.server.CS2.roles.lockfree.dropbox import LockFreeDropbox
+from prism.server.CS2.roles.lockfree.hook import MPCResponseHook
+from prism.server.CS2.roles.lockfree.mpc import MPCRole
+from prism.server.CS2.roles.lockfree.sharing import Sharing
+
+
+def test_action_handlers():
+    assert MPCRole.handler_for(MPCRole, ActionEnum.ACTION_OFFLINE_INIT) is MPCRole.preproduct_op
+    assert ActionEnum.ACTION_STORE_FRAGMENT not in MPCRole.action_handlers
+
+    handlers = LockFreeDropbox.action_handlers
+    assert handlers[ActionEnum.ACTION_STORE_FRAGMENT] is LockFreeDropbox.handle_store_op
+    assert handlers[ActionEnum.ACTION_OFFLINE_INIT] is MPCRole.preproduct_op
+    assert LockFreeDropbox.handler_for(LockFreeDropbox, ActionEnum.ACTION_MODULUS) is None
+
+
+def test_mpc_message_fields():
+    role = SimpleNamespace(party_id=2)
+    message = MPCRole.mpc_message(role, TypeEnum.MPC_REQUEST, ActionEnum.ACTION_STORE, b"op", size=5, nonce=b"n")
+    assert message.party_id == 2 and message.nonce == b"n"
+    assert message.mpc_map.size == 5 and message.mpc_map.request_id == b"op"
+
+
+def test_sharing_cache():
+    role = SimpleNamespace(sharing=Sharing(4, 2, 257), sharings={})
+    high = MPCRole.sharing_for(role, 3)
+    assert (high.nparties, high.threshold, high.modulus) == (4, 3, 257)
+    assert MPCRole.sharing_for(role, 3) is high
+
+
+async def test_surplus_responses_are_not_drops():
+    hook = MPCResponseHook(b"pseudonym", 0, b"op", ActionEnum.ACTION_STORE, expected=2)
+    for party_id in range(4):
+        response = PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, party_id=party_id, dest_party_id=0,
+                                mpc_map=MPCMap(action=ActionEnum.ACTION_STORE, request_id=b"op"))
+        assert hook.match(Package(response, None))
+        await hook.put(Package(response, None))
+
+    stats = hook.stats()
+    assert (stats["queued"], stats["dropped"], stats["surplus"], stats["backlog"]) == (2, 0, 2, 2)
@@ -0,0 +1,59 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import trio
+
+from prism.common.transport.package_tracker import PackageTracker
+
+
+async def test_status_before_wait():
+    tracker = PackageTracker()
+    tracker.attach()
+    tracker.expect(1)
+    tracker.expect(2)
+    # status callbacks arrive on SDK threads, possibly before the sender gets to wait
+    await trio.to_thread.run_sync(tracker.report, 1, True)
+    await trio.to_thread.run_sync(tracker.report, 2, False)
+    await trio.sleep(0)
+
+    assert await tracker.wait(1, 1) is True
+    assert await tracker.wait(2, 1) is False
+    assert not tracker._events and not tracker._results
+
+
+async def test_wait_timeout(autojump_clock):
+    tracker = PackageTracker()
+    tracker.attach()
+    tracker.expect(1)
+
+    start = trio.current_time()
+    assert await tracker.wait(1, 5) is False
+    assert trio.current_time() - start == 5
+
+    # late reports and waits for unknown handles are ignored
+    tracker.report(1, True)
+    await trio.sleep(0)
+    assert not tracker._events and not tracker._results
+    assert await tracker.wait(1, 5) is False
+
+
+async def test_cancelled_waiter_forgets_result():
+    tracker = PackageTracker()
+    tracker.expect(1)
+    tracker.report(1, True)
+
+    with trio.CancelScope() as cancel_scope:
+        cancel_scope.cancel()
+        await tracker.wait(1, 5)
+    assert cancel_scope.cancelled_caught
+    assert not tracker._events and not tracker._results
@@ -0,0 +1,49 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import structlog
+import trio
+
+from prism.common.state import DummyStateStore
+from prism.server.CS2.roles.lockfree.peer import Peer
+from prism.server.CS2.roles.lockfree.preproduct import PreproductStore, PreproductBatch
+
+
+def make_batch(batch_id: bytes, size: int) -> PreproductBatch:
+    return PreproductBatch(batch_id, peers={"peer0"}, owned=True, triples=[None] * size, random_numbers=[None] * size)
+
+
+async def test_claim_wakes_on_new_batch(autojump_clock):
+    store = PreproductStore(structlog.get_logger(), None, DummyStateStore())
+    peers = [Peer(0, "peer0")]
+    claims = []
+
+    async def claim():
+        claims.append((await store.claim_chunk(3, peers), trio.current_time()))
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(claim)
+        await trio.sleep(5)
+        assert not claims
+
+        store.add_batch(make_batch(b"batch", 4))
+        peers[0].preproduct_batches.add(b"batch")
+        store.notify_changed()
+        now = trio.current_time()
+
+    info, claimed_at = claims[0]
+    assert info.sizes == [3] and claimed_at == now
+
+    with trio.move_on_after(5) as cancel_scope:
+        await store.wait_for_shortage(peers, 2, exact=True)
+    assert not cancel_scope.cancelled_caught
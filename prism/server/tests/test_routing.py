@@ -0,0 +1,41 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import random
+
+from networkx import DiGraph, single_source_shortest_path_length
+
+from prism.server.routing.network import ShortestPathTree
+
+
+def test_incremental_shortest_paths():
+    rng = random.Random(42)
+    for _ in range(100):
+        nodes = list(range(rng.randint(2, 15)))
+        tree = ShortestPathTree(0)
+        edges = {}
+        for _ in range(40):
+            source = rng.choice(nodes)
+            targets = set(rng.sample(nodes, rng.randint(0, min(4, len(nodes))))) - {source}
+            edges[source] = targets
+            tree.set_edges(source, targets)
+
+            graph = DiGraph()
+            graph.add_node(0)
+            graph.add_edges_from((src, dst) for src, targets in edges.items() for dst in targets)
+            distances = single_source_shortest_path_length(graph, 0)
+            assert tree.distance == distances
+            assert set(tree.first_hop) == set(distances) - {0}
+            for target, hop in tree.first_hop.items():
+                assert hop in edges[0]
+                assert single_source_shortest_path_length(graph, hop).get(target) == distances[target] - 1
@@ -16,7 +16,8 @@ import random
 import cbor2
 
 from prism.common.crypto.secretsharing import get_ssobj
-from prism.common.crypto.secretsharing.shamir import ShamirSS
+from prism.common.crypto.secretsharing.shamir import ShamirSS, lagrange_coefficients
+from prism.server.CS2.roles.lockfree.sharing import Sharing
 
 modulus = 148642440876230622590087915555384503509593583704323618535892123042919637060567
 
@@ -50,3 +51,39 @@ def test_split_shares():
     reconstructed_bytes = ssobj.reconstruct_bytes(split_shares)
     reconstructed = cbor2.loads(reconstructed_bytes)
     assert reconstructed == data
+
+
+def test_lagrange_coefficients_cached():
+    ssobj = get_ssobj(5, 3, modulus)
+    lagrange_coefficients.cache_clear()
+    secrets = [random.randrange(modulus) for _ in range(20)]
+    share_sets = [ssobj.share(secret)[1:4] for secret in secrets]
+
+    assert [ssobj.reconstruct(shares) for shares in share_sets] == secrets
+    assert ssobj.reconstruct_all(share_sets) == secrets
+    assert lagrange_coefficients.cache_info().misses == 1
+
+
+def test_sharing_vectors():
+    sharing = Sharing(5, 3, modulus)
+    xs = [random.randrange(modulus) for _ in range(10)]
+    ys = [random.randrange(modulus) for _ in range(10)]
+    x_shares = [sharing.share(x) for x in xs]
+    y_shares = [sharing.share(y) for y in ys]
+
+    def party_vectors(shares):
+        return [[share_set[party] for share_set in shares] for party in range(sharing.nparties)]
+
+    x_parties = party_vectors(x_shares)
+    y_parties = party_vectors(y_shares)
+    sums = [sharing.add_all(xp, yp) for xp, yp in zip(x_parties, y_parties)]
+    diffs = [sharing.sub_all(xp, yp) for xp, yp in zip(x_parties, y_parties)]
+    scaled = [sharing.mulc_all(xp, 3) for xp in x_parties]
+
+    assert sharing.open_all(zip(*sums)) == [(x + y) % modulus for x, y in zip(xs, ys)]
+    assert sharing.open_all(zip(*diffs)) == [(x - y) % modulus for x, y in zip(xs, ys)]
+    assert sharing.open_all(zip(*scaled)) == [(x * 3) % modulus for x in xs]
+
+    x_parties[0][0] = sharing.dummy
+    assert sharing.add_all(x_parties[0], y_parties[0])[0].is_dummy
+    assert sharing.open_all([[sharing.dummy] * 5]) == [None]
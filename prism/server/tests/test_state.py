@@ -0,0 +1,120 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import pytest
+
+from prism.common.config.config import load_dict_config
+from prism.common.state import DirectoryStateStore, StateChanges
+
+
+def make_changes(*changes) -> StateChanges:
+    result = StateChanges()
+    for path, value in changes:
+        if value is None:
+            result.delete(path)
+        else:
+            result.set(path, value)
+    return result
+
+
+def test_journal_replay(tmp_path):
+    store = DirectoryStateStore(tmp_path, journal=True)
+    state = {"stored": {"aa": {"x": 1}, "bb": {"x": 2}}, "retrieved": {}, "batch": {"items": [1, 2, 3]}}
+    # nothing to journal on top of yet
+    store.save_changes("fragments", StateChanges(), lambda: state)
+    assert store.load_state("fragments") == state
+
+    expected = {"stored": {"aa": {"x": 4}, "cc": {"x": 3}}, "retrieved": {"bb": True}, "batch": {"items": [1, 0, 3]}}
+    changes = make_changes((("stored", "bb"), None), (("retrieved", "bb"), True))
+    store.save_changes("fragments", changes, lambda: expected)
+    store.save_changes("fragments", make_changes(
+        (("stored", "cc"), {"x": 3}),
+        (("stored", "aa", "x"), 4),
+        (("batch", "items", 1), 0),
+        (("batch", "items", 5), 0),
+    ), lambda: expected)
+
+    assert store.journal_path("fragments").exists()
+    assert DirectoryStateStore(tmp_path, journal=True).load_state("fragments") == expected
+    assert DirectoryStateStore(tmp_path, journal=True).load_state("missing") is None
+
+
+def test_change_order():
+    changes = make_changes((("stored", "aa", "x"), 1), (("stored", "aa"), None))
+    changes.set(("stored", "aa", "x"), 2)
+    assert list(changes) == [("stored", "aa"), ("stored", "aa", "x")]
+
+
+def test_journal_compaction(tmp_path):
+    DirectoryStateStore(tmp_path).save_state("preproduct", {"batches": {"old": 1}})
+
+    store = DirectoryStateStore(tmp_path, journal=True, compact_min_bytes=100)
+    state = store.load_state("preproduct")
+    assert state == {"batches": {"old": 1}}
+    compactions = 0
+    for i in range(20):
+        state["batches"][f"batch{i}"] = i
+        store.save_changes("preproduct", make_changes((("batches", f"batch{i}"), i)), lambda: state)
+        compactions += not store.journal_path("preproduct").read_bytes()
+    assert 0 < compactions < 20
+    assert DirectoryStateStore(tmp_path, journal=True).load_state("preproduct") == state
+
+    # a store that does not journal still replays and then clears the journal
+    del state["batches"]["old"]
+    store.save_changes("preproduct", make_changes((("batches", "old"), None)), lambda: state)
+    store = DirectoryStateStore(tmp_path)
+    assert store.load_state("preproduct") == state
+    store.save_changes("preproduct", StateChanges(), lambda: {"batches": {}})
+    assert not store.journal_path("preproduct").read_bytes()
+    assert DirectoryStateStore(tmp_path, journal=True).load_state("preproduct") == {"batches": {}}
+
+
+class FakeRaceFiles:
+    def __init__(self):
+        self.files = {}
+
+    def makeDir(self, _path):
+        pass
+
+    def readFile(self, path):
+        return self.files.get(path, b"")
+
+    def writeFile(self, path, data):
+        self.files[path] = bytes(data)
+
+    def appendFile(self, path, data):
+        self.files[path] = self.files.get(path, b"") + bytes(data)
+
+
+def test_rib_state_store():
+    rib_state = pytest.importorskip("prism.rib.state")
+    race = FakeRaceFiles()
+    load_dict_config({"state_journal": True})
+    try:
+        store = rib_state.RIBStateStore(race, compact_min_bytes=200)
+        state = {"stored": {}}
+        store.save_state("fragments", state)
+        for i in range(30):
+            state["stored"][str(i)] = i
+            store.save_changes("fragments", make_changes((("stored", str(i)), i)), lambda: state)
+        assert race.files["state/fragments.journal"]
+        assert rib_state.RIBStateStore(race).load_state("fragments") == state
+    finally:
+        load_dict_config({"state_journal": False})
+
+    # without journaling, saves rewrite the state and drop the old journal
+    store = rib_state.RIBStateStore(race)
+    state["stored"]["30"] = 30
+    store.save_changes("fragments", make_changes((("stored", "30"), 30)), lambda: state)
+    assert race.files["state/fragments.journal"] == b""
+    assert rib_state.RIBStateStore(race).load_state("fragments") == state
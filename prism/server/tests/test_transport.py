@@ -0,0 +1,345 @@
+#  Copyright (c) 2019-2023 SRI International.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import math
+from datetime import datetime, timedelta
+
+import cbor2
+import pytest
+import trio
+
+from prism.common.config import configuration
+from prism.common.message import LazyPrismMessage, LinkAddress, MPCMap, PrismMessage, TypeEnum
+from prism.common.transport.enums import ChannelStatus, ConnectionStatus, ConnectionType, LinkDirection, LinkStatus, \
+    LinkType, OverflowPolicy, TransmissionType
+from prism.common.transport.epoch_transport import EpochTransport
+from prism.common.transport.hooks import MessageTypeHook
+from prism.common.transport.transport import Channel, HookIndex, Link, MessageHook, MessagePool, Package, \
+    SendLinkPool, Transport
+
+
+def package(nonce: int) -> Package:
+    return Package(PrismMessage(msg_type=TypeEnum.USER_MESSAGE, nonce=bytes([nonce])), None)
+
+
+async def fill(hook: MessageTypeHook, count: int):
+    for i in range(count):
+        await hook.put(package(i))
+
+
+async def test_hook_drop_newest():
+    hook = MessageTypeHook(None, TypeEnum.USER_MESSAGE, capacity=2, overflow=OverflowPolicy.DROP_NEWEST)
+    await fill(hook, 4)
+    assert (hook.queued, hook.dropped, hook.backlog) == (2, 2, 2)
+    assert (await hook.receive_pkg()).message.nonce == bytes([0])
+    assert (await hook.receive_pkg()).message.nonce == bytes([1])
+    assert hook.stats()["delivered"] == 2
+
+
+async def test_hook_drop_oldest():
+    hook = MessageTypeHook(None, TypeEnum.USER_MESSAGE, capacity=2, overflow=OverflowPolicy.DROP_OLDEST)
+    await fill(hook, 4)
+    assert (hook.queued, hook.dropped, hook.backlog) == (4, 2, 2)
+    assert (await hook.receive_pkg()).message.nonce == bytes([2])
+    assert (await hook.receive_pkg()).message.nonce == bytes([3])
+
+
+async def test_hook_block():
+    hook = MessageTypeHook(None, TypeEnum.USER_MESSAGE, capacity=2)
+    with trio.move_on_after(0.1) as cancel_scope:
+        await fill(hook, 3)
+    assert cancel_scope.cancelled_caught
+    assert (hook.queued, hook.dropped, hook.backlog) == (2, 0, 2)
+
+
+def test_hook_drop_needs_capacity():
+    with pytest.raises(ValueError):
+        MessageTypeHook(None, TypeEnum.USER_MESSAGE, capacity=0, overflow=OverflowPolicy.DROP_NEWEST)
+
+
+def test_message_pool_candidates_and_expiry():
+    pool = MessagePool()
+    start = datetime.utcnow()
+    user = package(1)
+    ark = Package(PrismMessage(msg_type=TypeEnum.ANNOUNCE_ROLE_KEY, nonce=bytes([2])), None)
+    pool.add(user, start + timedelta(seconds=2))
+    pool.add(ark, start + timedelta(seconds=1))
+
+    hook = MessageTypeHook(None, TypeEnum.USER_MESSAGE)
+    assert [p for _, p in pool.candidates(hook)] == [user]
+    hook.dispatch_key = ("nonce", bytes([3]))
+    assert pool.candidates(hook) == []
+
+    assert pool.next_deadline() == start + timedelta(seconds=1)
+    assert pool.expire(start + timedelta(seconds=1)) == 1
+    assert len(pool) == 1
+
+    # re-adding a package moves its deadline
+    pool.add(user, start + timedelta(seconds=5))
+    assert pool.expire(start + timedelta(seconds=3)) == 0
+    assert pool.next_deadline() == start + timedelta(seconds=5)
+    assert pool.pop(user.message.hexdigest()) is user
+    assert pool.next_deadline() is None
+
+
+class KeyedHook(MessageHook):
+    def __init__(self, key_field: str, key_value, *types: TypeEnum):
+        super().__init__()
+        self.dispatch_types = frozenset(types)
+        self.dispatch_key = (key_field, key_value)
+
+    def match(self, package: Package) -> bool:
+        return True
+
+
+def test_hook_index_candidates():
+    index = HookIndex()
+    untyped = MessageHook()
+    user = MessageTypeHook(None, TypeEnum.USER_MESSAGE)
+    both = MessageTypeHook(None, TypeEnum.USER_MESSAGE, TypeEnum.ANNOUNCE_ROLE_KEY)
+    by_pseudonym = MessageTypeHook(b"alice", TypeEnum.USER_MESSAGE)
+    by_nonce = KeyedHook("nonce", bytes([1]), TypeEnum.USER_MESSAGE, TypeEnum.MPC_RESPONSE)
+    by_request = KeyedHook("request_id", b"request", TypeEnum.MPC_RESPONSE)
+    for hook in [by_pseudonym, by_nonce, by_request, both, user, untyped]:
+        index.add(hook)
+    assert len(index) == 6 and len(list(index)) == 6
+
+    message = PrismMessage(msg_type=TypeEnum.USER_MESSAGE, nonce=bytes([1]), pseudonym=b"alice")
+    assert index.candidates(Package(message, None)) == [untyped, both, user, by_pseudonym, by_nonce]
+
+    # keyed hooks are skipped for packages with a different or missing key
+    message = PrismMessage(msg_type=TypeEnum.USER_MESSAGE, nonce=bytes([2]), pseudonym=b"bob")
+    assert index.candidates(Package(message, None)) == [untyped, both, user]
+    response = PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, nonce=bytes([2]), mpc_map=MPCMap(request_id=b"request"))
+    assert index.candidates(Package(response, None)) == [untyped, by_request]
+    response = PrismMessage(msg_type=TypeEnum.MPC_RESPONSE, nonce=bytes([1]))
+    assert index.candidates(Package(response, None)) == [untyped, by_nonce]
+
+
+def test_hook_index_remove():
+    index = HookIndex()
+    both = MessageTypeHook(None, TypeEnum.USER_MESSAGE, TypeEnum.ANNOUNCE_ROLE_KEY)
+    by_nonce = KeyedHook("nonce", bytes([1]), TypeEnum.USER_MESSAGE, TypeEnum.MPC_RESPONSE)
+    untyped = MessageHook()
+    for hook in [both, by_nonce, untyped]:
+        index.add(hook)
+
+    for hook in [both, by_nonce, untyped]:
+        index.remove(hook)
+        index.remove(hook)
+    assert len(index) == 0 and list(index) == []
+    assert not index._keyed and not any(index._key_fields.values()) and not any(index._typed.values())
+    assert index.candidates(package(1)) == []
+
+
+class FakeChannel(Channel):
+    def __init__(self, channel_id: str):
+        super().__init__(channel_id)
+        self.status = ChannelStatus.AVAILABLE
+        self.link_direction = LinkDirection.BIDI
+        self.transmission_type = TransmissionType.UNICAST
+        self.connection_type = ConnectionType.DIRECT
+        self.reliable = True
+        self.mtu = 1000
+        self.bandwidth_bps = 1000
+        self.latency_ms = 10
+        self.loss = 0.0
+        self._links = []
+
+    @property
+    def links(self):
+        return self._links
+
+    def add_link(self, link_id: str, link_address: str) -> Link:
+        link = Link(link_id)
+        link.channel = self
+        link.link_address = link_address
+        link.link_type = LinkType.SEND
+        link.link_status = LinkStatus.LOADED
+        link.connection_status = ConnectionStatus.OPEN
+        self._links.append(link)
+        return link
+
+
+class FakeTransport(Transport):
+    def __init__(self):
+        super().__init__(configuration)
+        self._channels = [FakeChannel("one")]
+
+    @property
+    def channels(self):
+        return self._channels
+
+
+async def test_epoch_transport_views():
+    inner = FakeTransport()
+    transport = EpochTransport(inner, "genesis")
+    channel = transport.channels[0]
+    assert transport.channels[0] is channel
+
+    inner._channels.append(FakeChannel("two"))
+    inner.layout_changed()
+    assert transport.channels[0] is channel
+    assert [ch.channel_id for ch in transport.channels] == ["one", "two"]
+
+    raw_link = inner.channels[0].add_link("link-1", "address-1")
+    inner.layout_changed()
+    link = await channel.load_link("address-1", [], LinkType.SEND, "loader")
+    assert link.inner_link is raw_link
+    assert channel.links == [link]
+    assert transport.channels[1].links == []
+
+    # addresses that change after indexing are still found
+    raw_link.link_address = "address-2"
+    assert (await channel.load_link("address-2", [], LinkType.SEND, "loader")).inner_link is raw_link
+
+    await link.close()
+    assert link not in channel.links
+
+
+async def test_send_link_pool(autojump_clock):
+    pool = SendLinkPool(idle_sec=10)
+    channel = FakeChannel("one")
+    address = LinkAddress(channel_id="one", link_address="address-1")
+    loaded = []
+
+    async def load():
+        link = channel.add_link(f"link-{len(loaded)}", "address-1")
+        loaded.append(link)
+        return link
+
+    first = await pool.acquire(address, load)
+    second = await pool.acquire(address, load)
+    assert first is second and first.users == 2 and len(loaded) == 1
+    await pool.release(address, first, True)
+    await pool.release(address, second, True)
+
+    # a link that can no longer send is replaced
+    loaded[0].connection_status = ConnectionStatus.CLOSED
+    third = await pool.acquire(address, load)
+    assert third.link is loaded[1]
+
+    # a failed send evicts the link
+    await pool.release(address, third, False)
+    assert len(pool) == 0
+
+    fourth = await pool.acquire(address, load)
+    await pool.release(address, fourth, True)
+    await trio.sleep(9)
+    await pool.sweep()
+    assert len(pool) == 1
+    await trio.sleep(1)
+    await pool.sweep()
+    assert len(pool) == 0
+
+    # a link that fails to close is still evicted, and the other links are still closed
+    async def broken_close():
+        raise RuntimeError("close failed")
+
+    other = LinkAddress(channel_id="one", link_address="address-2")
+    fifth = await pool.acquire(address, load)
+    sixth = await pool.acquire(other, load)
+    fifth.link.close = broken_close
+    await pool.release(address, fifth, True)
+    await pool.release(other, sixth, True)
+    await pool.close()
+    assert len(pool) == 0
+
+
+async def test_epoch_send_links_swept_by_inner_transport(autojump_clock):
+    inner = FakeTransport()
+    inner.send_links.idle_sec = 10
+    transport = EpochTransport(inner, "genesis")
+    transport.send_links.idle_sec = 10
+    address = LinkAddress(channel_id="one", link_address="address-1")
+    inner.channels[0].add_link("link-1", "address-1")
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(inner.run)
+        await trio.sleep(1)
+        entry = await transport.send_links.acquire(
+            address,
+            lambda: transport.load_address(address, [], LinkType.SEND),
+        )
+        await transport.send_links.release(address, entry, True)
+        assert len(transport.send_links) == 1
+
+        # the pool is swept every idle_sec / 2, so an idle link lasts at most 1.5 * idle_sec
+        await trio.sleep(15)
+        assert len(transport.send_links) == 0
+        nursery.cancel_scope.cancel()
+
+    await transport.shutdown()
+    assert transport.send_links not in inner.send_link_pools
+
+
+async def test_register_hook_drops_malformed_package():
+    transport = FakeTransport()
+    malformed = {
+        PrismMessage.lookup_field_index("msg_type"): int(TypeEnum.USER_MESSAGE),
+        PrismMessage.lookup_field_index("sub_msg"): "garbage",
+    }
+    await transport.submit_to_hooks(Package(LazyPrismMessage(cbor2.dumps(malformed)), None))
+    await transport.submit_to_hooks(package(1))
+    assert len(transport.message_pool) == 2
+
+    hook = MessageTypeHook(None, TypeEnum.USER_MESSAGE)
+    await transport.register_hook(hook)
+    assert len(transport.message_pool) == 0
+    assert hook.backlog == 1
+    assert (await hook.receive_pkg()).message.nonce == bytes([1])
+
+
+async def test_hook_unbounded_by_default():
+    hook = MessageTypeHook(None, TypeEnum.USER_MESSAGE)
+    with trio.fail_after(1):
+        await fill(hook, 250)
+    assert (hook.capacity, hook.backlog, hook.dropped) == (math.inf, 250, 0)
+
+
+async def test_keyed_hook_ignores_other_keys():
+    transport = FakeTransport()
+    hook = KeyedHook("nonce", bytes([1]), TypeEnum.USER_MESSAGE)
+    await transport.register_hook(hook)
+    await transport.submit_to_hooks(package(2))
+    assert hook.backlog == 0 and len(transport.message_pool) == 1
+
+    await transport.submit_to_hooks(package(1))
+    assert hook.backlog == 1 and len(transport.message_pool) == 1
+
+    transport.remove_hook(hook)
+    assert len(transport.hooks) == 0
+
+
+async def test_malformed_nested_field_is_dropped():
+    def malformed_response() -> Package:
+        fields = {
+            PrismMessage.lookup_field_index("msg_type"): int(TypeEnum.MPC_RESPONSE),
+            PrismMessage.lookup_field_index("mpc_map"): "garbage",
+        }
+        return Package(LazyPrismMessage(cbor2.dumps(fields)), None)
+
+    with pytest.raises(ValueError):
+        _ = malformed_response().message.mpc_map
+
+    # pooled before a keyed hook is registered
+    transport = FakeTransport()
+    await transport.submit_to_hooks(malformed_response())
+    assert len(transport.message_pool) == 1
+    hook = KeyedHook("request_id", b"request", TypeEnum.MPC_RESPONSE)
+    await transport.register_hook(hook)
+    assert len(transport.message_pool) == 0 and hook.backlog == 0
+
+    # arriving while a keyed hook is registered
+    await transport.submit_to_hooks(malformed_response())
+    assert len(transport.message_pool) == 0 and hook.backlog == 0
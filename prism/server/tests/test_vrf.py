@@ -161,3 +161,24 @@ def test_sortition():
     else:
         r2 = 'a'
     assert sortition.verify(proof, r2) is False
+
+
+def test_RSASP1_crt():
+    key = VRF_keyGen()
+    numbers = key.private_numbers()
+    n = numbers.public_numbers.n
+    for _ in range(5):
+        m = random.randint(0, n - 1)
+        assert RSASP1(key, m) == pow(m, numbers.d, n)
+
+
+def test_sortition_rejects_bad_proof():
+    key = VRF_keyGen()
+    sortition = VRFSortition(VRFDistribution({'a': .5, 'b': .5}))
+    alpha = i2bytes(random.randint(0, 2 ** 256 - 1), 2048)
+    r, proof = sortition.sort_and_prove(key, alpha)
+
+    forged = serialize_proof(key.public_key(), alpha + b'!', VRF_prove(key, alpha))
+    assert sortition.verify(proof, r) is True
+    assert sortition.verify(forged, 'a') is False
+    assert sortition.verify(forged, 'b') is False
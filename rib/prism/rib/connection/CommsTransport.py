@@ -24,7 +24,7 @@ from jaeger_client import SpanContext
 from jaeger_client.constants import SAMPLED_FLAG
 
 from prism.common.deduplicate import MessageDeduplicator
-from prism.common.message import PrismMessage
+from prism.common.message import LazyPrismMessage
 from prism.common.replay import Replay
 from prism.common.tracing import trace_context
 from prism.common.transport.enums import ChannelStatus, ConnectionType, LinkStatus, ConnectionStatus
@@ -135,6 +135,7 @@ class CommsTransport(Transport):
 
     async def run(self):
         logDebug(f"Start running CommsTransport...")
+        self.state.packages.attach()
         async with trio.open_nursery() as nursery:
             nursery.start_soon(super().run)
             nursery.start_soon(self.package_task, nursery)
@@ -157,6 +158,9 @@ class CommsTransport(Transport):
                 await self.submit_to_hooks(package)
             except Empty:
                 pass
+            except (ValueError, TypeError) as e:
+                # fields of lazily decoded messages are only checked once hooks look at them
+                logError(f"Error decoding prism message: {e}")
             await trio.sleep(0.01)
 
     async def reconnect_task(self):
@@ -208,6 +212,7 @@ class CommsTransport(Transport):
         logDebug(f"Discovered channel {channel_properties.channelGid}")
         channel = CommsChannel(self.race, self.state, channel_properties)
         self._channels[channel.channel_id] = channel
+        self.layout_changed()
         return channel
 
     def ensure_channel(self, channel_gid: str) -> Optional[CommsChannel]:
@@ -241,6 +246,7 @@ class CommsTransport(Transport):
 
         channel.add_link(link)
         self.links[link_id] = link
+        self.layout_changed()
         if handle:
             self.state.handle_links[handle] = link
 
@@ -281,7 +287,7 @@ class CommsTransport(Transport):
 
         try:
             data = self.state.checksum.package_data(pkg)
-            message = PrismMessage.decode(data)
+            message = LazyPrismMessage(data)
             if self.configuration.transport_ignore_old and \
                     message.transport_timestamp is not None and \
                     message.transport_timestamp < self.start_timestamp:
@@ -342,13 +348,13 @@ class CommsTransport(Transport):
 
     def onPackageStatusChanged(self, handle, status):
         if status == PACKAGE_SENT or status == PACKAGE_RECEIVED:
-            self.state.successful_packages.add(handle)
+            self.state.packages.report(handle, True)
         elif (
             status == PACKAGE_FAILED_GENERIC
             or status == PACKAGE_FAILED_NETWORK_ERROR
             or status == PACKAGE_FAILED_TIMEOUT
         ):
-            self.state.failed_packages.add(handle)
+            self.state.packages.report(handle, False)
             logWarning(f"Package {handle} failed.")
         elif status == PACKAGE_INVALID:
             logWarning(f"Package {handle} invalid.")
@@ -111,6 +111,7 @@ class CommsLink(Link):
             return False
 
         handle = response.handle
+        self.transport_state.packages.expect(handle)
         if self.endpoints:
             receiver = self.endpoints[0]
         else:
@@ -118,20 +119,11 @@ class CommsLink(Link):
         self.channel.replay.log(receiver, self, bytes(pkg.getCipherText()), pkg.getTraceId(), handle)
 
         # TODO - remove trio timeout if SDK timeout is reliable
-        with trio.move_on_after(timeout_ms / 1000):
-            while True:
-                if handle in self.transport_state.successful_packages:
-                    self.last_send = datetime.utcnow()
-                    self.pending_sends -= 1
-                    return True
-                if handle in self.transport_state.failed_packages:
-                    self.pending_sends -= 1
-                    return False
-                await trio.sleep(0.05)
-
-        # noinspection PyUnreachableCode
+        success = await self.transport_state.packages.wait(handle, timeout_ms / 1000)
         self.pending_sends -= 1
-        return False
+        if success:
+            self.last_send = datetime.utcnow()
+        return success
 
     def update_properties(self, properties):
         self.properties = properties
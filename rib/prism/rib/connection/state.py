@@ -12,18 +12,18 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 from dataclasses import dataclass, field
-from typing import Set, Dict
+from typing import Dict
 
 from prism.rib.common import CHECKSUM_BYTES
 from prism.rib.connection.checksum import Checksum
 from prism.common.replay import Replay
+from prism.common.transport.package_tracker import PackageTracker
 from prism.common.transport.transport import Link
 
 
 @dataclass
 class TransportState:
     replay: Replay
-    successful_packages: Set[str] = field(default_factory=set)
-    failed_packages: Set[str] = field(default_factory=set)
+    packages: PackageTracker = field(default_factory=PackageTracker)
     handle_links: Dict[int, Link] = field(default_factory=dict)
     checksum: Checksum = field(default=Checksum(CHECKSUM_BYTES))
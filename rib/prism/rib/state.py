@@ -12,36 +12,60 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import json
-from typing import Optional
+from typing import Any, Callable, Dict, Optional
 
 from prism.common.config import configuration
 from prism.rib.Log import logDebug
 from networkManagerPluginBindings import IRaceSdkNM
 
-from prism.common.state import StateStore
+from prism.common.state import FileStateStore, StatePath
 
 CACHE_PREFIX = "cache"
 STATE_PREFIX = "state"
 
 
-class RIBStateStore(StateStore):
-    def __init__(self, race: IRaceSdkNM):
+class RIBStateStore(FileStateStore):
+    """Saves states through the RACE SDK's file API, journaling changes if configuration.state_journal is set."""
+
+    def __init__(self, race: IRaceSdkNM, compact_min_bytes: int = 64 * 1024):
+        super().__init__(compact_min_bytes)
         self.race = race
         self.race.makeDir(STATE_PREFIX)
 
+    @property
+    def journaling(self) -> bool:
+        return bool(configuration.get("state_journal"))
+
     def save_path(self, name: str) -> str:
         return f"{STATE_PREFIX}/{name}.json"
 
+    def journal_path(self, name: str) -> str:
+        return f"{STATE_PREFIX}/{name}.journal"
+
     def cache_path(self, name: str) -> str:
         return f"{CACHE_PREFIX}/{name}.json"
 
+    def read_file(self, path: str) -> Optional[bytes]:
+        data = self.race.readFile(path)
+        return bytes(data) if data else None
+
+    def write_file(self, path: str, data: bytes):
+        self.race.writeFile(path, data)
+
+    def append_file(self, path: str, data: bytes):
+        self.race.appendFile(path, data)
+
     def save_state(self, name: str, state: dict):
         if not configuration.get("save_state"):
             return
 
-        state_text = json.dumps(state)
-        state_bytes = state_text.encode("utf-8")
-        self.race.writeFile(self.save_path(name), state_bytes)
+        super().save_state(name, state)
+
+    def save_changes(self, name: str, changes: Dict[StatePath, Any], state: Callable[[], dict]):
+        if not configuration.get("save_state"):
+            return
+
+        super().save_changes(name, changes, state)
 
     def json_from_file(self, path: str) -> Optional[dict]:
         logDebug(f"Attempting to load read from {path}")
@@ -62,8 +86,7 @@ class RIBStateStore(StateStore):
             logDebug("Ignoring request to load state due to configuration.ignore_state")
             return None
         logDebug(f"Attempting to load state {name}")
-        path = self.save_path(name)
-        saved = self.json_from_file(path)
+        saved = super().load_state(name)
         if saved:
             logDebug("Found saved state")
             return saved